@@ -8,23 +8,37 @@
 #############################
 
 import math
+import numpy
 from planet import Planet
 import reporting
+import keplerSolver
 
 #############################
 # Options and default values for module
 #############################
 
+# Increase when a change to these calculations changes their results, so
+#   trajectories saved by trajectoryCache are calculated again
+engineVersion = 2
+
 # Accuracy for eccentric anomoly calculations
 #
 accuracy = .000000001
 
+# The most iterations used for a single eccentric anomaly
+maxIterations = 50
+
 # Method for calculating Eccentric Anomaly
 #   Values: 0 => eccAnomApprox
 #           1 => eccAnomIter1
 #           2 => eccAnomIter2
+#           3 => eccAnomHalley
+#   Set by -km or --kepler in orbital_drift.py
 methodForEccen = 1
 
+# Julian date of day number 0, 1999-12-31 at 0h. See convertToday
+epochJD = 2451543.5
+
 # If 1, track time for calculation
 time = 0
 
@@ -68,16 +82,212 @@ def setTestMoon(planet, d):
 def runSchlyterCalc(planet, date, options):
     timer = reporting.startTimer()
     time = convertToday(date)
+    calculatePosition(planet, time)
+    planet.addCalculationTime("Sch", reporting.endTimer(timer))
+
+
+###############################
+# calculatePosition
+###############################
+# Performs the calculations for a single day number and appends the
+#   resulting point to the planet's "Sch" trajectory. The day number may be
+#   fractional.
+#
+# INPUT:
+#   planet - planet object to be used
+#   time - float, day number as returned by convertToday
+def calculatePosition(planet, time):
     calculateElements(planet, time)
-    eccAnomIter1(planet)
+    calculateEccenAnom(planet)
     calculateXYAnomaly(planet)
     calculatePlanetDistance1(planet)
     calculateAnomaly(planet)
-    calculateHelioXYZ(planet)
-    try:
-        planet.SchlyterTime += reporting.endTimer(timer)
-    except AttributeError:
-        planet.SchlyterTime = reporting.endTimer(timer)
+    x, y, z = calculateHelioXYZ(planet)
+    planet.getTrajectory("Sch").append(epochJD + time, x, y, z)
+
+
+###############################
+# runSchlyterCalcBatch
+###############################
+# Performs the same calculations as runSchlyterCalc for a whole array of day
+#   numbers at once. The planet is not changed; its elements must have been
+#   set with setElementsDict and setSchlyterTerms.
+#
+# INPUT:
+#   planet - planet object to be used
+#   days - array of day numbers, as returned by convertToday. The day
+#       numbers may be fractional
+#   velocity - boolean, if True, the velocities are also returned (see
+#       calculateHelioVelocityBatch)
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z). If velocity is True,
+#       (X, Y, Z, VX, VY, VZ) with the velocities in AU/day
+def runSchlyterCalcBatch(planet, days, velocity=False):
+    days = numpy.asarray(days, dtype=float)
+    elements = calculateElementsBatch(planet, days)
+
+    eccen = elements['eccen']
+    eccenAnom = keplerSolver.solve(elements['meanAnom'], eccen,
+                                   methodForEccen, accuracy, maxIterations)
+
+    # x and y anomaly, as in calculateXYAnomaly
+    xAnom = elements['semiMajAx'] * (numpy.cos(eccenAnom) - eccen)
+    yAnom = numpy.sqrt(1.0 - eccen * eccen) * numpy.sin(eccenAnom)
+    yAnom = elements['semiMajAx'] * yAnom
+
+    # Distance and true anomaly
+    distance = numpy.sqrt(xAnom * xAnom + yAnom * yAnom)
+    anom = numpy.arctan2(yAnom, xAnom)
+
+    points = calculateHelioXYZBatch(elements, anom, distance)
+    if velocity:
+        points += calculateHelioVelocityBatch(
+            elements, calculateElementRates(planet), eccenAnom, xAnom,
+            yAnom)
+    return points
+
+
+###############################
+# SchlyterPropagator
+###############################
+# Calculates the points of a planet at evenly spaced day numbers, a block of
+#   points at a time. Each eccentric anomaly is found with Newton's method,
+#   starting from the last eccentric anomaly of the block before, advanced
+#   to the point by a second order Taylor series in the mean anomaly. A
+#   block is kept short enough that the mean anomaly moves by at most
+#   blockAngle over it, so Newton's method usually converges in two or
+#   three iterations, where the solvers of keplerSolver take four or more.
+#   Planets with a short period need many short blocks, so this is still
+#   slower than runSchlyterCalcBatch.
+#
+# The results are the same as runSchlyterCalc, to within the accuracy.
+class SchlyterPropagator:
+
+    ########
+    # Values of SchlyterPropagator class
+    ########
+    #
+    # planet -> planet object, whose elements are used
+    # start -> float, day number of the first point
+    # step -> float, days between points
+    # count -> int, number of points calculated
+    # blockPoints -> int, most points calculated at once
+    # eccenAnom -> float, eccentric anomaly of the last point, or None
+    # meanAnom -> float, mean anomaly of the last point
+    # eccen -> float, eccentricity of the last point
+
+    # Largest change in the mean anomaly over a block, in radians
+    blockAngle = 2.0
+
+    ################
+    # __init__
+    ################
+    # INPUT:
+    #   planet - planet object. Its elements must have been set with
+    #       setElementsDict and setSchlyterTerms
+    #   start - float, day number of the first point
+    #   step - float, days between points
+    def __init__(self, planet, start, step=1.0):
+        self.planet = planet
+        self.start = start
+        self.step = step
+        self.count = 0
+        self.eccenAnom = None
+        self.meanAnom = None
+        self.eccen = None
+
+        # Change in the mean anomaly over one step
+        change = abs(math.radians(
+            planet.elements['meanAnom']['coefficient']) * step)
+        self.blockPoints = int(self.blockAngle / change) if change else 1
+        self.blockPoints = max(1, self.blockPoints)
+
+    ################
+    # day
+    ################
+    # Returns the day number of the next point
+    def day(self):
+        return self.start + self.count * self.step
+
+    ################
+    # next
+    ################
+    # Calculates the next block of points
+    #
+    # INPUT:
+    #   numPoints - int, number of points, at most blockPoints
+    # OUTPUT:
+    #   tuple (X, Y, Z, iterations), arrays of the points and of the number
+    #       of iterations used for each eccentric anomaly
+    def next(self, numPoints):
+        days = self.day() + self.step * numpy.arange(numPoints)
+        elements = calculateElementsBatch(self.planet, days)
+        meanAnom = elements['meanAnom']
+        eccen = elements['eccen']
+        iterations = numpy.zeros(numPoints, dtype=int)
+        active = numpy.arange(numPoints)
+
+        # The very first point is solved for, and counted by the solver
+        if self.eccenAnom is None:
+            self.eccenAnom = keplerSolver.solve(
+                meanAnom[0], eccen[0], methodForEccen, accuracy,
+                maxIterations)
+            self.meanAnom = meanAnom[0]
+            self.eccen = eccen[0]
+            active = active[1:]
+
+        # dE/dM and d2E/dM2 at the last point, from M = E - e * sin(E)
+        denominator = 1 - self.eccen * math.cos(self.eccenAnom)
+        slope = 1 / denominator
+        curve = -self.eccen * math.sin(self.eccenAnom) * slope ** 3
+        change = meanAnom - self.meanAnom
+        E = self.eccenAnom + slope * change + curve * change * change / 2
+
+        # Newton's method, until each correction is within the accuracy
+        while len(active):
+            e = eccen[active]
+            Ea = E[active]
+            correction = (meanAnom[active] + e * numpy.sin(Ea) - Ea) / (
+                1 - e * numpy.cos(Ea))
+            E[active] = Ea + correction
+            iterations[active] += 1
+            active = active[(numpy.abs(correction) > accuracy) &
+                            (iterations[active] < maxIterations)]
+
+        self.eccenAnom = E[-1]
+        self.meanAnom = meanAnom[-1]
+        self.eccen = eccen[-1]
+        self.count += numPoints
+
+        # Same as runSchlyterCalcBatch
+        xAnom = elements['semiMajAx'] * (numpy.cos(E) - eccen)
+        yAnom = numpy.sqrt(1.0 - eccen * eccen) * numpy.sin(E)
+        yAnom = elements['semiMajAx'] * yAnom
+        distance = numpy.sqrt(xAnom * xAnom + yAnom * yAnom)
+        anom = numpy.arctan2(yAnom, xAnom)
+        X, Y, Z = calculateHelioXYZBatch(elements, anom, distance)
+        return (X, Y, Z, iterations)
+
+    ################
+    # propagate
+    ################
+    # Calculates the given number of points, and adds the iterations used to
+    #   keplerSolver.statistics
+    #
+    # INPUT:
+    #   numPoints - int, number of points to calculate
+    # OUTPUT:
+    #   tuple of numpy arrays (X, Y, Z)
+    def propagate(self, numPoints):
+        points = numpy.empty((3, numPoints))
+        iterations = numpy.empty(numPoints, dtype=int)
+        for first in range(0, numPoints, self.blockPoints):
+            last = min(numPoints, first + self.blockPoints)
+            X, Y, Z, iterations[first:last] = self.next(last - first)
+            points[:, first:last] = (X, Y, Z)
+        keplerSolver.recordIterations(
+            iterations, int((iterations >= maxIterations).sum()))
+        return (points[0], points[1], points[2])
 
 
 def calculateElements(planet, time):
@@ -86,15 +296,57 @@ def calculateElements(planet, time):
         value = value + planet.elements[key]['constant']
         if planet.elements[key]['units'] == 'Rad':
             value = math.radians(value)
-        planet.__dict__[key] = value
+        setattr(planet, key, value)
+
+
+################
+# calculateElementsBatch
+################
+# The array equivalent of calculateElements. The elements are returned
+#   instead of being set on the planet, and each element's units are only
+#   checked once.
+#
+# INPUT:
+#   planet - planet object to use
+#   days - numpy array of day numbers
+# OUTPUT:
+#   dict, maps each element (i.e. 'meanAnom') to an array of values
+def calculateElementsBatch(planet, days):
+    elements = {}
+    for key in planet.elements:
+        coefficient = planet.elements[key]['coefficient']
+        constant = planet.elements[key]['constant']
+        if planet.elements[key]['units'] == 'Rad':
+            coefficient = math.radians(coefficient)
+            constant = math.radians(constant)
+        elements[key] = coefficient * days + constant
+    return elements
+
+
+################
+# calculateElementRates
+################
+# Returns the change of each element per day, in radians for angles
+#
+# INPUT:
+#   planet - planet object to use
+# OUTPUT:
+#   dict, maps each element (i.e. 'meanAnom') to its rate
+def calculateElementRates(planet):
+    rates = {}
+    for key in planet.elements:
+        rates[key] = planet.elements[key]['coefficient']
+        if planet.elements[key]['units'] == 'Rad':
+            rates[key] = math.radians(rates[key])
+    return rates
 
 
 ################
 # calculateHelioXYZ
 ################
 # The final function in the runSchlyterCalc. Calculates the 3-dimensional
-#   heliocentric coordinates of the planet and appends them to the planets
-#   orbit array
+#   heliocentric coordinates of the planet and returns them as a tuple
+#   (x, y, z)
 #
 #   NOTE: May want to change output to make it possible to calculate geocentric
 #
@@ -118,9 +370,108 @@ def calculateHelioXYZ(p):
     z = math.sin(p.anom + p.argPerih) * math.cos(p.incElip)
     z = z * p.semiMajAx
 
-    p.orbitXSchlyter.append(x)
-    p.orbitYSchlyter.append(y)
-    p.orbitZSchlyter.append(z)
+    return (x, y, z)
+
+
+################
+# calculateHelioXYZBatch
+################
+# The array equivalent of calculateHelioXYZ. The points are returned instead
+#   of being appended to the planet.
+#
+# INPUT:
+#   elements - dict, as returned by calculateElementsBatch
+#   anom - numpy array, true anomaly
+#   distance - numpy array, distance from the sun
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z)
+def calculateHelioXYZBatch(elements, anom, distance):
+    node = elements['longAscNode']
+    angle = anom + elements['argPerih']
+    cosInc = numpy.cos(elements['incElip'])
+    sinAngle = numpy.sin(angle)
+    cosAngle = numpy.cos(angle)
+
+    x = numpy.sin(node) * sinAngle * cosInc
+    x = (numpy.cos(node) * cosAngle - x) * distance
+
+    y = numpy.cos(node) * sinAngle * cosInc
+    y = (numpy.sin(node) * cosAngle + y) * distance
+
+    z = sinAngle * cosInc * distance
+
+    return (x, y, z)
+
+
+################
+# calculateHelioVelocityBatch
+################
+# Calculates the velocity of the points given by calculateHelioXYZBatch, by
+#   differentiating each step of the calculation with respect to the day
+#   number. Every element changes linearly, so its derivative is its rate.
+#
+# E' = (M' + e' * sin(E)) / (1 - e * cos(E))
+# xv' = a' * (cos(E) - e) - a * (sin(E) * E' + e')
+# yv' = (a' * sin(E) + a * cos(E) * E') * sqrt(1 - e*e)
+#       - a * sin(E) * e * e' / sqrt(1 - e*e)
+# r' = (xv * xv' + yv * yv') / r
+# v' = (xv * yv' - yv * xv') / (r * r)
+#
+# INPUT:
+#   elements - dict, as returned by calculateElementsBatch
+#   rates - dict, as returned by calculateElementRates
+#   eccenAnom - numpy array, eccentric anomaly
+#   xAnom - numpy array, x anomaly
+#   yAnom - numpy array, y anomaly
+# OUTPUT:
+#   tuple of numpy arrays (VX, VY, VZ), in AU/day
+def calculateHelioVelocityBatch(elements, rates, eccenAnom, xAnom, yAnom):
+    a = elements['semiMajAx']
+    e = elements['eccen']
+    cosE = numpy.cos(eccenAnom)
+    sinE = numpy.sin(eccenAnom)
+    root = numpy.sqrt(1.0 - e * e)
+
+    rateE = (rates['meanAnom'] + rates['eccen'] * sinE) / (1 - e * cosE)
+    rateX = rates['semiMajAx'] * (cosE - e) - a * (sinE * rateE +
+                                                   rates['eccen'])
+    rateY = (rates['semiMajAx'] * sinE + a * cosE * rateE) * root
+    rateY -= a * sinE * e * rates['eccen'] / root
+
+    distance2 = xAnom * xAnom + yAnom * yAnom
+    distance = numpy.sqrt(distance2)
+    rateDistance = (xAnom * rateX + yAnom * rateY) / distance
+    rateAnom = (xAnom * rateY - yAnom * rateX) / distance2
+
+    # Differentiate calculateHelioXYZBatch, with u = v + w
+    node = elements['longAscNode']
+    angle = numpy.arctan2(yAnom, xAnom) + elements['argPerih']
+    rateAngle = rateAnom + rates['argPerih']
+    rateNode = rates['longAscNode']
+    cosNode = numpy.cos(node)
+    sinNode = numpy.sin(node)
+    cosAngle = numpy.cos(angle)
+    sinAngle = numpy.sin(angle)
+    cosInc = numpy.cos(elements['incElip'])
+    rateCosInc = -numpy.sin(elements['incElip']) * rates['incElip']
+
+    # Unit vector of each point, and its rate of change
+    x = cosNode * cosAngle - sinNode * sinAngle * cosInc
+    y = sinNode * cosAngle + cosNode * sinAngle * cosInc
+    z = sinAngle * cosInc
+    rateUnitX = (-sinNode * cosAngle * rateNode - cosNode * sinAngle *
+                 rateAngle - cosNode * sinAngle * cosInc * rateNode -
+                 sinNode * cosAngle * cosInc * rateAngle -
+                 sinNode * sinAngle * rateCosInc)
+    rateUnitY = (cosNode * cosAngle * rateNode - sinNode * sinAngle *
+                 rateAngle - sinNode * sinAngle * cosInc * rateNode +
+                 cosNode * cosAngle * cosInc * rateAngle +
+                 cosNode * sinAngle * rateCosInc)
+    rateUnitZ = cosAngle * cosInc * rateAngle + sinAngle * rateCosInc
+
+    return (rateDistance * x + distance * rateUnitX,
+            rateDistance * y + distance * rateUnitY,
+            rateDistance * z + distance * rateUnitZ)
 
 
 ################
@@ -169,6 +520,25 @@ def calculatePlanetDistance1(p):
     p.semiMajAx = math.sqrt(p.xAnom*p.xAnom+p.yAnom*p.yAnom)
 
 
+################
+# calculateEccenAnom
+################
+# Calculates the eccentric anomaly using the function chosen by
+#   methodForEccen
+#
+# INPUT:
+#   p - planet object to use
+def calculateEccenAnom(p):
+    if methodForEccen == 0:
+        eccAnomApprox(p)
+    elif methodForEccen == 2:
+        eccAnomIter2(p)
+    elif methodForEccen == 3:
+        eccAnomHalley(p)
+    else:
+        eccAnomIter1(p)
+
+
 ################
 # eccAnomIter1
 ################
@@ -182,15 +552,9 @@ def calculatePlanetDistance1(p):
 # where E is Eccentric anomaly, M is the mean anomaly in radians,
 #   and e is the eccentricity in radians
 def eccAnomIter1(planet):
-    E0 = planet.meanAnom
-    # Calculate first E1
-    E1 = planet.meanAnom + planet.eccen * math.sin(E0)
-
-    # NOTE: ADD ACCURACY OPTION HERE
-    while (E1 - E0 > .000000001) or (E1 - E0 < -.000000001):
-        E0 = E1
-        E1 = planet.meanAnom + planet.eccen * math.sin(E0)
-    planet.eccenAnom = E1
+    planet.eccenAnom = keplerSolver.solve(
+        planet.meanAnom, planet.eccen, keplerSolver.FIXED_POINT, accuracy,
+        maxIterations)
 
 
 ################
@@ -202,31 +566,37 @@ def eccAnomIter1(planet):
 # E1 = E0 + (M + e * sin(E0) - E0)/(1 - e*cos(E0))
 # where E is Eccentric anomaly, M is the mean anomaly in degrees,
 #   and e is the eccentricity in degrees
+#
+# Each correction is limited to 0.5 using the trick devised by John M. Steele
 def eccAnomIter2(planet):
-    E0 = planet.meanAnom  # E0 starts out equal to mean Anomoly
-
-    # Calculate first E1
-    E1 = planet.meanAnom + planet.eccen * math.sin(E0) - E0
-    E1 = E1 / (1 - planet.eccen * math.cos(E0))
-    E1 = E0 + E1
-
-    # Calculate progessively more accurate eccenAnom
-    # NOTE: ADD ACCURACY OPTION HERE
-    while (E1 - E0 > .000000001) or (E1 - E0 < -.000000001):
-        E0 = E1
-        E1 = planet.meanAnom + planet.eccen * math.sin(E0) - E0
-        E1 = E1 / (1 - planet.eccen * math.cos(E0))
-        # Adjust using trick devised by John M. Steele
-        if E1 > .5:
-            E1 = .5
-        if E1 < -.5:
-            E1 = -.5
-        E1 = E0 + E1
-    planet.eccenAnom = E1
+    planet.eccenAnom = keplerSolver.solve(
+        planet.meanAnom, planet.eccen, keplerSolver.NEWTON, accuracy,
+        maxIterations)
+
+
+################
+# eccAnomHalley
+################
+# Calculates the eccentric anomaly using Halley's method, starting from the
+#   guess E0 = M + 0.85 * e * sign(sin(M)) given by Danby. Converges in
+#   fewer iterations than the above for high eccentricities.
+def eccAnomHalley(planet):
+    planet.eccenAnom = keplerSolver.solve(
+        planet.meanAnom, planet.eccen, keplerSolver.HALLEY, accuracy,
+        maxIterations)
 
 
+################
+# eccAnomApprox
+################
+# Calculates the eccentric anomaly by interpolating in a table of solutions
+#   that is built once, followed by a single Newton step. Much faster than
+#   the iterative methods when many points are calculated, see
+#   keplerSolver.approximate
 def eccAnomApprox(planet):
-    blank
+    planet.eccenAnom = keplerSolver.solve(
+        planet.meanAnom, planet.eccen, keplerSolver.APPROX, accuracy,
+        maxIterations)
 
 
 ################
@@ -237,11 +607,16 @@ def eccAnomApprox(planet):
 #   is specific to the calculation method found at
 #   http://stjarnhimlen.se/comp/ppcomp.html
 #
+# The time of day is added as a fraction of a day. The formula ignores the
+#   century leap years, so it is only valid from March 1900 to February 2100.
+#   timeGrid.TimeGrid.dayNumbers converts whole grids of any dates.
+#
 def convertToday(date):
     d = 367 * date.year
-    d -= (7 * (date.year + ((date.month + 9) / 12))) / 4
-    d += (275 * date.month) / 9
+    d -= (7 * (date.year + ((date.month + 9) // 12))) // 4
+    d += (275 * date.month) // 9
     d += date.day
     d -= 730530
+    d += (date.hour + (date.minute + date.second / 60.0) / 60.0) / 24.0
 
     return d
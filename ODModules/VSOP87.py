@@ -13,26 +13,61 @@
 
 import math as Math
 from datetime import datetime, timedelta
+import numpy
 import reporting
 
+# Version of the results of this module. Increase it when a change affects
+#   the calculated points, so saved trajectories are not reused
+#   (see trajectoryCache)
+engineVersion = 1
+
+# Coefficient tables for each planet that has been calculated, keyed by the
+#   planet's id. Filled by loadCoefficients.
+coefficientTables = {}
+
+# Target accuracy, in AU, used to truncate the series. Terms too small to
+#   affect a coordinate by more than this are dropped. 0 uses every term.
+#   Set by -ta or --truncate in orbital_drift.py
+truncation = 0
+
+# Truncated coefficient tables, keyed by (planet id, accuracy). Filled by
+#   truncateCoefficients.
+truncatedTables = {}
+
+# Concatenated coefficient tables of several planets, keyed by (tuple of
+#   planet ids, accuracy). Filled by loadFusedCoefficients.
+fusedTables = {}
+
+# Number of steps runVSOP87Uniform advances each term by rotation before
+#   calculating its angle directly again
+reanchorSteps = 256
+
+# The largest number of term/time pairs evaluated at once by
+#   runVSOP87Batch. Longer date ranges are split into blocks of times so the
+#   intermediate terms x times matrix stays small.
+batchSize = 1000000
+
+# Number of times runVSOP87Fused evaluates at once. Every term of every
+#   planet is evaluated for each time in a block
+fusedPoints = 16
+
 
 ###############################
 # runVSOP87
 ###############################
 # Calls the functions needed to run the VSOP87
 #   method
-def runVSOP87(planet, date, db):
+#
+# If velocity is True, the velocity of the planet in AU/day is also
+#   returned as a tuple (vx, vy, vz). It reuses the angles of the position
+#   terms (see calculateTerm).
+def runVSOP87(planet, date, db, velocity=False):
     # Start timer and pull planet info from DB
     timer = reporting.startTimer()
-    data = (planet.id,)
 
     # Retrieve all the terms for the given planet (Not all planets have all
-    #   five terms)
-    db.execute('''
-        SELECT DISTINCT term FROM vsop87terms WHERE planet_id = ?
-    ''', data)
-
-    terms = db.fetchall()
+    #   five terms). The terms are only read from the DB on the first call.
+    table = loadCoefficients(planet.id, db, truncation)
 
     # All term values start at zero, and will be replaced if the planet has
     #   that term
@@ -40,6 +75,7 @@ def runVSOP87(planet, date, db):
         'X0': 0, 'X1': 0, 'X2': 0, 'X3': 0, 'X4': 0, 'X5': 0,
         'Y0': 0, 'Y1': 0, 'Y2': 0, 'Y3': 0, 'Y4': 0, 'Y5': 0,
         'Z0': 0, 'Z1': 0, 'Z2': 0, 'Z3': 0, 'Z4': 0, 'Z5': 0}
+    termRates = {}
 
     # Convert the standard date to its JDN equivalent
     JDN = calculateJDN(date)
@@ -47,17 +83,292 @@ def runVSOP87(planet, date, db):
     # Using JDN, calculate the Julian Millenia
     time = calculateJMillenia(JDN)
     # Calculate the term
-    for term in terms:
-        termValues[term[0]] = calculateTerm(planet, term[0], time, db)
-
-    # Calculate the final value for each value
-    calculateXYZTerms(planet, termValues, time)
+    for term in table:
+        if velocity:
+            termValues[term], termRates[term] = calculateTerm(
+                table[term], time, True)
+        else:
+            termValues[term] = calculateTerm(table[term], time)
+
+    # Calculate the final value for each value, and add the point to the
+    #   planet's trajectory
+    x, y, z = calculateXYZTerms(termValues, time)
+    if velocity:
+        rates = calculateXYZRatesBatch(termValues, termRates, time)
+    planet.getTrajectory("VSO").append(JDN, x, y, z)
 
     # Add this run's time to the total time
-    try:
-        planet.VSOPTime += reporting.endTimer(timer)
-    except AttributeError:
-        planet.VSOPTime = reporting.endTimer(timer)  # Create attribute
+    planet.addCalculationTime("VSO", reporting.endTimer(timer))
+
+    if velocity:
+        return tuple(float(rate) for rate in rates)
+
+
+###############################
+# loadCoefficients
+###############################
+# Retrieves every VSOP87 term for a planet with a single query and keeps them
+#   in coefficientTables, so the database is only read the first time a
+#   planet is calculated in this process.
+#
+# INPUT:
+#   planetID - int, id of the planet to load
+#   db - database cursor
+#   accuracy - float, AU. If set, the truncated table for this accuracy is
+#       returned instead (see truncateCoefficients)
+# OUTPUT:
+#   dict, maps each term (i.e. 'X0') to a tuple of numpy arrays (A, B, C)
+def loadCoefficients(planetID, db, accuracy=0):
+    if accuracy:
+        return truncateCoefficients(planetID, db, accuracy)
+    if planetID in coefficientTables:
+        return coefficientTables[planetID]
+
+    data = (planetID,)
+    db.execute('''
+        SELECT term, A, B, C FROM vsop87terms WHERE planet_id = ?
+            ORDER BY id
+    ''', data)
+
+    table = {}
+    for row in db.fetchall():
+        if row[0] not in table:
+            table[row[0]] = ([], [], [])
+        table[row[0]][0].append(row[1])
+        table[row[0]][1].append(row[2])
+        table[row[0]][2].append(row[3])
+
+    for term in table:
+        table[term] = tuple(numpy.array(values) for values in table[term])
+
+    coefficientTables[planetID] = table
+    return table
+
+
+###############################
+# truncateCoefficients
+###############################
+# Creates a copy of a planet's coefficient table with the smallest terms
+#   removed, and keeps it in truncatedTables for later calls.
+#
+# Each coordinate's accuracy is split evenly between its terms (X0..X5). In
+#   each term, the smallest amplitudes are dropped for as long as the root sum
+#   square of the dropped amplitudes stays within that share. The dropped
+#   terms have unrelated phases, so the root sum square is a realistic
+#   estimate of their combined effect. The powers of t are at most one within
+#   a millennium of J2000, so the estimate holds for the higher terms too.
+#
+# INPUT:
+#   planetID - int, id of the planet to load
+#   db - database cursor
+#   accuracy - float, target accuracy in AU
+# OUTPUT:
+#   dict, in the same form as loadCoefficients
+def truncateCoefficients(planetID, db, accuracy):
+    if (planetID, accuracy) in truncatedTables:
+        return truncatedTables[(planetID, accuracy)]
+
+    table = loadCoefficients(planetID, db)
+    truncated = {}
+    for term in table:
+        A, B, C = table[term]
+
+        # Share the accuracy between each term of the same coordinate
+        numTerms = len([key for key in table if key[0] == term[0]])
+        allowed = accuracy / numTerms
+
+        # Drop the smallest amplitudes while their root sum square is allowed
+        order = numpy.argsort(numpy.abs(A))
+        dropped = numpy.sqrt(numpy.cumsum(A[order] * A[order]))
+        numDropped = numpy.searchsorted(dropped, allowed, side='right')
+
+        # Keep the remaining terms in their original order
+        keep = numpy.sort(order[numDropped:])
+        if len(keep):
+            truncated[term] = (A[keep], B[keep], C[keep])
+
+    truncatedTables[(planetID, accuracy)] = truncated
+    return truncated
+
+
+###############################
+# runVSOP87Batch
+###############################
+# Calculates the VSOP87 coordinates of a planet for a whole array of times in
+#   one call. Unlike runVSOP87, the points are returned instead of being
+#   appended to the planet.
+#
+# INPUT:
+#   planet - planet object to be used
+#   times - array of times in Julian millennia (see calculateJMillenia)
+#   db - database cursor
+#   velocity - boolean, if True, the velocities are also returned
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z), one value for each time. If velocity is
+#       True, (X, Y, Z, VX, VY, VZ) with the velocities in AU/day
+def runVSOP87Batch(planet, times, db, velocity=False):
+    timer = reporting.startTimer()
+    table = loadCoefficients(planet.id, db, truncation)
+    times = numpy.asarray(times, dtype=float)
+
+    termValues = {}
+    termRates = {}
+    for term in table:
+        if velocity:
+            termValues[term], termRates[term] = calculateTermBatch(
+                table[term], times, True)
+        else:
+            termValues[term] = calculateTermBatch(table[term], times)
+
+    points = calculateXYZTermsBatch(termValues, times)
+    if velocity:
+        points += calculateXYZRatesBatch(termValues, termRates, times)
+
+    planet.addCalculationTime("VSO", reporting.endTimer(timer))
+    return points
+
+
+###############################
+# runVSOP87Uniform
+###############################
+# Calculates the VSOP87 coordinates of a planet for evenly spaced times, as
+#   used for the daily points in orbital_drift.py. Gives the same results as
+#   runVSOP87Batch, but each cos(B + C * t) is advanced from the previous
+#   time by a rotation of C * step instead of being calculated directly (see
+#   calculateTermUniform).
+#
+# INPUT:
+#   planet - planet object to be used
+#   start - float, first time in Julian millennia
+#   step - float, Julian millennia between times
+#   numPoints - int, number of times
+#   db - database cursor
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z), one value for each time
+def runVSOP87Uniform(planet, start, step, numPoints, db):
+    timer = reporting.startTimer()
+    table = loadCoefficients(planet.id, db, truncation)
+    times = start + step * numpy.arange(numPoints)
+
+    termValues = {}
+    for term in table:
+        termValues[term] = calculateTermUniform(table[term], start, step,
+                                                numPoints)
+
+    points = calculateXYZTermsBatch(termValues, times)
+
+    planet.addCalculationTime("VSO", reporting.endTimer(timer))
+    return points
+
+
+###############################
+# runVSOP87Fused
+###############################
+# Calculates the VSOP87 coordinates of several planets for an array of times
+#   in a single pass. The terms of every planet are evaluated together as one
+#   long series, and then summed into each planet's terms (see
+#   loadFusedCoefficients). Each block of fusedPoints times is summed into
+#   the terms with a single reduction. Gives the same results as calling
+#   runVSOP87Batch for each planet, but is not faster than it with every
+#   numpy build, so it is only used when asked for (-fv in
+#   orbital_drift.py).
+#
+# INPUT:
+#   planets - list of planet objects
+#   times - array of times in Julian millennia (see calculateJMillenia)
+#   db - database cursor
+# OUTPUT:
+#   list of tuples of numpy arrays (X, Y, Z), in the order of planets
+def runVSOP87Fused(planets, times, db):
+    timer = reporting.startTimer()
+    fused = loadFusedCoefficients([planet.id for planet in planets], db,
+                                  truncation)
+    times = numpy.asarray(times, dtype=float)
+    A, B, C = fused['coefficients']
+    offsets = fused['offsets']
+
+    # Value of every term of every planet, one row per term
+    values = numpy.empty((len(offsets), len(times)))
+    for start in range(0, len(times), fusedPoints):
+        block = times[start:start + fusedPoints]
+        terms = numpy.outer(C, block)
+        terms += B[:, numpy.newaxis]
+        numpy.cos(terms, terms)
+        terms *= A[:, numpy.newaxis]
+        values[:, start:start + fusedPoints] = numpy.add.reduceat(
+            terms, offsets, axis=0)
+
+    # Split the rows back into each planet's terms
+    results = [{} for planet in planets]
+    for row, (index, term) in enumerate(fused['terms']):
+        results[index][term] = values[row]
+    points = [calculateXYZTermsBatch(terms, times) for terms in results]
+
+    # Share the time taken between the planets by their number of terms
+    timeTaken = reporting.endTimer(timer)
+    for index, planet in enumerate(planets):
+        share = timeTaken * fused['sizes'][index] / float(len(A))
+        planet.addCalculationTime("VSO", share)
+    return points
+
+
+###############################
+# loadFusedCoefficients
+###############################
+# Concatenates the coefficient tables of several planets into single (A, B,
+#   C) arrays, and keeps the result in fusedTables.
+#
+# INPUT:
+#   planetIDs - list of planet ids
+#   db - database cursor
+#   accuracy - float, AU, as in loadCoefficients
+# OUTPUT:
+#   dict, containing
+#       coefficients -> tuple of numpy arrays (A, B, C)
+#       offsets -> numpy array, index of the first value of each term
+#       terms -> list of (index in planetIDs, term) for each term
+#       sizes -> list, number of values for each planet
+def loadFusedCoefficients(planetIDs, db, accuracy=0):
+    key = (tuple(planetIDs), accuracy)
+    if key in fusedTables:
+        return fusedTables[key]
+
+    parts = ([], [], [])
+    offsets = []
+    terms = []
+    sizes = []
+    count = 0
+    for index, planetID in enumerate(planetIDs):
+        table = loadCoefficients(planetID, db, accuracy)
+        size = 0
+        for term in sorted(table):
+            offsets.append(count)
+            terms.append((index, term))
+            for i in range(3):
+                parts[i].append(table[term][i])
+            count += len(table[term][0])
+            size += len(table[term][0])
+        sizes.append(size)
+
+    fusedTables[key] = {
+        'coefficients': tuple(numpy.concatenate(part) for part in parts),
+        'offsets': numpy.array(offsets),
+        'terms': terms,
+        'sizes': sizes,
+    }
+    return fusedTables[key]
+
+
+###############################
+# recurrenceError
+###############################
+# Measures the largest difference, in AU, between runVSOP87Uniform and
+#   runVSOP87Batch for the given times
+def recurrenceError(planet, start, step, numPoints, db):
+    times = start + step * numpy.arange(numPoints)
+    uniform = runVSOP87Uniform(planet, start, step, numPoints, db)
+    direct = runVSOP87Batch(planet, times, db)
+    return max(numpy.abs(uniform[i] - direct[i]).max() for i in range(3))
 
 
 ###############################
@@ -67,6 +378,9 @@ def runVSOP87(planet, date, db):
 #   NOTE: This function was built for VSOP87-A, which is used to calculate
 #   Spherical coordinates. Due to issues converting spherical coordinates,
 #   this function has been replaced by calculateXYZTerms
+#
+# OUTPUT:
+#   tuple (x, y, z)
 def calculatePoint(planet):
     R = planet.radVector
     B = planet.helioLat
@@ -76,18 +390,16 @@ def calculatePoint(planet):
     y = R * Math.cos(B) * Math.sin(L)
     z = R * Math.sin(B)
 
-    planet.orbitXVSOP.append(x)
-    planet.orbitYVSOP.append(y)
-    planet.orbitZVSOP.append(z)
+    return (x, y, z)
 
 
 ###############################
 # calculateXYZTerms
 ###############################
-# Takes the calculated values from the VSOP87 method, and adds the
-#   coordinate to the planet object. This properly implements VSOP87-C,
+# Takes the calculated values from the VSOP87 method, and returns the
+#   coordinate as a tuple (x, y, z). This properly implements VSOP87-C,
 #   which calculates rectangular coordinates
-def calculateXYZTerms(planet, terms, time):
+def calculateXYZTerms(terms, time):
     x = 0
     y = 0
     z = 0
@@ -104,9 +416,61 @@ def calculateXYZTerms(planet, terms, time):
     for i in range(0, 6):
         z = z + terms['Z' + str(i)] * Math.pow(time, i)
 
-    planet.orbitXVSOP.append(x)
-    planet.orbitYVSOP.append(y)
-    planet.orbitZVSOP.append(z)
+    return (x, y, z)
+
+
+###############################
+# calculateXYZTermsBatch
+###############################
+# The array equivalent of calculateXYZTerms. The polynomial in time is
+#   evaluated with Horner's rule, i.e. ((E5 * t + E4) * t + E3) * t ...
+#
+# INPUT:
+#   terms - dict, maps each term the planet has to an array of values
+#   times - numpy array of times in Julian millennia
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z)
+def calculateXYZTermsBatch(terms, times):
+    points = []
+    for coordinate in ['X', 'Y', 'Z']:
+        value = numpy.zeros(len(times))
+        for i in range(5, -1, -1):
+            value *= times
+            if coordinate + str(i) in terms:
+                value += terms[coordinate + str(i)]
+        points.append(value)
+    return tuple(points)
+
+
+###############################
+# calculateXYZRatesBatch
+###############################
+# Calculates the velocity from the terms and their rates of change. The
+#   derivative of the polynomial is found alongside its value with Horner's
+#   rule:
+#   p_i = p_(i+1) * t + E_i
+#   p'_i = p'_(i+1) * t + p_(i+1) + E'_i
+#
+# INPUT:
+#   terms - dict, maps each term to its values
+#   rates - dict, maps each term the planet has to its rate of change per
+#       Julian millennium
+#   times - float or numpy array of times in Julian millennia
+# OUTPUT:
+#   tuple (VX, VY, VZ), in AU/day
+def calculateXYZRatesBatch(terms, rates, times):
+    velocities = []
+    for coordinate in ['X', 'Y', 'Z']:
+        value = numpy.zeros(numpy.shape(times))
+        rate = numpy.zeros(numpy.shape(times))
+        for i in range(5, -1, -1):
+            rate = rate * times + value
+            value = value * times
+            if coordinate + str(i) in rates:
+                rate += rates[coordinate + str(i)]
+                value += terms[coordinate + str(i)]
+        velocities.append(rate / 365250.0)
+    return tuple(velocities)
 
 
 ###############################
@@ -134,22 +498,92 @@ def calculateFinalTerms(planet, terms, time):
 # calculateTerm
 ###############################
 # Calculates the exponents to be used
-#   in calculateXYZTerms using the terms stored
-#   in the DB.
-def calculateTerm(planet, term, time, db):
-    data = (planet.id, term, )
+#   in calculateXYZTerms using the (A, B, C) arrays
+#   loaded by loadCoefficients.
+#
+# If rate is True, the rate of change of the term per Julian millennium,
+#   -sum(A * C * sin(B + C * t)), is also returned, using the same angles.
+def calculateTerm(coefficients, time, rate=False):
+    A, B, C = coefficients
+    angles = B + C * time
+    value = float(numpy.dot(A, numpy.cos(angles)))
+    if rate:
+        return value, -float(numpy.dot(A * C, numpy.sin(angles)))
+    return value
 
-    db.execute('''
-        SELECT * FROM vsop87terms WHERE planet_id = ? AND term = ?
-    ''', data)
 
-    terms = db.fetchall()
-    value = 0
+###############################
+# calculateTermBatch
+###############################
+# Calculates a term for every time at once, as the sum of A * cos(B + C * t)
+#   over a terms x times matrix. The times are split into blocks so that no
+#   more than batchSize values are held at once.
+#
+# INPUT:
+#   coefficients - tuple of numpy arrays (A, B, C) for the term
+#   times - numpy array of times in Julian millennia
+#   rate - boolean, if True, the rate of change of the term is also returned
+# OUTPUT:
+#   numpy array, the value of the term for each time. If rate is True, a
+#       tuple (values, rates), the rates per Julian millennium
+def calculateTermBatch(coefficients, times, rate=False):
+    A, B, C = coefficients
+    values = numpy.empty(len(times))
+    if rate:
+        rates = numpy.empty(len(times))
+        AC = A * C
+    step = max(1, batchSize // len(A))
+
+    for start in range(0, len(times), step):
+        block = times[start:start + step]
+        angles = numpy.outer(C, block)
+        angles += B[:, numpy.newaxis]
+        values[start:start + step] = numpy.dot(A, numpy.cos(angles))
+        if rate:
+            rates[start:start + step] = -numpy.dot(AC, numpy.sin(angles))
+
+    if rate:
+        return values, rates
+    return values
 
-    for term in terms:
-        value += term['A'] * Math.cos(term['B'] + (term['C'] * time))
 
-    return value
+###############################
+# calculateTermUniform
+###############################
+# Calculates a term for evenly spaced times. Writing each part of the term
+#   as the real part of A * e^(i(B + C * t)), moving one step forward is a
+#   multiplication by the rotation e^(i * C * step). The powers of the
+#   rotation for a block of reanchorSteps times are found once with a
+#   cumulative product. At the start of each block the angles are calculated
+#   directly, so the rounding error of the rotations cannot build up.
+#
+# INPUT:
+#   coefficients - tuple of numpy arrays (A, B, C) for the term
+#   start - float, first time in Julian millennia
+#   step - float, Julian millennia between times
+#   numPoints - int, number of times
+# OUTPUT:
+#   numpy array, the value of the term for each time
+def calculateTermUniform(coefficients, start, step, numPoints):
+    A, B, C = coefficients
+    blockLength = max(1, min(reanchorSteps, numPoints,
+                             batchSize // len(A)))
+
+    # rotation ^ j for each term, j = 0 .. blockLength - 1
+    powers = numpy.empty((len(A), blockLength), dtype=complex)
+    powers[:, 0] = 1
+    powers[:, 1:] = numpy.exp(1j * C * step)[:, numpy.newaxis]
+    powers = numpy.cumprod(powers, axis=1)
+
+    values = numpy.empty(numPoints)
+    for blockStart in range(0, numPoints, blockLength):
+        count = min(blockLength, numPoints - blockStart)
+        time = start + step * blockStart
+        anchor = A * numpy.exp(1j * (B + C * time))
+        values[blockStart:blockStart + count] = numpy.dot(
+            anchor, powers[:, :count]).real
+
+    return values
 
 
 ###############################
@@ -0,0 +1,126 @@
+###############################
+# FileName: adaptiveSampling.py
+#
+# Purpose: Chooses how often each planet is calculated. The straight line
+#   between two points of an orbit is furthest from the orbit near its
+#   middle, by about an eighth of the step squared times the curvature, so
+#   Mercury needs far more points than Neptune to be drawn and compared to
+#   the same accuracy. The planet is probed with its own methods at a few
+#   places across the date range, and the step is made as long as it can be
+#   while the midpoints stay within a tolerance.
+###############################
+
+import math
+import numpy
+
+import chebyshevEphemeris
+from timeGrid import TimeGrid
+
+# Number of places across the date range each planet is probed at
+probeCount = 256
+
+# Most times the requested interval can be doubled or halved
+maxDoublings = 12
+maxHalvings = 10
+
+
+###############################
+# interpolationError
+###############################
+# Returns the largest distance between a planet's orbit and the straight
+#   lines between its points, for points a given step apart.
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch" or "VSO"
+#   starts - numpy array of Julian dates to probe at
+#   step - float, days between points
+#   db - PlanetDBInterface
+# OUTPUT:
+#   float, AU
+def interpolationError(planet, method, starts, step, db):
+    jds = numpy.concatenate((starts, starts + step / 2.0, starts + step))
+    points = chebyshevEphemeris.sampleMethod(planet, method, jds, db)
+    count = len(starts)
+    error = 0.0
+    for values in points:
+        first = values[:count]
+        middle = values[count:2 * count]
+        last = values[2 * count:]
+        error = error + (middle - (first + last) / 2.0) ** 2
+    return float(numpy.sqrt(error).max())
+
+
+###############################
+# chooseStep
+###############################
+# Finds the longest step, a power of two times the grid's step, at which
+#   straight lines between a planet's points stay within the tolerance.
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch" or "VSO"
+#   grid - TimeGrid, the requested dates and interval
+#   tolerance - float, AU
+#   db - PlanetDBInterface
+# OUTPUT:
+#   float, days
+def chooseStep(planet, method, grid, tolerance, db):
+    span = grid.step * (len(grid) - 1)
+    if span <= 0:
+        return grid.step
+    starts = grid.start + span * numpy.arange(probeCount) / float(probeCount)
+
+    # The error grows with the square of the step, which gives the first
+    #   guess
+    error = interpolationError(planet, method, starts, grid.step, db)
+    if error > 0:
+        power = int(math.floor(math.log(tolerance / error, 2) / 2))
+    else:
+        power = maxDoublings
+    power = max(-maxHalvings, min(maxDoublings, power))
+
+    # Keep at least two points
+    while power > -maxHalvings and grid.step * 2.0 ** power > span:
+        power -= 1
+
+    # The square law does not hold for steps that are a large part of the
+    #   orbit, so check the guess
+    while power > -maxHalvings and interpolationError(
+            planet, method, starts, grid.step * 2.0 ** power, db) > tolerance:
+        power -= 1
+    return grid.step * 2.0 ** power
+
+
+###############################
+# adaptGrid
+###############################
+# Returns the grid a planet is calculated at: the requested dates, at the
+#   longest step that suits all of its methods. The step is shortened so
+#   that a whole number of steps spans the range, and the last point is
+#   always the requested end. If the points are also retrieved from
+#   Horizons, the step is shortened further to a whole number of minutes.
+#
+# INPUT:
+#   planet - planet object to be used
+#   methods - list of "Sch" and "VSO"
+#   grid - TimeGrid, the requested dates and interval
+#   tolerance - float, AU
+#   db - PlanetDBInterface
+#   minutes - boolean, if True, the step is a whole number of minutes
+# OUTPUT:
+#   TimeGrid
+def adaptGrid(planet, methods, grid, tolerance, db, minutes=False):
+    step = min(chooseStep(planet, method, grid, tolerance, db)
+               for method in methods)
+    span = grid.step * (len(grid) - 1)
+    if span <= 0:
+        return grid
+    steps = int(math.ceil(span / step - 1e-9))
+    if minutes:
+        # The range is a whole number of minutes, as are the dates given
+        spanMinutes = int(round(span * 1440))
+        steps = min(steps, spanMinutes)
+        while spanMinutes % steps:
+            steps += 1
+    return TimeGrid(grid.start, span / steps, steps + 1)
@@ -0,0 +1,331 @@
+###############################
+# FileName: chebyshevEphemeris.py
+#
+# Purpose: Compresses the output of the Schlyter and VSOP87 methods into
+#   piecewise Chebyshev polynomials, in the same manner as the JPL SPK
+#   kernels. The time range is split into segments of equal length, and each
+#   coordinate in a segment is described by a short series of coefficients.
+#   Once generated, a position (or velocity) at any time in the range only
+#   costs the evaluation of the short polynomial.
+#
+#   An ephemeris is a dict with the following values:
+#       name -> String, name of the planet
+#       method -> String, "Sch" or "VSO"
+#       start -> float, Julian date the first segment starts on
+#       end -> float, Julian date the last segment ends on
+#       segmentDays -> float, length of each segment in days
+#       truncation -> float, VSOP87.truncation used to create the ephemeris
+#       key -> String, trajectoryCache.settingsKey of the method's engine
+#           version and settings, such as SchlyterCalc.methodForEccen, when
+#           the ephemeris was created
+#       coefficients -> numpy array, (segments, 3, degree + 1). The
+#           coefficients of X, Y and Z for each segment
+###############################
+
+import os
+import math
+import numpy
+
+import SchlyterCalc
+import VSOP87
+from trajectoryCache import settingsKey
+
+# Default length of each segment, in days
+segmentDays = 16.0
+
+# Default degree of the polynomial for each segment
+degree = 12
+
+# The ephemeris files are stored in the data folder in the directory this
+#   file is contained in
+directory = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'data', 'ephemerides')
+
+# Julian date of the Schlyter day number 0
+schlyterEpoch = SchlyterCalc.epochJD
+
+
+###############################
+# generateEphemeris
+###############################
+# Fits the given method's coordinates for a planet between two Julian dates.
+#   The method is evaluated at the Chebyshev nodes of each segment, which
+#   gives the coefficients directly without solving a least squares problem.
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch" or "VSO"
+#   jdStart - float, Julian date to start on
+#   jdEnd - float, Julian date to end on
+#   db - PlanetDBInterface
+#   days - float, length of each segment in days
+#   order - int, degree of the polynomial for each segment
+# OUTPUT:
+#   dict, the ephemeris
+def generateEphemeris(planet, method, jdStart, jdEnd, db,
+                      days=segmentDays, order=degree):
+    numSegments = max(1, int(math.ceil((jdEnd - jdStart) / days)))
+    numNodes = order + 1
+
+    # Chebyshev nodes of the first kind on [-1, 1]
+    k = numpy.arange(numNodes)
+    nodes = numpy.cos(math.pi * (k + 0.5) / numNodes)
+
+    # Julian date of every node in every segment
+    middles = jdStart + days * (numpy.arange(numSegments) + 0.5)
+    jds = middles[:, numpy.newaxis] + nodes * (days / 2.0)
+
+    points = sampleMethod(planet, method, jds.ravel(), db)
+
+    # c_j = 2/N * sum(f(x_k) * T_j(x_k)), with c_0 halved
+    T = numpy.cos(numpy.outer(numpy.arange(numNodes), math.pi * (k + 0.5) /
+                              numNodes))
+    T *= 2.0 / numNodes
+    T[0] /= 2.0
+
+    coefficients = numpy.empty((numSegments, 3, numNodes))
+    for i in range(3):
+        values = points[i].reshape(numSegments, numNodes)
+        coefficients[:, i, :] = numpy.dot(values, T.T)
+
+    return {
+        'name': planet.name,
+        'method': method,
+        'start': float(jdStart),
+        'end': float(jdStart + numSegments * days),
+        'segmentDays': float(days),
+        'truncation': float(VSOP87.truncation if method == "VSO" else 0),
+        'key': settingsKey(method, ''),
+        'coefficients': coefficients,
+    }
+
+
+###############################
+# sampleMethod
+###############################
+# Calculates the coordinates of a planet at the given Julian dates using
+#   either the Schlyter or VSOP87 method. The points are not added to the
+#   planet.
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch" or "VSO"
+#   jds - numpy array of Julian dates
+#   db - PlanetDBInterface
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z)
+def sampleMethod(planet, method, jds, db):
+    if method == "VSO":
+        times = VSOP87.calculateJMillenia(jds)
+        return VSOP87.runVSOP87Batch(planet, times, db.cursor)
+
+    # The Schlyter elements are only read from the DB if they are not set
+    if not planet.elements:
+        planet.setElementsDict(db)
+        planet.setSchlyterTerms(db)
+    return SchlyterCalc.runSchlyterCalcBatch(planet, jds - schlyterEpoch)
+
+
+###############################
+# evaluate
+###############################
+# Calculates the coordinates at the given Julian dates using Clenshaw's
+#   recurrence on each date's segment.
+#
+# INPUT:
+#   ephemeris - dict, as returned by generateEphemeris
+#   jds - array of Julian dates, within the ephemeris' range
+#   velocity - boolean, if True, returns the velocity in AU/day instead
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z)
+def evaluate(ephemeris, jds, velocity=False):
+    jds = numpy.asarray(jds, dtype=float)
+    coefficients = ephemeris['coefficients']
+    days = ephemeris['segmentDays']
+
+    # Find the segment of each date, and the date's position in it on [-1, 1]
+    position = (jds - ephemeris['start']) / days
+    segments = numpy.clip(numpy.floor(position).astype(int), 0,
+                          len(coefficients) - 1)
+    x = 2.0 * (position - segments) - 1.0
+
+    if velocity:
+        coefficients = derivativeCoefficients(coefficients) * (2.0 / days)
+
+    points = []
+    for i in range(3):
+        c = coefficients[segments, i, :]
+        b1 = numpy.zeros(len(jds))
+        b2 = numpy.zeros(len(jds))
+        for j in range(c.shape[1] - 1, 0, -1):
+            b1, b2 = 2.0 * x * b1 - b2 + c[:, j], b1
+        points.append(x * b1 - b2 + c[:, 0])
+    return tuple(points)
+
+
+###############################
+# derivativeCoefficients
+###############################
+# Returns the Chebyshev coefficients of the derivative of each series, with
+#   respect to the segment's [-1, 1] variable.
+#
+# c'_(j-1) = c'_(j+1) + 2 * j * c_j, with c'_0 halved
+def derivativeCoefficients(coefficients):
+    n = coefficients.shape[-1]
+    derivative = numpy.zeros(coefficients.shape)
+    for j in range(n - 1, 0, -1):
+        derivative[..., j - 1] = 2.0 * j * coefficients[..., j]
+        if j + 1 < n:
+            derivative[..., j - 1] += derivative[..., j + 1]
+    derivative[..., 0] /= 2.0
+    return derivative
+
+
+###############################
+# covers
+###############################
+# Returns True if the ephemeris can be used for the given Julian dates
+def covers(ephemeris, jdStart, jdEnd):
+    return ephemeris['start'] <= jdStart and jdEnd <= ephemeris['end']
+
+
+###############################
+# saveEphemeris
+###############################
+# Saves an ephemeris to the ephemerides folder, replacing any earlier
+#   ephemeris for the same planet and method
+def saveEphemeris(ephemeris):
+    if not os.path.isdir(directory):
+        os.makedirs(directory)
+    numpy.savez(
+        ephemerisPath(ephemeris['name'], ephemeris['method']),
+        start=ephemeris['start'], end=ephemeris['end'],
+        segmentDays=ephemeris['segmentDays'],
+        truncation=ephemeris['truncation'], key=ephemeris['key'],
+        coefficients=ephemeris['coefficients'])
+
+
+###############################
+# loadEphemeris
+###############################
+# Loads the saved ephemeris for a planet and method.
+#
+# OUTPUT:
+#   dict, the ephemeris, or None if there is no saved ephemeris
+def loadEphemeris(name, method):
+    path = ephemerisPath(name, method)
+    if not os.path.isfile(path):
+        return None
+    data = numpy.load(path)
+    return {
+        'name': name,
+        'method': method,
+        'start': float(data['start']),
+        'end': float(data['end']),
+        'segmentDays': float(data['segmentDays']),
+        'truncation': float(data['truncation']),
+        # Ephemerides saved before the key was added are never reused
+        'key': str(data['key']) if 'key' in data.files else None,
+        'coefficients': data['coefficients'],
+    }
+
+
+###############################
+# ephemerisPath
+###############################
+# Returns the file an ephemeris is saved to, i.e. Earth_VSO.npz
+def ephemerisPath(name, method):
+    return os.path.join(directory, name + '_' + method + '.npz')
+
+
+###############################
+# getEphemeris
+###############################
+# Returns an ephemeris for the planet and method that covers the given
+#   Julian dates. A saved ephemeris is used if possible, as long as it was
+#   created with the same engine version and settings. Otherwise, one is
+#   generated over the dates (and the range of the saved ephemeris, so that
+#   earlier windows remain covered), saved, and its fit error is reported.
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch" or "VSO"
+#   jdStart - float, Julian date to start on
+#   jdEnd - float, Julian date to end on
+#   db - PlanetDBInterface
+#   output - String, file to output the fit report to, '' for stdout
+# OUTPUT:
+#   dict, the ephemeris
+def getEphemeris(planet, method, jdStart, jdEnd, db, output=''):
+    ephemeris = loadEphemeris(planet.name, method)
+    if ephemeris is not None:
+        sameSettings = ephemeris['key'] == settingsKey(method, '')
+        if sameSettings and covers(ephemeris, jdStart, jdEnd):
+            return ephemeris
+        if sameSettings:
+            jdStart = min(jdStart, ephemeris['start'])
+            jdEnd = max(jdEnd, ephemeris['end'])
+
+    ephemeris = generateEphemeris(planet, method, jdStart, jdEnd, db)
+    saveEphemeris(ephemeris)
+    outputFitReport([ephemeris], [fitErrors(ephemeris, planet, db)], output)
+    return ephemeris
+
+
+###############################
+# fitErrors
+###############################
+# Compares the ephemeris to the method it was generated from at points
+#   between the nodes of every segment.
+#
+# INPUT:
+#   ephemeris - dict, as returned by generateEphemeris
+#   planet - planet object to be used
+#   db - PlanetDBInterface
+#   checks - int, number of points to check in each segment
+# OUTPUT:
+#   numpy array, the largest distance in AU between the ephemeris and the
+#       method in each segment
+def fitErrors(ephemeris, planet, db, checks=8):
+    numSegments = len(ephemeris['coefficients'])
+    offsets = (numpy.arange(checks) + 0.5) / checks
+    jds = ephemeris['start'] + ephemeris['segmentDays'] * (
+        numpy.arange(numSegments)[:, numpy.newaxis] + offsets)
+    jds = jds.ravel()
+
+    fitted = evaluate(ephemeris, jds)
+    actual = sampleMethod(planet, ephemeris['method'], jds, db)
+    distance = numpy.sqrt(sum((fitted[i] - actual[i]) ** 2
+                              for i in range(3)))
+    return distance.reshape(numSegments, checks).max(axis=1)
+
+
+###############################
+# outputFitReport
+###############################
+# Outputs the fit error of each ephemeris, in the same style as the
+#   difference file
+#
+# INPUT:
+#   ephemerides - list of ephemeris dicts
+#   errors - list of arrays, as returned by fitErrors for each ephemeris
+#   output - String, file to output to. '' outputs to stdout
+def outputFitReport(ephemerides, errors, output):
+    header = ["Planet", "Method", "Segments", "SegDays", "MaxError",
+              "MeanError"]
+    out = '{0[0]:*^10}  {0[1]:*^10}  {0[2]:*^10}  {0[3]:*^10}'.format(header)
+    out += '  {0[4]:*^14}  {0[5]:*^14}\n'.format(header)
+
+    for ephemeris, error in zip(ephemerides, errors):
+        line = [ephemeris['name'], ephemeris['method'],
+                len(ephemeris['coefficients']), ephemeris['segmentDays'],
+                float(error.max()), float(error.mean())]
+        out += '{0[0]:^10}  {0[1]:^10}  {0[2]:^10}  {0[3]:^10.2f}'.format(line)
+        out += '  {0[4]:^14.4e}  {0[5]:^14.4e}\n'.format(line)
+
+    if output != '':
+        f = open(output, 'a')
+        f.write(out)
+        f.close()
+    else:
+        print(out)
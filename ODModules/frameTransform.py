@@ -0,0 +1,65 @@
+###############################
+# FileName: frameTransform.py
+#
+# Purpose: Moves calculated trajectories to a frame centred on any body, by
+#   subtracting the body's points from every planet's points. The
+#   heliocentric trajectories are kept on each planet, so a planet can be
+#   centred on another body, or the Sun again, without calculating anything.
+###############################
+
+
+###############################
+# heliocentric
+###############################
+# Returns a planet's heliocentric trajectories, wherever it is centred
+#
+# OUTPUT:
+#   dict, maps each method to a Trajectory
+def heliocentric(planet):
+    if planet.heliocentric is not None:
+        return planet.heliocentric
+    return planet.trajectories
+
+
+###############################
+# relativeTrajectories
+###############################
+# Subtracts the center's trajectory of each method from the trajectory of the
+#   same method
+#
+# INPUT:
+#   trajectories - dict, maps each method to a Trajectory
+#   center - dict, maps each method to the center's Trajectory, or None to
+#       leave the trajectories heliocentric
+# OUTPUT:
+#   dict, maps each method the center has to the moved Trajectory
+def relativeTrajectories(trajectories, center):
+    if center is None:
+        return dict(trajectories)
+    moved = {}
+    for method, trajectory in trajectories.items():
+        if method in center:
+            moved[method] = trajectory.relativeTo(center[method])
+    return moved
+
+
+###############################
+# centerOn
+###############################
+# Moves planets to the frame centred on a body. A planet's trajectories are
+#   replaced by the moved ones, and the heliocentric ones are kept in
+#   planet.heliocentric. The center can be one of the planets, in which case
+#   its own points become zero.
+#
+# INPUT:
+#   planets - list of planet objects
+#   center - planet object, or None to move the planets back to the Sun
+def centerOn(planets, center):
+    centerPoints = None
+    if center is not None:
+        centerPoints = heliocentric(center)
+
+    for planet in planets:
+        points = heliocentric(planet)
+        planet.heliocentric = None if center is None else points
+        planet.trajectories = relativeTrajectories(points, centerPoints)
@@ -0,0 +1,199 @@
+###############################
+# FileName: horizonsCache.py
+#
+# Purpose: Keeps every result retrieved from Horizons on disk, with the
+#   trajectories saved by trajectoryCache. The vectors of a planet for a
+#   given center, frame, corrections, units and step never change, so a
+#   request within a saved date range is read from disk, and a request
+#   that runs past it only retrieves the missing dates. In offline mode
+#   nothing is retrieved, and a request that is not saved fails at once.
+#   A Retrieval does all of this in the background.
+###############################
+
+import threading
+import numpy
+
+import reporting
+import trajectoryCache
+import horizonsConnection as horiz
+from trajectory import joinTrajectories
+
+# If True, Horizons is never contacted. Set by -of or --offline in
+#   orbital_drift.py
+offline = False
+
+
+###############################
+# retrieveTrajectories
+###############################
+# Reads the requested trajectories from disk where they are saved, and
+#   retrieves the rest from Horizons, several planets at once (see
+#   horizonsConnection.fetchTrajectories). Everything retrieved is saved.
+#
+# A request may also give a consumer, which is handed the points of the
+#   request in order as they arrive (see horizonsParser.VectorParser): a
+#   saved trajectory at once, and a retrieved one a block at a time. The
+#   whole range of such a request is retrieved, so that the blocks start at
+#   its first date. Every consumer is called with None once nothing more
+#   will arrive, even if the retrieval failed.
+#
+# INPUT:
+#   requests - list of (planet, jds), jds being a numpy array of evenly
+#       spaced Julian dates, optionally followed by a consumer
+# OUTPUT:
+#   list of (Trajectory, seconds taken), in the order of the requests
+def retrieveTrajectories(requests):
+    try:
+        return retrieveRequests(requests)
+    finally:
+        for request in requests:
+            if len(request) > 2:
+                request[2](None)
+
+
+###############################
+# retrieveRequests
+###############################
+# Does the work of retrieveTrajectories, without ending the consumers
+def retrieveRequests(requests):
+    results = [None] * len(requests)
+    plans = {}
+    fetches = []
+    missing = []
+
+    for index, request in enumerate(requests):
+        planet, jds = request[:2]
+        consumer = request[2] if len(request) > 2 else None
+        timer = reporting.startTimer()
+        saved = trajectoryCache.loadTrajectory(planet.name, "Hor", jds)
+        if saved is not None:
+            results[index] = (saved, reporting.endTimer(timer))
+            if consumer is not None:
+                consumer(saved)
+            continue
+
+        # Only the dates missing from a saved trajectory are retrieved
+        plan = None
+        if consumer is None:
+            plan = trajectoryCache.planExtension(planet.name, "Hor", jds)
+        if plan is None:
+            spans = [numpy.asarray(jds, dtype=float)]
+        else:
+            spans = [span for span in plan[2] if len(span)]
+        plans[index] = (plan, len(fetches), len(spans),
+                        reporting.endTimer(timer))
+        for span in spans:
+            fetches.append(fetchRequest(planet, span, jds) + request[2:])
+        missing.append(planet.name)
+
+    # Fail before connecting if anything is not saved
+    if offline and missing:
+        print("Offline, and the Horizons results are not saved for: " +
+              ", ".join(missing))
+        exit()
+
+    fetched = horiz.fetchTrajectories(fetches)
+    for index, (plan, first, count, seconds) in plans.items():
+        planet, jds = requests[index][:2]
+        parts = [trajectory for trajectory, taken in
+                 fetched[first:first + count]]
+        seconds += sum(taken for trajectory, taken in
+                       fetched[first:first + count])
+        if plan is not None:
+            parts.append(plan[1])
+        joined = joinTrajectories(parts)
+
+        timer = reporting.startTimer()
+        if plan is None:
+            trajectoryCache.saveTrajectory(planet.name, "Hor", joined)
+        else:
+            trajectoryCache.replaceTrajectory(planet.name, "Hor", joined, '',
+                                              plan[0])
+        trajectory = joined.section(jds)
+        if trajectory is None:
+            print("The Horizons results for " + planet.name + " are not " +
+                  "at the requested dates. Horizons steps")
+            print("are whole minutes, so the interval must be too.")
+            exit()
+        results[index] = (trajectory, seconds + reporting.endTimer(timer))
+    return results
+
+
+class Retrieval(object):
+
+    ########
+    # Values of Retrieval class
+    ########
+    #
+    # Retrieves trajectories in the background, as retrieveTrajectories
+    #   does, so that the planets can be calculated while waiting on
+    #   Horizons. Offline, only saved results are read, so they are read at
+    #   once, and a missing one stops the program before anything is
+    #   calculated.
+    #
+    # thread -> Thread doing the retrieval, or None if it was done at once
+    # results -> list of (Trajectory, seconds taken), or None until done
+    # error -> exception raised by the retrieval, or None
+    __slots__ = ['thread', 'results', 'error']
+
+    ################
+    # __init__
+    ################
+    # Starts the retrieval
+    #
+    # INPUT:
+    #   requests - list of (planet, jds), optionally followed by a consumer,
+    #       as for retrieveTrajectories
+    def __init__(self, requests):
+        self.results = None
+        self.error = None
+        self.thread = None
+        if offline:
+            self.results = retrieveTrajectories(requests)
+            return
+        self.thread = threading.Thread(target=self.run, args=(requests,))
+        self.thread.daemon = True
+        self.thread.start()
+
+    ################
+    # run
+    ################
+    # Retrieves the trajectories. Runs in the background thread, and keeps
+    #   anything raised, including the exit after a failed session, for join
+    def run(self, requests):
+        try:
+            self.results = retrieveTrajectories(requests)
+        except BaseException as error:
+            self.error = error
+
+    ################
+    # join
+    ################
+    # Waits for the retrieval to finish. Raises whatever the retrieval
+    #   raised, so a failed session still stops the program.
+    #
+    # OUTPUT:
+    #   list of (Trajectory, seconds taken), in the order of the requests
+    def join(self):
+        if self.thread is not None:
+            self.thread.join()
+        if self.error is not None:
+            raise self.error
+        return self.results
+
+
+###############################
+# fetchRequest
+###############################
+# Returns the request for horizonsConnection.fetchTrajectories that
+#   retrieves a span of dates. Horizons needs the end to be after the start,
+#   so a span of one date also asks for the date after it.
+#
+# INPUT:
+#   planet - planet object
+#   span - numpy array of evenly spaced Julian dates to retrieve
+#   jds - numpy array of all the requested dates, which give the step
+def fetchRequest(planet, span, jds):
+    step = jds[1] - jds[0] if len(jds) > 1 else 1.0
+    last = span[-1] if len(span) > 1 else span[0] + step
+    return (planet, horiz.jdToDate(span[0]), horiz.jdToDate(last), step)
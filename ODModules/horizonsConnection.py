@@ -8,106 +8,441 @@
 #   to the coordinates calculated by
 #   another method.
 ###############################
-from telnetlib import Telnet
+from datetime import datetime, timedelta
+from telnetlib import Telnet, IAC
+import re
+import socket
+import threading
+import Queue
 import reporting
+from horizonsParser import VectorParser
 
 planetIDs = {'Mercury': "199", "Venus": "299", 'Earth': "399", "Mars": "499",
              "Jupiter": "599", "Saturn": "699", "Uranus": "799",
              "Neptune": "899"}
 
+# Settings sent with every request. Saved trajectories are keyed by these,
+#   see requestSettings
+center = "500@10"  # Sun's ID
+referencePlane = "eclip"
+referenceFrame = "J2000"
+corrections = "3"  # 1=NONE, 2=LT, 3=LT+S
+units = "2"  # 1=KM-S, 2=AU-D, 3=KM-D
+tableType = "2"  # State vector
 
+# Address of the Horizons telnet service
+host = 'horizons.jpl.nasa.gov'
+port = 6775
+
+# Largest number of sessions open with Horizons at once, each retrieving a
+#   different planet. Set by -hj or --horizonjobs in orbital_drift.py
+maxSessions = 4
+
+# Seconds to wait for each reply from Horizons before a session gives up
+timeout = 120
+
+# Largest number of bytes of vectors read from the connection at a time
+chunkSize = 65536
+
+# Date and Julian date that dateToJD and jdToDate count from
+epochDate = datetime(2000, 1, 1, 12)
+epochJD = 2451545.0
+
+
+###############################
+# requestSettings
+###############################
+# Returns the settings that affect the results of a request, other than the
+#   planet and the dates
+def requestSettings():
+    return (center, referencePlane, referenceFrame, corrections, units,
+            tableType)
+
+
+###############################
+# dateToJD
+###############################
+# Converts a date to the Julian date Horizons gives it in the results. Only
+#   the minutes are sent in a request, so seconds are ignored.
+def dateToJD(date):
+    difference = date.replace(second=0, microsecond=0) - epochDate
+    return epochJD + difference.days + difference.seconds / 86400.0
+
+
+###############################
+# jdToDate
+###############################
+# Converts a Julian date to the nearest minute
+def jdToDate(jd):
+    return epochDate + timedelta(minutes=round((jd - epochJD) * 1440))
+
+
+###############################
+# intervalString
+###############################
+# Converts a step in days to the output interval sent to Horizons, in whole
+#   days, hours or minutes
+def intervalString(interval):
+    minutes = int(round(interval * 1440))
+    if minutes % 1440 == 0:
+        return str(minutes // 1440) + "d"
+    if minutes % 60 == 0:
+        return str(minutes // 60) + "h"
+    return str(minutes) + "m"
+
+
+###############################
+# HorizonsError
+###############################
+# Raised when a session with Horizons cannot be completed
+class HorizonsError(Exception):
+    pass
+
+
+###############################
+# calculatePlanets
+###############################
 # Calculates the coordinates of several planets.
 #
 # INPUT:
 #   planets -- array of planet names to calculate
 #   dateStart -- the date that the coordinates should begin on
 #   dateEnd -- the date that the coordinates should end on
-#   interval -- the time interval to calculate
+#   interval -- the days between the coordinates
 def calculatePlanets(planets, dateStart, dateEnd, interval):
-    for planet in planets:
-        # Start timer for Horizon method
-        timer = reporting.startTimer()
+    requests = [(planet, dateStart, dateEnd, interval) for planet in planets]
+    results = fetchTrajectories(requests)
+    for planet, (trajectory, seconds) in zip(planets, results):
+        planet.trajectories["Hor"] = trajectory
+        planet.calculationTimes["Hor"] = seconds
+
+
+###############################
+# fetchTrajectories
+###############################
+# Retrieves several trajectories at once, with up to maxSessions sessions
+#   open with Horizons. Each session retrieves one planet after another. If
+#   any session fails, the errors are printed and the program exits.
+#
+# INPUT:
+#   requests -- list of (planet, dateStart, dateEnd, interval), as for
+#       fetchTrajectory, optionally followed by a consumer
+# OUTPUT:
+#   list of (Trajectory, seconds taken), in the order of the requests
+def fetchTrajectories(requests):
+    results = [None] * len(requests)
+    errors = []
+    queue = Queue.Queue()
+    for index, request in enumerate(requests):
+        queue.put((index, request))
+
+    # Each thread takes the next request until none are left, keeping its
+    #   session open between them
+    def work():
+        session = None
+        while True:
+            try:
+                index, request = queue.get_nowait()
+            except Queue.Empty:
+                break
+            timer = reporting.startTimer()
+            try:
+                if session is None:
+                    session = HorizonsSession()
+                trajectory = session.request(*request)
+            except Exception as error:
+                errors.append(error)
+                # Start again with a new session
+                if session is not None:
+                    session.close()
+                    session = None
+                continue
+            results[index] = (trajectory, reporting.endTimer(timer))
+        if session is not None:
+            session.close()
+
+    threads = []
+    for i in range(min(maxSessions, len(requests))):
+        thread = threading.Thread(target=work)
+        thread.daemon = True
+        thread.start()
+        threads.append(thread)
+    for thread in threads:
+        thread.join()
+
+    for error in errors:
+        if not isinstance(error, HorizonsError):
+            raise error
+    if errors:
+        printError(errors[0])
+        exit()
+    return results
+
+
+###############################
+# fetchTrajectory
+###############################
+# Retrieves the position and velocity of a planet from Horizons. If the
+#   session fails, the error is printed and the program exits.
+#
+# INPUT:
+#   planet -- planet object to retrieve
+#   dateStart -- the date that the coordinates should begin on
+#   dateEnd -- the date that the coordinates should end on
+#   interval -- the days between the coordinates
+#   consumer -- function called with each block of points as it arrives,
+#       see horizonsParser.VectorParser, or None
+# OUTPUT:
+#   Trajectory, with velocities
+def fetchTrajectory(planet, dateStart, dateEnd, interval=1.0, consumer=None):
+    session = None
+    try:
+        session = HorizonsSession()
+        return session.request(planet, dateStart, dateEnd, interval,
+                               consumer)
+    except HorizonsError as error:
+        printError(error)
+        exit()
+    finally:
+        if session is not None:
+            session.close()
+
+
+###############################
+# printError
+###############################
+# Prints why a session with Horizons failed
+def printError(error):
+    print("Error connecting to Horizons service: " + str(error))
+    print("For help troubleshooting, please visit:")
+    print("http://ssd.jpl.nasa.gov/?horizons#telnet")
+
+
+###############################
+# expect
+###############################
+# Reads from Horizons until the given prompt
+#
+# OUTPUT:
+#   String, everything read, ending with the prompt
+def expect(tel, prompt):
+    try:
+        text = tel.read_until(prompt, timeout)
+    except (EOFError, socket.error) as error:
+        raise HorizonsError("connection lost (" + str(error) + ")")
+    if not text.endswith(prompt):
+        if tel.eof:
+            raise HorizonsError("connection closed, waiting for: " + prompt)
+        raise HorizonsError("no reply after " + str(timeout) +
+                            " seconds, waiting for: " + prompt)
+    return text
+
+
+###############################
+# expectAny
+###############################
+# Reads from Horizons until one of several prompts, for the prompts that
+#   change once a session has made a request
+#
+# INPUT:
+#   patterns -- list of regular expressions
+# OUTPUT:
+#   int, index of the pattern that was read
+def expectAny(tel, patterns):
+    try:
+        index, match, text = tel.expect([re.compile(pattern)
+                                         for pattern in patterns], timeout)
+    except (EOFError, socket.error) as error:
+        raise HorizonsError("connection lost (" + str(error) + ")")
+    if index < 0:
+        if tel.eof:
+            raise HorizonsError("connection closed, waiting for: " +
+                                " or ".join(patterns))
+        raise HorizonsError("no reply after " + str(timeout) +
+                            " seconds, waiting for: " + " or ".join(patterns))
+    return index
+
+
+###############################
+# readVectors
+###############################
+# Reads the table of vectors into a parser as it arrives. telnetlib reads 50
+#   bytes at a time and checks each character for telnet commands, which is
+#   far too slow for a table of many megabytes, and Horizons sends no telnet
+#   commands inside it. So once telnetlib has handed over what it has
+#   already processed, the rest is read straight from the socket in large
+#   chunks. Whatever follows the table is given back to telnetlib for the
+#   next prompt, see unread.
+#
+# INPUT:
+#   tel -- Telnet connection, just after $$SOE
+#   parser -- VectorParser
+# OUTPUT:
+#   Trajectory, with velocities
+def readVectors(tel, parser):
+    remainder = parser.feed(tel.read_lazy())
+    sock = tel.get_socket()
+    while not parser.done:
+        try:
+            text = sock.recv(chunkSize)
+        except socket.timeout:
+            raise HorizonsError("no reply after " + str(timeout) +
+                                " seconds, waiting for: $$EOE")
+        if not text:
+            raise HorizonsError("connection closed, waiting for: $$EOE")
+        if IAC in text:
+            raise HorizonsError("telnet command received in the results")
+        remainder = parser.feed(text)
+    unread(tel, remainder)
+    return parser.trajectory
+
+
+###############################
+# unread
+###############################
+# Gives text read straight from the socket back to telnetlib, to be read by
+#   the next expect. telnetlib has no public way to do this, so the text is
+#   put in front of its queue of processed text, Telnet.cookedq. This is the
+#   only place that uses it. Raises HorizonsError if telnetlib no longer has
+#   the queue, rather than losing the text.
+def unread(tel, text):
+    if not isinstance(getattr(tel, 'cookedq', None), str):
+        raise HorizonsError("this version of telnetlib cannot be given " +
+                            "the rest of the results back")
+    tel.cookedq = text + tel.cookedq
+
+
+class HorizonsSession(object):
+
+    ########
+    # Values of HorizonsSession class
+    ########
+    #
+    # A single connection to Horizons that retrieves one planet after
+    #   another. The first request walks through every prompt. Later
+    #   requests start a new case, which keeps the previous center and
+    #   output settings, so only the planet and dates are sent again.
+    #
+    # tel -> Telnet connection, or None once closed
+    # cases -> int, number of requests made over the connection
+    __slots__ = ['tel', 'cases']
 
-        # Connect to Horizon telnet server
+    ################
+    # __init__
+    ################
+    # Connects to Horizons. Raises HorizonsError if it cannot
+    def __init__(self):
         try:
-            tel = Telnet('horizons.jpl.nasa.gov', 6775)
-        except:
-            print("Error connecting to Horizons service.")
-            print("For help troubleshooting, please visit:")
-            print("http://ssd.jpl.nasa.gov/?horizons#telnet")
-            exit()
+            self.tel = Telnet(host, port, timeout)
+        except (socket.error, EOFError) as error:
+            raise HorizonsError(str(error))
+        self.cases = 0
+
+    ################
+    # request
+    ################
+    # Retrieves the position and velocity of a planet, as fetchTrajectory
+    #   does, but raises HorizonsError if the session fails
+    def request(self, planet, dateStart, dateEnd, interval=1.0,
+                consumer=None):
+        try:
+            return self.requestVectors(planet, dateStart, dateEnd, interval,
+                                       consumer)
+        except (socket.error, EOFError) as error:
+            raise HorizonsError("connection lost (" + str(error) + ")")
+        except (ValueError, IndexError):
+            raise HorizonsError("could not read the results for " +
+                                planet.name)
+
+    ################
+    # close
+    ################
+    # Closes the connection
+    def close(self):
+        if self.tel is not None:
+            self.tel.close()
+            self.tel = None
+
+    ################
+    # requestVectors
+    ################
+    # Walks through the prompts for one planet, and reads the vectors
+    def requestVectors(self, planet, dateStart, dateEnd, interval, consumer):
+        tel = self.tel
+
+        # After the results of the previous planet, start a new case
+        if self.cases:
+            expectAny(tel, [r"\[N\]ew-case.*:"])
+            tel.write("N\n")
 
         # Send id of planet to read when prompted
-        tel.read_until('Horizons>')
+        expect(tel, 'Horizons>')
         tel.write(planetIDs[planet.name] + "\n")
 
         # We want the results through the tenet connection, so choose E
-        tel.read_until("Select ... [E]phemeris, [F]tp, [M]ail, [R]")
+        expect(tel, "Select ... [E]phemeris, [F]tp, [M]ail, [R]")
         tel.write("E\n")
 
         # We want Vectors, so we can receive 3D coordinates
-        tel.read_until("Observe, Elements, Vectors  [o,e,v,?] :")
+        expect(tel, "Observe, Elements, Vectors  [o,e,v,?] :")
         tel.write("v\n")
 
-        # We would like to center our coordinates on the sun -- Prompting
-        #   center may be a nice future addition
-        tel.read_until("Coordinate center [ <id>,coord,geo  ] :")
-        tel.write("500@10\n")  # Sun's ID
+        # A new case offers the center used before
+        if expectAny(tel, [r"Coordinate center.*:",
+                           r"Use previous center.*:"]) == 1:
+            tel.write("y\n")
+        else:
+            # We would like to center our coordinates on the sun
+            tel.write(center + "\n")
 
-        # Asks to confirm sun as center
-        tel.read_until("Confirm selected station    [ y/n ] -->")
-        tel.write("y\n")
+            # Asks to confirm sun as center
+            expect(tel, "Confirm selected station    [ y/n ] -->")
+            tel.write("y\n")
 
-        # Our reference plane is in the ecliptical
-        tel.read_until("Reference plane [eclip, frame, body ] :")
-        tel.write("eclip\n")
+            # Our reference plane is in the ecliptical
+            expect(tel, "Reference plane [eclip, frame, body ] :")
+            tel.write(referencePlane + "\n")
 
         # Need to format date to  match string
-        tel.read_until(":")  # Prompt for start date
+        expect(tel, ":")  # Prompt for start date
         tel.write(dateStart.strftime("%Y-%b-%d %H:%M") + "\n")
-        tel.read_until(":")  # Prompt for end date.
+        expect(tel, ":")  # Prompt for end date.
         tel.write(dateEnd.strftime("%Y-%b-%d %H:%M") + "\n")
 
-        # We output once a day with the other methods -- Time may be a nice
-        #   future addition
-        tel.read_until("Output interval [ex: 10m, 1h, 1d, ? ] :")
-        tel.write("1d\n")
-
-        # We want to format the output, so we can read it easier
-        tel.read_until("Accept default output [ cr=(y), n, ?] :")
-        tel.write("n\n")
-
-        # The reference is in J2000 time
-        tel.read_until("Output reference frame [J2000, B1950] :")
-        tel.write("J2000\n")
-
-        # Add the extra accuraccy for Light Time and Speed
-        tel.read_until("Corrections [ 1=NONE, 2=LT, 3=LT+S ]  :")
-        tel.write("3\n")
-
-        # Receive units in Astronomical Units
-        tel.read_until("Output units [1=KM-S, 2=AU-D, 3=KM-D] :")
-        tel.write("2\n")
-        tel.read_until("Spreadsheet CSV format    [ YES, NO ] :")
-        tel.write("YES\n")
-        tel.read_until("Output delta-T (TDB-UT)   [ YES, NO ] :")
-        tel.write("NO\n")
-        tel.read_until("Select output table type  [ 1-6, ?  ] :")
-        tel.write("1\n")
-        tel.read_until('$SOE')
-        results = tel.read_until('$EOE')
-        results = results.split("\r\n")
-        results.remove('')
-        results.remove('$$EOE')
-        planet.horizonX = []
-        planet.horizonY = []
-        planet.horizonZ = []
-        for result in results:
-            values = result.split(", ")
-            planet.horizonX.append(float(values[2]))
-            planet.horizonY.append(float(values[3]))
-            # value Z has a comma hanging on it
-            valueZ = values[4].replace(',', '')
-            planet.horizonZ.append(float(valueZ))
-        tel.close()
-        planet.horizonTime = reporting.endTimer(timer)
+        # We output at the same interval as the other methods
+        expect(tel, "Output interval [ex: 10m, 1h, 1d, ? ] :")
+        tel.write(intervalString(interval) + "\n")
+
+        # A new case offers the output settings used before. Otherwise we
+        #   want to format the output, so we can read it easier
+        if expectAny(tel, [r"Accept default output.*:",
+                           r"Accept previous output.*:"]) == 1:
+            tel.write("y\n")
+        else:
+            tel.write("n\n")
+
+            # The reference is in J2000 time
+            expect(tel, "Output reference frame [J2000, B1950] :")
+            tel.write(referenceFrame + "\n")
+
+            # Add the extra accuraccy for Light Time and Speed
+            expect(tel, "Corrections [ 1=NONE, 2=LT, 3=LT+S ]  :")
+            tel.write(corrections + "\n")
+
+            # Receive units in Astronomical Units
+            expect(tel, "Output units [1=KM-S, 2=AU-D, 3=KM-D] :")
+            tel.write(units + "\n")
+            expect(tel, "Spreadsheet CSV format    [ YES, NO ] :")
+            tel.write("YES\n")
+            expect(tel, "Output delta-T (TDB-UT)   [ YES, NO ] :")
+            tel.write("NO\n")
+            # Table type 2 gives the state vector, the position and velocity
+            expect(tel, "Select output table type  [ 1-6, ?  ] :")
+            tel.write(tableType + "\n")
+
+        expect(tel, '$$SOE')
+        capacity = int((dateToJD(dateEnd) - dateToJD(dateStart)) / interval +
+                       1e-6) + 1
+        trajectory = readVectors(tel, VectorParser(capacity, consumer))
+        self.cases += 1
+        return trajectory
@@ -0,0 +1,109 @@
+###############################
+# FileName: horizonsParser.py
+#
+# Purpose: Reads the vectors Horizons sends between $$SOE and $$EOE as they
+#   arrive, a chunk at a time, instead of waiting for the whole table and
+#   holding it as one string. Each chunk's complete rows are converted at
+#   once into a trajectory allocated for the expected number of points,
+#   keeping the Julian date (TDB) and the velocity of each point, and every
+#   full block of points can be handed on before the rest has arrived.
+###############################
+
+import numpy
+
+from trajectory import Trajectory
+
+# Marks the end of the table
+endMarker = '$$EOE'
+
+# Number of points handed on at a time
+blockPoints = 4096
+
+
+class VectorParser(object):
+
+    ########
+    # Values of VectorParser class
+    ########
+    #
+    # trajectory -> Trajectory, with velocities, of the points read so far
+    # partial -> String, the start of a row whose end has not arrived yet
+    # consumer -> function taking a Trajectory of each block of points, or
+    #   None
+    # delivered -> int, number of points handed to the consumer
+    # done -> boolean, True once the end of the table has been read
+    __slots__ = ['trajectory', 'partial', 'consumer', 'delivered', 'done']
+
+    ################
+    # __init__
+    ################
+    # INPUT:
+    #   capacity - int, number of points expected
+    #   consumer - function, called with a Trajectory of each block of
+    #       blockPoints points as soon as it has been read, and of the points
+    #       left over at the end. The blocks share the parser's buffer
+    def __init__(self, capacity, consumer=None):
+        self.trajectory = Trajectory(capacity, True)
+        self.partial = ''
+        self.consumer = consumer
+        self.delivered = 0
+        self.done = False
+
+    ################
+    # feed
+    ################
+    # Reads the next chunk of the table. Raises ValueError if a row cannot
+    #   be read.
+    #
+    # INPUT:
+    #   text - String, the next chunk received
+    # OUTPUT:
+    #   String, whatever was received after the end of the table, which
+    #       belongs to the next prompt
+    def feed(self, text):
+        text = self.partial + text
+        end = text.find(endMarker)
+        if end >= 0:
+            self.parseRows(text[:end])
+            self.partial = ''
+            self.done = True
+            self.deliver()
+            return text[end + len(endMarker):]
+
+        # Keep the last row until its end arrives
+        last = text.rfind('\n') + 1
+        self.parseRows(text[:last])
+        self.partial = text[last:]
+        self.deliver()
+        return ''
+
+    ################
+    # parseRows
+    ################
+    # Adds the points of complete rows. Each row is
+    #   "JDTDB, Calendar Date (TDB), X, Y, Z, VX, VY, VZ,"
+    def parseRows(self, text):
+        rows = [line.split(',') for line in text.split('\n') if line.strip()]
+        if not rows:
+            return
+        values = numpy.array([row[:1] + row[2:8] for row in rows],
+                             dtype=float)
+        if values.ndim != 2 or values.shape[1] != 7:
+            raise ValueError("incomplete row: " + ",".join(rows[0]))
+        self.trajectory.extend(values[:, 0], values[:, 1], values[:, 2],
+                               values[:, 3], values[:, 4:].T)
+
+    ################
+    # deliver
+    ################
+    # Hands every full block of points to the consumer, and the rest once
+    #   the table has ended
+    def deliver(self):
+        if self.consumer is None:
+            return
+        count = len(self.trajectory)
+        while (count - self.delivered >= blockPoints or
+               (self.done and count > self.delivered)):
+            end = min(count, self.delivered + blockPoints)
+            self.consumer(self.trajectory.view(self.delivered, end))
+            self.delivered = end
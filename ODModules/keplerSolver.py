@@ -0,0 +1,291 @@
+###############################
+# FileName: keplerSolver.py
+#
+# Purpose: Solves Kepler's equation, M = E - e * sin(E), for the eccentric
+#   anomaly E. Every solver works on arrays of mean anomalies and
+#   eccentricities, stops each value once its correction is within the
+#   tolerance (or the iteration limit is reached), and keeps count of the
+#   iterations used in statistics.
+###############################
+
+import numpy
+
+# Available methods. The values match SchlyterCalc.methodForEccen
+#   APPROX => Interpolated from a precomputed table of E - M over mean
+#       anomaly and eccentricity, optionally polished with one Newton step
+#   FIXED_POINT => E1 = M + e * sin(E0), Chapter 30 of Astronomical Algorithms
+#   NEWTON => E1 = E0 + (M + e * sin(E0) - E0) / (1 - e * cos(E0)), with the
+#       correction limited to 0.5 radians as suggested by John M. Steele
+#   HALLEY => Halley's method, started from Danby's guess
+#       E0 = M + 0.85 * e * sign(sin(M))
+APPROX = 0
+FIXED_POINT = 1
+NEWTON = 2
+HALLEY = 3
+
+# Size of the table used by APPROX. The mean anomaly from 0 to 2 pi is split
+#   into tableMeanPoints steps, and the eccentricity from 0 to tableMaxEccen
+#   into tableEccenPoints values. Eccentricities above tableMaxEccen are
+#   solved with HALLEY instead. E changes quickly near perihelion as e
+#   approaches 1. With the Newton step of polishApprox, the error is at
+#   most 2e-10 radians for the planets (e up to 0.25), 4e-10 at e = 0.7,
+#   4e-9 at 0.8 and 2e-7 at 0.9. Above 0.9 it grows to 1e-2 radians at
+#   0.99, so those are solved instead.
+tableMeanPoints = 1024
+tableEccenPoints = 64
+tableMaxEccen = 0.9
+
+# If True, APPROX applies one Newton step to the interpolated value
+polishApprox = True
+
+# The table used by APPROX. Built by buildApproxTable on first use
+approxTable = None
+
+# Iteration counts of every solve since the last resetStatistics
+#   solves -> int, number of calls to solve
+#   samples -> int, number of anomalies solved
+#   iterations -> int, total iterations over all anomalies
+#   maxIterations -> int, most iterations used by a single anomaly
+#   unconverged -> int, anomalies that reached the iteration limit
+statistics = {}
+
+
+###############################
+# solve
+###############################
+# Calculates the eccentric anomaly for each mean anomaly and eccentricity.
+#
+# INPUT:
+#   meanAnom - float or array, mean anomaly in radians
+#   eccen - float or array, eccentricity
+#   method - int, one of APPROX, FIXED_POINT, NEWTON or HALLEY
+#   tolerance - float, radians. A value stops once its correction is smaller
+#   maxIterations - int, the most iterations used for any value
+# OUTPUT:
+#   float or numpy array (matching meanAnom), eccentric anomaly in radians
+def solve(meanAnom, eccen, method=FIXED_POINT, tolerance=1e-9,
+          maxIterations=50):
+    if method not in steps and method != APPROX:
+        raise ValueError("Unknown method for eccentric anomaly: " +
+                         str(method))
+
+    scalar = numpy.ndim(meanAnom) == 0
+    M = numpy.atleast_1d(numpy.asarray(meanAnom, dtype=float))
+    e = numpy.zeros(M.shape) + eccen
+
+    if method == APPROX:
+        E = approximate(M, e, tolerance, maxIterations)
+        if scalar:
+            return float(E[0])
+        return E
+
+    if method == HALLEY:
+        E = M + 0.85 * e * numpy.sign(numpy.sin(M))
+    else:
+        E = M.copy()
+
+    step = steps[method]
+    active = numpy.arange(len(M))
+    iterations = numpy.zeros(len(M), dtype=int)
+    count = 0
+    while len(active) and count < maxIterations:
+        correction = step(E[active], M[active], e[active])
+        E[active] += correction
+        count += 1
+        iterations[active] = count
+        active = active[numpy.abs(correction) > tolerance]
+
+    recordIterations(iterations, len(active))
+
+    if scalar:
+        return float(E[0])
+    return E
+
+
+###############################
+# approximate
+###############################
+# Looks up the eccentric anomaly in the precomputed table with bilinear
+#   interpolation. E - M = e * sin(E) is periodic in M, so the mean anomaly is
+#   reduced to [0, 2 pi) for the lookup.
+#
+# INPUT:
+#   M - numpy array, mean anomaly in radians
+#   e - numpy array, eccentricity
+#   tolerance, maxIterations - used for eccentricities outside the table
+# OUTPUT:
+#   numpy array, eccentric anomaly in radians
+def approximate(M, e, tolerance, maxIterations):
+    table = getApproxTable()
+    values = table['values']
+
+    x = numpy.mod(M, 2 * numpy.pi) / table['meanStep']
+    y = e / table['eccenStep']
+    i = numpy.clip(x.astype(int), 0, tableMeanPoints - 1)
+    j = numpy.clip(y.astype(int), 0, tableEccenPoints - 2)
+    fx = x - i
+    fy = y - j
+
+    lower = values[j, i] * (1 - fx) + values[j, i + 1] * fx
+    upper = values[j + 1, i] * (1 - fx) + values[j + 1, i + 1] * fx
+    E = M + lower * (1 - fy) + upper * fy
+
+    if polishApprox:
+        E += newtonStep(E, M, e)
+
+    # The table does not cover these eccentricities. They are counted by
+    #   solve, so only the anomalies looked up are counted here
+    outside = numpy.nonzero(e > tableMaxEccen)[0]
+    lookedUp = len(M) - len(outside)
+    if polishApprox:
+        recordIterations(numpy.ones(lookedUp, dtype=int), 0)
+    else:
+        recordIterations(numpy.zeros(lookedUp, dtype=int), 0)
+    if len(outside):
+        E[outside] = solve(M[outside], e[outside], HALLEY, tolerance,
+                           maxIterations)
+    return E
+
+
+###############################
+# getApproxTable
+###############################
+# Returns the table used by APPROX, building it the first time
+def getApproxTable():
+    global approxTable
+    if approxTable is None:
+        approxTable = buildApproxTable(tableMeanPoints, tableEccenPoints,
+                                       tableMaxEccen)
+    return approxTable
+
+
+###############################
+# buildApproxTable
+###############################
+# Solves Kepler's equation over a grid of mean anomalies and eccentricities.
+#
+# INPUT:
+#   numMean - int, number of steps from 0 to 2 pi
+#   numEccen - int, number of eccentricities from 0 to maxEccen
+#   maxEccen - float, the largest eccentricity in the table
+# OUTPUT:
+#   dict, containing
+#       values -> numpy array (numEccen, numMean + 1), E - M at each point
+#       meanStep -> float, step between mean anomalies
+#       eccenStep -> float, step between eccentricities
+def buildApproxTable(numMean, numEccen, maxEccen):
+    meanStep = 2 * numpy.pi / numMean
+    eccenStep = float(maxEccen) / (numEccen - 1)
+    M, e = numpy.meshgrid(numpy.arange(numMean + 1) * meanStep,
+                          numpy.arange(numEccen) * eccenStep)
+
+    # The table is built with the tightest tolerance, and is not counted in
+    #   the statistics
+    counts = statistics.copy()
+    E = solve(M.ravel(), e.ravel(), HALLEY, 1e-15, 100)
+    statistics.update(counts)
+
+    return {
+        'values': E.reshape(M.shape) - M,
+        'meanStep': meanStep,
+        'eccenStep': eccenStep,
+    }
+
+
+###############################
+# fixedPointStep
+###############################
+# Returns the correction to E for the fixed point iteration
+def fixedPointStep(E, M, e):
+    return M + e * numpy.sin(E) - E
+
+
+###############################
+# newtonStep
+###############################
+# Returns the correction to E for Newton's method
+def newtonStep(E, M, e):
+    correction = (M + e * numpy.sin(E) - E) / (1 - e * numpy.cos(E))
+    return numpy.clip(correction, -.5, .5)
+
+
+###############################
+# halleyStep
+###############################
+# Returns the correction to E for Halley's method
+#
+# f = E - e * sin(E) - M, f' = 1 - e * cos(E), f'' = e * sin(E)
+# dE = -f / (f' - f * f'' / (2 * f'))
+def halleyStep(E, M, e):
+    eSin = e * numpy.sin(E)
+    f = E - eSin - M
+    fPrime = 1 - e * numpy.cos(E)
+    return -f / (fPrime - f * eSin / (2 * fPrime))
+
+
+# The step function used by each method
+steps = {FIXED_POINT: fixedPointStep, NEWTON: newtonStep, HALLEY: halleyStep}
+
+
+###############################
+# recordIterations
+###############################
+# Adds the iterations used by a solve to statistics
+#
+# INPUT:
+#   iterations - numpy array, iterations used for each anomaly
+#   unconverged - int, number of anomalies that reached the limit
+def recordIterations(iterations, unconverged):
+    statistics['solves'] += 1
+    statistics['samples'] += len(iterations)
+    statistics['iterations'] += int(iterations.sum())
+    if len(iterations):
+        statistics['maxIterations'] = max(statistics['maxIterations'],
+                                          int(iterations.max()))
+    statistics['unconverged'] += unconverged
+
+
+###############################
+# mergeStatistics
+###############################
+# Adds the statistics of solves made elsewhere, i.e. in a worker process
+#
+# INPUT:
+#   counts - dict, a copy of another process' statistics
+def mergeStatistics(counts):
+    for key in ('solves', 'samples', 'iterations', 'unconverged'):
+        statistics[key] += counts[key]
+    statistics['maxIterations'] = max(statistics['maxIterations'],
+                                      counts['maxIterations'])
+
+
+###############################
+# resetStatistics
+###############################
+# Sets every count in statistics back to zero
+def resetStatistics():
+    statistics['solves'] = 0
+    statistics['samples'] = 0
+    statistics['iterations'] = 0
+    statistics['maxIterations'] = 0
+    statistics['unconverged'] = 0
+
+
+###############################
+# statisticsString
+###############################
+# Returns a one line summary of statistics, i.e.
+#   "Kepler solver: 365 anomalies, 4.12 iterations on average, 6 at most,
+#   0 unconverged"
+def statisticsString():
+    average = 0
+    if statistics['samples']:
+        average = float(statistics['iterations']) / statistics['samples']
+    out = "Kepler solver: " + str(statistics['samples']) + " anomalies, "
+    out += '{0:.2f}'.format(average) + " iterations on average, "
+    out += str(statistics['maxIterations']) + " at most, "
+    out += str(statistics['unconverged']) + " unconverged"
+    return out
+
+
+resetStatistics()
@@ -0,0 +1,259 @@
+###############################
+# FileName: parallelRunner.py
+#
+# Purpose: Calculates the Schlyter and VSOP87 points of several planets in
+#   parallel. Each (planet, method, date chunk) is a separate job, run by a
+#   pool of worker processes that each open their own PlanetDBInterface.
+#   The results are added to the planets in the same order as the serial
+#   calculation in orbital_drift.py.
+#
+#   A single long trajectory is instead split into chunks that the workers
+#   read from and write to a shared memory buffer, so the points are never
+#   pickled between processes (see runLongTrajectory).
+###############################
+
+import math
+import multiprocessing
+import numpy
+
+from planetDBInterface import PlanetDBInterface
+from planet import Planet
+from trajectory import Trajectory
+import SchlyterCalc
+import VSOP87
+import keplerSolver
+import reporting
+
+# Chunks smaller than this many days are not worth sending to a worker
+minChunkDays = 64
+
+# Number of chunks given to each worker by runLongTrajectory
+chunksPerJob = 4
+
+# The database interface of a worker process. Set by initWorker
+workerDB = None
+
+# The shared buffer of a worker process running runLongTrajectory chunks. Row
+#   0 holds the times, and rows 1 to 3 the X, Y and Z values. Set by
+#   initSharedWorker
+sharedPoints = None
+
+
+###############################
+# getSettings
+###############################
+# Returns the module options that affect the results, so the workers can be
+#   given the same options as the main process
+def getSettings():
+    return {
+        'truncation': VSOP87.truncation,
+        'methodForEccen': SchlyterCalc.methodForEccen,
+        'accuracy': SchlyterCalc.accuracy,
+        'maxIterations': SchlyterCalc.maxIterations,
+    }
+
+
+###############################
+# initWorker
+###############################
+# Opens the worker's database interface and applies the main process'
+#   options. Runs once in each worker process.
+#
+# INPUT:
+#   settings - dict, as returned by getSettings
+def initWorker(settings):
+    global workerDB
+    workerDB = PlanetDBInterface()
+    VSOP87.truncation = settings['truncation']
+    SchlyterCalc.methodForEccen = settings['methodForEccen']
+    SchlyterCalc.accuracy = settings['accuracy']
+    SchlyterCalc.maxIterations = settings['maxIterations']
+
+
+###############################
+# initSharedWorker
+###############################
+# Runs initWorker, and wraps the shared buffer as a numpy array without
+#   copying it.
+#
+# INPUT:
+#   settings - dict, as returned by getSettings
+#   buffer - multiprocessing.RawArray, 4 * numPoints doubles
+#   numPoints - int, number of points in the trajectory
+def initSharedWorker(settings, buffer, numPoints):
+    global sharedPoints
+    initWorker(settings)
+    sharedPoints = numpy.frombuffer(buffer, dtype=float).reshape(4, numPoints)
+
+
+###############################
+# runJob
+###############################
+# Calculates one chunk of a planet's points in a worker process.
+#
+# INPUT:
+#   job - tuple (planet name, method, times). The times are Schlyter day
+#       numbers for "Sch", and Julian millennia for "VSO"
+# OUTPUT:
+#   tuple (X, Y, Z, time taken, keplerSolver.statistics of the job)
+def runJob(job):
+    name, method, times = job
+    keplerSolver.resetStatistics()
+    timer = reporting.startTimer()
+    planet = Planet(name, 0000, workerDB.getPlanet(name))
+    if method == "Sch":
+        planet.setElementsDict(workerDB)
+        planet.setSchlyterTerms(workerDB)
+        X, Y, Z = SchlyterCalc.runSchlyterCalcBatch(planet, times)
+    else:
+        X, Y, Z = VSOP87.runVSOP87Batch(planet, times, workerDB.cursor)
+    return (X, Y, Z, reporting.endTimer(timer),
+            dict(keplerSolver.statistics))
+
+
+###############################
+# runSharedJob
+###############################
+# Calculates one chunk of a long trajectory in a worker process, reading the
+#   times from and writing the points to the shared buffer.
+#
+# INPUT:
+#   job - tuple (planet name, method, first index, number of points)
+# OUTPUT:
+#   tuple (time taken, keplerSolver.statistics of the job)
+def runSharedJob(job):
+    name, method, start, count = job
+    end = start + count
+    X, Y, Z, timeTaken, counts = runJob((name, method,
+                                         sharedPoints[0, start:end]))
+    sharedPoints[1, start:end] = X
+    sharedPoints[2, start:end] = Y
+    sharedPoints[3, start:end] = Z
+    return (timeTaken, counts)
+
+
+###############################
+# runLongTrajectory
+###############################
+# Calculates a single planet and method over a long array of times, split
+#   into chunks across a pool of worker processes. The times and the results
+#   are kept in a multiprocessing.RawArray shared by every worker.
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch" or "VSO"
+#   times - array of Schlyter day numbers for "Sch", or Julian millennia for
+#       "VSO"
+#   jobs - int, number of worker processes
+# OUTPUT:
+#   tuple of numpy arrays (X, Y, Z, time taken). The solver's iterations
+#       are added to keplerSolver.statistics
+def runLongTrajectory(planet, method, times, jobs):
+    numPoints = len(times)
+    buffer = multiprocessing.RawArray('d', 4 * numPoints)
+    points = numpy.frombuffer(buffer, dtype=float).reshape(4, numPoints)
+    points[0] = times
+
+    size = int(math.ceil(float(numPoints) / (jobs * chunksPerJob)))
+    size = max(size, minChunkDays)
+    jobList = [(planet.name, method, start, min(size, numPoints - start))
+               for start in range(0, numPoints, size)]
+
+    pool = multiprocessing.Pool(jobs, initSharedWorker,
+                                (getSettings(), buffer, numPoints))
+    try:
+        results = pool.map(runSharedJob, jobList, 1)
+    finally:
+        pool.close()
+        pool.join()
+
+    # The solver's iterations were counted in the workers
+    timeTaken = 0
+    for jobTime, counts in results:
+        timeTaken += jobTime
+        keplerSolver.mergeStatistics(counts)
+    return (points[1], points[2], points[3], timeTaken)
+
+
+###############################
+# createJobs
+###############################
+# Splits the calculations into jobs. Each planet and method is split into
+#   enough chunks that every worker has about two jobs.
+#
+# INPUT:
+#   work - list of (planet, method) to calculate, method is "Sch" or "VSO"
+#   schlyterDays - array of day numbers for the Schlyter method
+#   vsopTimes - array of Julian millennia for the VSOP87 method
+#   jobs - int, number of worker processes
+# OUTPUT:
+#   list of jobs, in the order of work
+#   list of (planet, method, number of chunks), in the same order
+def createJobs(work, schlyterDays, vsopTimes, jobs):
+    numDays = len(schlyterDays)
+    chunks = int(math.ceil(2.0 * jobs / max(1, len(work))))
+    chunks = max(1, min(chunks, numDays // minChunkDays))
+    size = int(math.ceil(float(numDays) / chunks))
+
+    jobList = []
+    layout = []
+    for planet, method in work:
+        times = schlyterDays if method == "Sch" else vsopTimes
+        starts = range(0, numDays, size)
+        for start in starts:
+            jobList.append((planet.name, method, times[start:start + size]))
+        layout.append((planet, method, len(starts)))
+    return jobList, layout
+
+
+###############################
+# runJobs
+###############################
+# Calculates the Schlyter and VSOP87 points of each planet and method using
+#   a pool of worker processes, and adds them to the planets' trajectories.
+#
+# INPUT:
+#   work - list of (planet, method) to calculate, method is "Sch" or "VSO"
+#   schlyterJDs - array of Julian dates for the Schlyter method
+#   vsopJDs - array of Julian dates for the VSOP87 method
+#   jobs - int, number of worker processes
+def runJobs(work, schlyterJDs, vsopJDs, jobs):
+    schlyterJDs = numpy.asarray(schlyterJDs, dtype=float)
+    vsopJDs = numpy.asarray(vsopJDs, dtype=float)
+    schlyterDays = schlyterJDs - SchlyterCalc.epochJD
+    vsopTimes = VSOP87.calculateJMillenia(vsopJDs)
+
+    if len(work) == 1:
+        # A single trajectory is shared between the workers instead
+        planet, method = work[0]
+        times = schlyterDays if method == "Sch" else vsopTimes
+        X, Y, Z, timeTaken = runLongTrajectory(planet, method, times, jobs)
+        # Its solver's iterations are already counted
+        results = [(X, Y, Z, timeTaken, None)]
+        layout = [(planet, method, 1)]
+    else:
+        jobList, layout = createJobs(work, schlyterDays, vsopTimes, jobs)
+        pool = multiprocessing.Pool(jobs, initWorker, (getSettings(),))
+        try:
+            results = pool.map(runJob, jobList, 1)
+        finally:
+            pool.close()
+            pool.join()
+
+    # Merge the chunks back in order
+    index = 0
+    for planet, method, numChunks in layout:
+        chunks = results[index:index + numChunks]
+        index += numChunks
+        jds = schlyterJDs if method == "Sch" else vsopJDs
+        trajectory = Trajectory(len(jds))
+        start = 0
+        for X, Y, Z, timeTaken, counts in chunks:
+            end = start + len(X)
+            trajectory.extend(jds[start:end], X, Y, Z)
+            planet.addCalculationTime(method, timeTaken)
+            # The solver's iterations were counted in the workers
+            if counts is not None:
+                keplerSolver.mergeStatistics(counts)
+            start = end
+        planet.trajectories[method] = trajectory
@@ -0,0 +1,206 @@
+###############################
+# FileName: pipeline.py
+#
+# Purpose: Calculates long date ranges as a stream of fixed size blocks of
+#   points, so that the memory used does not grow with the range and the
+#   output starts before the calculation ends. Each stage is a generator
+#   that takes the blocks of the stage before it:
+#
+#   gridBlocks -> engineBlocks -> combineStreams -> frameBlocks
+#       -> accumulateBlocks -> writeBlocks
+#
+#   There is one grid and engine stream for each planet and method. The
+#   Horizons results take the place of an engine with arrivingBlocks, which
+#   hands on the points as Horizons sends them. The streams are then
+#   advanced together, so every later stage receives a row of (planet,
+#   method, Trajectory) for the same block of times.
+###############################
+
+import itertools
+import numpy
+
+import reporting
+from trajectory import joinTrajectories
+
+# Number of points in each block
+blockPoints = 4096
+
+
+###############################
+# gridBlocks
+###############################
+# Yields the Julian dates of a timeGrid.TimeGrid, blockPoints at a time
+def gridBlocks(grid):
+    for block in grid.blocks(blockPoints):
+        yield block.jds()
+
+
+###############################
+# engineBlocks
+###############################
+# Yields the points of a planet for each block of Julian dates, and adds the
+#   time taken to the planet's calculationTimes
+#
+# INPUT:
+#   planet - planet object to be used
+#   method - String, "Sch", "VSO" or "Hor"
+#   grid - iterable of arrays of Julian dates, i.e. from gridBlocks
+#   calculate - function, takes an array of Julian dates and returns a
+#       Trajectory of the points at those dates
+def engineBlocks(planet, method, grid, calculate):
+    for jds in grid:
+        timer = reporting.startTimer()
+        block = calculate(jds)
+        planet.addCalculationTime(method, reporting.endTimer(timer))
+        yield block
+
+
+###############################
+# arrivingBlocks
+###############################
+# Yields the points for each block of Julian dates as they arrive from
+#   another thread, i.e. from Horizons while it is still sending them (see
+#   horizonsCache.retrieveTrajectories). The points arrive in order, in
+#   blocks of any size, and None marks their end.
+#
+# INPUT:
+#   grid - iterable of arrays of Julian dates, i.e. from gridBlocks
+#   arriving - Queue.Queue of Trajectory, the points as they arrive
+#   finish - function called if the points end early, which raises
+#       whatever ended them
+def arrivingBlocks(grid, arriving, finish):
+    parts = []
+    count = 0
+    for jds in grid:
+        while count < len(jds):
+            part = arriving.get()
+            if part is None:
+                finish()
+                raise ValueError("fewer points arrived than requested")
+            parts.append(part)
+            count += len(part)
+
+        # Keep the points after this block for the next one
+        joined = joinTrajectories(parts)
+        parts = [joined.view(len(jds), count)]
+        count -= len(jds)
+        yield joined.view(0, len(jds))
+
+
+###############################
+# combineStreams
+###############################
+# Advances the streams of every planet and method together
+#
+# INPUT:
+#   streams - list of (planet, method, blocks), blocks being a generator
+#       such as engineBlocks. Every stream must have the same block sizes
+# OUTPUT:
+#   Yields a list of (planet, method, Trajectory) for each block of times
+def combineStreams(streams):
+    keys = [(planet, method) for planet, method, blocks in streams]
+    for blocks in itertools.izip(*[stream[2] for stream in streams]):
+        yield [(planet, method, block)
+               for (planet, method), block in zip(keys, blocks)]
+
+
+###############################
+# frameBlocks
+###############################
+# Moves each row's points to be relative to an origin planet (see
+#   frameTransform). The origin's own points are taken from the row, so the
+#   origin must be streamed for every method. The origin's points that were
+#   only streamed to center the planets are not passed on.
+#
+# INPUT:
+#   rows - generator of rows, as from combineStreams
+#   origin - planet object used as the center, or False for heliocentric
+#       coordinates
+#   planets - list of the planet objects requested
+def frameBlocks(rows, origin, planets):
+    for row in rows:
+        if origin is False:
+            yield row
+            continue
+        centers = {}
+        for planet, method, block in row:
+            if planet is origin:
+                centers[method] = block
+        yield [(planet, method, block.relativeTo(centers[method]))
+               for planet, method, block in row
+               if planet in planets and
+               (method in planet.method or method == "Hor")]
+
+
+###############################
+# accumulateBlocks
+###############################
+# Adds each row to a reporting.DifferenceAccumulator and passes it on
+def accumulateBlocks(rows, accumulator):
+    for row in rows:
+        accumulator.add(row)
+        yield row
+
+
+###############################
+# writeBlocks
+###############################
+# Writes the points of each row to a CSV file as soon as they are
+#   calculated, one line per planet, method and point:
+#   Planet,Method,JD,X,Y,Z
+#
+# INPUT:
+#   rows - generator of rows
+#   output - String, file to write to. '' passes the rows on without writing
+def writeBlocks(rows, output):
+    if output == '':
+        for row in rows:
+            yield row
+        return
+
+    f = open(output, 'w')
+    try:
+        f.write("Planet,Method,JD,X,Y,Z\n")
+        for row in rows:
+            for planet, method, block in row:
+                values = numpy.column_stack(
+                    (block.times, block.X, block.Y, block.Z))
+                numpy.savetxt(f, values, delimiter=',',
+                              fmt=[planet.name + ',' + method + ',%.6f',
+                                   '%.12f', '%.12f', '%.12f'])
+            f.flush()
+            yield row
+    finally:
+        f.close()
+
+
+###############################
+# runPipeline
+###############################
+# Streams every planet and method through the stages, and outputs the
+#   difference file once every block has been calculated.
+#
+# INPUT:
+#   streams - list of (planet, method, blocks), as for combineStreams
+#   origin - planet object used as the center, or False
+#   planets - list of the planet objects requested
+#   horizon - boolean, if True, the differences to Horizons are included
+#   differenceOutput - String, file for the difference file, '' for stdout,
+#       or None to not output it
+#   pointsOutput - String, CSV file for the points, '' to not write them
+#   finish - function called once every block has been calculated, before
+#       the difference file is output, or None
+def runPipeline(streams, origin, planets, horizon, differenceOutput,
+                pointsOutput, finish=None):
+    accumulator = reporting.DifferenceAccumulator(horizon)
+    rows = combineStreams(streams)
+    rows = frameBlocks(rows, origin, planets)
+    rows = accumulateBlocks(rows, accumulator)
+    rows = writeBlocks(rows, pointsOutput)
+    for row in rows:
+        pass
+
+    if finish is not None:
+        finish()
+    if differenceOutput is not None:
+        accumulator.output(differenceOutput)
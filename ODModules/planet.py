@@ -8,17 +8,23 @@
 
 import math
 
+from trajectory import Trajectory
 
-class Planet:
+
+class Planet(object):
 
     ########
     # Values of Planet class
     ########
     #
     # name -> String, name of planet
-    # orbitX -> array
-    # orbitY -> array
-    # orbitZ -> array
+    # method -> list of the methods to calculate, "Sch" or "VSO"
+    # trajectories -> dict, maps each method ("Sch", "VSO", or "Hor" for
+    #   Horizons) to the Trajectory of points calculated with it
+    # heliocentric -> dict, the heliocentric trajectories once the planet
+    #   has been centred on another body by frameTransform, otherwise None
+    # calculationTimes -> dict, maps each method to the time taken to
+    #   calculate its trajectory
     #
     # NOTE: All orbital elements are updated constantly while drawing the
     #   orbits. There is currently no tracking of these values while graphing.
@@ -41,6 +47,19 @@ class Planet:
     # xAnom -> float, x Anomaly
     # yAnom -> float, y Anomaly
     # anom -> true Anomaly
+    #
+    # The "Hor" trajectory added by horizonsConnection also holds the
+    #   heliocentric velocity on each day.
+
+    # Every value a planet can hold. Planets are created for each method and
+    #   worker, so they have no __dict__
+    __slots__ = [
+        'epoch', 'name', 'id', 'num_moons', 'size_ratio', 'color',
+        'orbit_color', 'elements', 'method', 'trajectories',
+        'heliocentric', 'calculationTimes',
+        'eclipLong', 'helioLat', 'radVector',
+        'longAscNode', 'incElip', 'argPerih', 'semiMajAx', 'meanAnom',
+        'eccen', 'eccenAnom', 'distance', 'xAnom', 'yAnom', 'anom']
 
     ################
     # __init__
@@ -57,14 +76,34 @@ class Planet:
             self.color = dbResults['default_color']
             self.orbit_color = dbResults['default_orbit_color']
             self.elements = {}
-            self.orbitXSchlyter = []
-            self.orbitYSchlyter = []
-            self.orbitZSchlyter = []
-            self.orbitXVSOP = []
-            self.orbitYVSOP = []
-            self.orbitZVSOP = []
+            self.trajectories = {}
+            self.heliocentric = None
+            self.calculationTimes = {}
             self.method = []
 
+    ###############################
+    # getTrajectory
+    ###############################
+    # Returns the trajectory for a method, creating an empty one if the
+    #   method has not been calculated yet
+    #
+    # INPUT:
+    #   method - String, "Sch", "VSO" or "Hor"
+    #   capacity - int, number of points to allocate space for if created
+    #   velocity - boolean, if True and created, it also holds velocities
+    def getTrajectory(self, method, capacity=0, velocity=False):
+        if method not in self.trajectories:
+            self.trajectories[method] = Trajectory(capacity, velocity)
+        return self.trajectories[method]
+
+    ###############################
+    # addCalculationTime
+    ###############################
+    # Adds to the time taken to calculate a method
+    def addCalculationTime(self, method, seconds):
+        self.calculationTimes[method] = (
+            self.calculationTimes.get(method, 0) + seconds)
+
     ###############################
     # setElements
     ###############################
@@ -6,7 +6,7 @@
 
 import time
 import sys
-import math
+import numpy
 
 # If True, only calculates time actively spent on this process
 noSleep = False
@@ -20,13 +20,18 @@ noAdvancedTime = (sys.version_info < (3, 3))
 ###############################
 # Starts a "timer" for tracking calculations
 #   Records and saves current time
-def startTimer():
+#   If wall is True, the time that passes is measured even while this
+#   process waits, i.e. on worker processes
+def startTimer(wall=False):
     global noSleep
     global noAdvancedTime
 
     if(noAdvancedTime):
-        timer = time.clock()
-    elif(noSleep):
+        if(wall):
+            timer = time.time()
+        else:
+            timer = time.clock()
+    elif(noSleep and not wall):
         timer = time.process_time()
     else:
         timer = time.perf_counter()
@@ -39,13 +44,16 @@ def startTimer():
 # Ends a "timer" for tracking calculations
 #   Subtracts the time recorded in startTimer from the current time
 #   Returns the time object with the difference
-def endTimer(timer):
+#   wall must match the value given to startTimer
+def endTimer(timer, wall=False):
     global noSleep
     global noAdvancedTime
 
     if(noAdvancedTime):
+        if(wall):
+            return time.time() - timer
         return time.clock() - timer
-    elif(noSleep):
+    elif(noSleep and not wall):
         return time.process_time() - timer
     else:
         return time.perf_counter() - timer
@@ -57,12 +65,16 @@ def endTimer(timer):
 # Calculates the average difference between the values in A and B
 #   i.e. A[0] - B[0] + A[1] - B[1] ... / numItems
 def calculateDifference(valuesA, valuesB):
-    total = 0
     if(len(valuesA) != len(valuesB)):
         return null
-    for i in range(0, len(valuesB)):
-        total += (valuesB[i] - valuesA[i])
-    return total / len(valuesB)
+    return float(numpy.mean(numpy.asarray(valuesB) - numpy.asarray(valuesA)))
+
+
+# The pairs of methods compared in the difference file, in order
+comparisons = [("Sch", "VSO"), ("VSO", "Hor"), ("Sch", "Hor")]
+
+# The name of each method in the difference file
+methodNames = {"Sch": "Schlyter", "VSO": "VSOP87", "Hor": "Horizon"}
 
 
 ###############################
@@ -71,8 +83,6 @@ def calculateDifference(valuesA, valuesB):
 # Creates and outputs the difference file, which lists
 #   the average differences between the three methods
 #   coordinates
-#   NOTE: This is sloppy. This should be more functionized.
-#       If time, split into several functions to be DRY.
 def outputDifferenceFile(planets, output, horizon):
     # Header lines
     header = ["Planet", "DiffX", "DiffY", "DiffZ", "DiffDis", "Method1",
@@ -80,132 +90,133 @@ def outputDifferenceFile(planets, output, horizon):
     headerOutput = 0  # We have not yet outputted the header
 
     for p in planets:
-        # Compate VSOP87 and Schlyter
-        if('VSO' in p.method and 'Sch' in p.method):
-            # If the header has not been output, output it
-            if not headerOutput:
-                addHeaderLine(output, header)
-                headerOutput = True
-            line = []
-            line.append(p.name)
-            # Calculate difference between x,y and z
-            line.append(calculateDifference(p.orbitXSchlyter, p.orbitXVSOP))
-            line.append(calculateDifference(p.orbitYSchlyter, p.orbitYVSOP))
-            line.append(calculateDifference(p.orbitZSchlyter, p.orbitZVSOP))
-
-            # Now we want to calculate the average distance from each point
-            # To do this, first subtract each point in method B from method A
-            x = []
-            x[:] = [p.orbitXSchlyter[i] - p.orbitXVSOP[i]
-                    for i in range(0, len(p.orbitXSchlyter))]
-            y = []
-            y[:] = [p.orbitYSchlyter[i] - p.orbitYVSOP[i]
-                    for i in range(0, len(p.orbitYSchlyter))]
-            z = []
-            z[:] = [p.orbitZSchlyter[i] - p.orbitZVSOP[i]
-                    for i in range(0, len(p.orbitZSchlyter))]
-            # Now that we have the difference between each x, y, and z,
-            #   calculate the distance of each set of points
-            d1 = distance(x, y, z)
-
-            # Now d1 contains the distances between each point
-            # Get the average distance by summing each and dividing
-            line.append(sum(d1)/len(d1))
-
-            # Add method names
-            line.append("Schlyter")
-            line.append('VSOP87')
-
-            # Add execution times
-            line.append(p.SchlyterTime)
-            line.append(p.VSOPTime)
-
-            # output line
-            addLine(output, line)
+        methods = list(p.method)
+        if horizon:
+            methods.append("Hor")
 
-        # Compare VSOP87 and Horizon
-        if('VSO' in p.method and horizon):
+        for methodA, methodB in comparisons:
+            if methodA not in methods or methodB not in methods:
+                continue
             # If the header has not been output, output it
             if not headerOutput:
                 addHeaderLine(output, header)
                 headerOutput = True
-            line = []
-            line.append(p.name)
-            # Calculate difference between x,y and z
-            line.append(calculateDifference(p.orbitXVSOP, p.horizonX))
-            line.append(calculateDifference(p.orbitYVSOP, p.horizonY))
-            line.append(calculateDifference(p.orbitZVSOP, p.horizonZ))
-
-            # Now we want to calculate the average distance from each point
-            # To do this, first subtract each point in method B from method A
-            x = []
-            x[:] = [p.orbitXVSOP[i] - p.horizonX[i]
-                    for i in range(0, len(p.orbitXVSOP))]
-            y = []
-            y[:] = [p.orbitYVSOP[i] - p.horizonY[i]
-                    for i in range(0, len(p.orbitYVSOP))]
-            z = []
-            z[:] = [p.orbitZVSOP[i] - p.horizonZ[i]
-                    for i in range(0, len(p.orbitZVSOP))]
-            # Now that we have the difference between each x, y, and z,
-            #   calculate the distance of each set of points
-            d1 = distance(x, y, z)
-
-            # Now d1 contains the distances between each point
-            # Get the average distance by summing each and dividing
-            line.append(sum(d1)/len(d1))
-
-            # Add method names
-            line.append("VSOP87")
-            line.append('Horizon')
-
-            # Add execution times
-            line.append(p.VSOPTime)
-            line.append(p.horizonTime)
-
-            # Output line
-            addLine(output, line)
+            addLine(output, compareMethods(p, methodA, methodB))
 
-        # Compare Schlyter and Horizon
-        if('Sch' in p.method and horizon):
-            if not headerOutput:
-                addHeaderLine(output, header)
-                headerOutput = True
-            line = []
-            line.append(p.name)
-            # Calculate difference between x,y and z
-            line.append(calculateDifference(p.orbitXSchlyter, p.horizonX))
-            line.append(calculateDifference(p.orbitXSchlyter, p.horizonY))
-            line.append(calculateDifference(p.orbitXSchlyter, p.horizonZ))
-
-            # Now we want to calculate the average distance from each point
-            # To do this, first subtract each point in method B from method A
-            x = []
-            x[:] = [p.orbitXSchlyter[i] - p.horizonX[i]
-                    for i in range(0, len(p.orbitXSchlyter))]
-            y = []
-            y[:] = [p.orbitYSchlyter[i] - p.horizonY[i]
-                    for i in range(0, len(p.orbitYSchlyter))]
-            z = []
-            z[:] = [p.orbitZSchlyter[i] - p.horizonZ[i]
-                    for i in range(0, len(p.orbitZSchlyter))]
-            # Now that we have the difference between each x, y, and z,
-            #   calculate the distance of each set of points
-            d1 = distance(x, y, z)
-
-            # Now d1 contains the distances between each point
-            # Get the average distance by summing each and dividing
-            line.append(sum(d1)/len(d1))
-
-            # Add method names
-            line.append("Schlyter")
-            line.append('Horizon')
-
-            # Add execution times
-            line.append(p.SchlyterTime)
-            line.append(p.horizonTime)
-
-            # Output line
+
+###############################
+# compareMethods
+###############################
+# Creates the difference file line comparing two of a planet's trajectories
+#
+# INPUT:
+#   p - planet object
+#   methodA, methodB - String, "Sch", "VSO" or "Hor"
+# OUTPUT:
+#   list, the values of the line
+def compareMethods(p, methodA, methodB):
+    a = p.trajectories[methodA]
+    b = p.trajectories[methodB]
+
+    line = []
+    line.append(p.name)
+    # Calculate difference between x,y and z
+    line.append(calculateDifference(a.X, b.X))
+    line.append(calculateDifference(a.Y, b.Y))
+    line.append(calculateDifference(a.Z, b.Z))
+
+    # Now we want to calculate the average distance from each point, from the
+    #   difference between each x, y, and z
+    d1 = distance(a.X - b.X, a.Y - b.Y, a.Z - b.Z)
+    line.append(float(numpy.mean(d1)))
+
+    # Add method names
+    line.append(methodNames[methodA])
+    line.append(methodNames[methodB])
+
+    # Add execution times
+    line.append(p.calculationTimes[methodA])
+    line.append(p.calculationTimes[methodB])
+    return line
+
+
+###############################
+# DifferenceAccumulator
+###############################
+# Builds the same difference file as outputDifferenceFile from blocks of
+#   points, as they are calculated by pipeline.py, by keeping running sums
+#   of the differences instead of the points themselves.
+class DifferenceAccumulator(object):
+
+    ########
+    # Values of DifferenceAccumulator class
+    ########
+    #
+    # horizon -> boolean, if True, the differences to Horizons are included
+    # totals -> dict, maps (planet, methodA, methodB) to a numpy array of the
+    #   sums of the X, Y and Z differences and of the distances, and the
+    #   number of points
+    # order -> list of the keys of totals, in the order first added
+    def __init__(self, horizon):
+        self.horizon = horizon
+        self.totals = {}
+        self.order = []
+
+    ################
+    # add
+    ################
+    # Adds the differences of one block of days
+    #
+    # INPUT:
+    #   row - list of (planet, method, Trajectory), all covering the same days
+    def add(self, row):
+        blocks = {}
+        planets = []
+        for p, method, block in row:
+            if p not in blocks:
+                blocks[p] = {}
+                planets.append(p)
+            blocks[p][method] = block
+
+        for p in planets:
+            methods = list(p.method)
+            if self.horizon:
+                methods.append("Hor")
+
+            for methodA, methodB in comparisons:
+                if methodA not in methods or methodB not in methods:
+                    continue
+                a = blocks[p][methodA]
+                b = blocks[p][methodB]
+                key = (p, methodA, methodB)
+                if key not in self.totals:
+                    self.totals[key] = numpy.zeros(5)
+                    self.order.append(key)
+                d1 = distance(a.X - b.X, a.Y - b.Y, a.Z - b.Z)
+                self.totals[key] += (numpy.sum(b.X - a.X),
+                                     numpy.sum(b.Y - a.Y),
+                                     numpy.sum(b.Z - a.Z),
+                                     numpy.sum(d1), len(a))
+
+    ################
+    # output
+    ################
+    # Outputs the difference file of the averages of everything added
+    def output(self, output):
+        header = ["Planet", "DiffX", "DiffY", "DiffZ", "DiffDis", "Method1",
+                  "Method2", "M1Time", "M2Time"]
+        if self.order:
+            addHeaderLine(output, header)
+
+        for key in self.order:
+            p, methodA, methodB = key
+            totals = self.totals[key]
+            line = [p.name]
+            line.extend(float(total / totals[4]) for total in totals[:4])
+            line.append(methodNames[methodA])
+            line.append(methodNames[methodB])
+            line.append(p.calculationTimes[methodA])
+            line.append(p.calculationTimes[methodB])
             addLine(output, line)
 
 
@@ -251,10 +262,7 @@ def addLine(output, values):
 def distance(xVals, yVals, zVals):
     if(len(xVals) != len(yVals) or len(xVals) != len(zVals)):
         return false
-    distance = []
-    for i in range(0, len(xVals)):
-        x = math.pow(xVals[i], 2)
-        y = math.pow(yVals[i], 2)
-        z = math.pow(zVals[i], 2)
-        distance.append(math.sqrt(x + y + z))
-    return distance
+    xVals = numpy.asarray(xVals)
+    yVals = numpy.asarray(yVals)
+    zVals = numpy.asarray(zVals)
+    return numpy.sqrt(xVals * xVals + yVals * yVals + zVals * zVals)
@@ -0,0 +1,166 @@
+###############################
+# FileName: timeGrid.py
+#
+# Purpose: Describes the times the planets are calculated at: evenly spaced
+#   Julian dates from a start date, at any step from minutes to months. The
+#   whole grid is converted at once to the times each method uses, Schlyter
+#   day numbers or VSOP87 Julian millennia, instead of converting one date
+#   at a time.
+###############################
+
+import re
+import math
+import numpy
+
+import SchlyterCalc
+import VSOP87
+
+# Length in days of each unit a step can be given in. A month is the mean
+#   Julian month, so that a monthly grid is still evenly spaced
+stepUnits = {'m': 1 / 1440.0, 'h': 1 / 24.0, 'd': 1.0, 'w': 7.0,
+             'mo': 365.25 / 12}
+
+# Julian dates closer than this, in days, are treated as the same
+tolerance = 1e-6
+
+
+###############################
+# parseStep
+###############################
+# Converts a step such as "30m", "6h", "1d", "2w" or "1mo" to days. A number
+#   with no unit is in days.
+#
+# OUTPUT:
+#   float, days, or None if the step could not be read
+def parseStep(text):
+    match = re.match(r'^([0-9]*\.?[0-9]+)(mo|m|h|d|w)?$', text)
+    if match is None:
+        return None
+    step = float(match.group(1)) * stepUnits[match.group(2) or 'd']
+    if step <= 0:
+        return None
+    return step
+
+
+###############################
+# wholeMinutes
+###############################
+# Returns True if a step is a whole number of minutes, the finest step
+#   Horizons can be asked for
+def wholeMinutes(step):
+    minutes = step * 1440
+    return abs(minutes - round(minutes)) <= tolerance * 1440
+
+
+###############################
+# calendarToJD
+###############################
+# Converts Gregorian calendar dates to Julian dates, using the method in
+#   Meeus, Astronomical Algorithms, chapter 7. Takes numbers or numpy arrays.
+#
+# INPUT:
+#   year, month - ints or arrays of ints
+#   day - day of the month, with the time of day as its fraction
+# OUTPUT:
+#   float or numpy array of Julian dates
+def calendarToJD(year, month, day):
+    year = numpy.asarray(year)
+    month = numpy.asarray(month)
+    early = month <= 2
+    year = numpy.where(early, year - 1, year)
+    month = numpy.where(early, month + 12, month)
+
+    a = numpy.floor(year / 100.0)
+    b = 2 - a + numpy.floor(a / 4.0)
+    return (numpy.floor(365.25 * (year + 4716)) +
+            numpy.floor(30.6001 * (month + 1)) + day + b - 1524.5)
+
+
+###############################
+# datesToJD
+###############################
+# Converts a list of datetimes to a numpy array of Julian dates
+def datesToJD(dates):
+    year = [date.year for date in dates]
+    month = [date.month for date in dates]
+    day = [date.day + (date.hour * 3600 + date.minute * 60 + date.second +
+                       date.microsecond / 1e6) / 86400.0 for date in dates]
+    return calendarToJD(year, month, numpy.array(day))
+
+
+class TimeGrid(object):
+
+    ########
+    # Values of TimeGrid class
+    ########
+    #
+    # start -> float, Julian date of the first point
+    # step -> float, days between the points
+    # count -> int, number of points
+    __slots__ = ['start', 'step', 'count']
+
+    def __init__(self, start, step, count):
+        self.start = float(start)
+        self.step = float(step)
+        self.count = int(count)
+
+    ################
+    # fromDates
+    ################
+    # Creates the grid of points from one date to another. The last point is
+    #   the last one that is not after dateEnd.
+    #
+    # INPUT:
+    #   dateStart, dateEnd - datetimes
+    #   step - float, days between the points
+    @classmethod
+    def fromDates(cls, dateStart, dateEnd, step):
+        start, end = datesToJD([dateStart, dateEnd])
+        count = int(math.floor((end - start) / step + tolerance)) + 1
+        return cls(start, step, max(count, 1))
+
+    ################
+    # __len__
+    ################
+    # Returns the number of points
+    def __len__(self):
+        return self.count
+
+    ################
+    # jds
+    ################
+    # Returns a numpy array of the Julian date of each point
+    def jds(self):
+        return self.start + self.step * numpy.arange(self.count)
+
+    ################
+    # dayNumbers
+    ################
+    # Returns the Schlyter day number of each point, see
+    #   SchlyterCalc.convertToday
+    def dayNumbers(self):
+        return self.jds() - SchlyterCalc.epochJD
+
+    ################
+    # millennia
+    ################
+    # Returns the Julian millennia from J2000 of each point, as used by
+    #   VSOP87
+    def millennia(self):
+        return VSOP87.calculateJMillenia(self.jds())
+
+    ################
+    # shifted
+    ################
+    # Returns the same grid moved by a number of days
+    def shifted(self, days):
+        return TimeGrid(self.start + days, self.step, self.count)
+
+    ################
+    # blocks
+    ################
+    # Splits the grid into grids of at most the given number of points
+    def blocks(self, size):
+        for first in range(0, self.count, size):
+            yield TimeGrid(self.start + self.step * first, self.step,
+                           min(size, self.count - first))
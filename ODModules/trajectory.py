@@ -0,0 +1,293 @@
+###############################
+# FileName: trajectory.py
+#
+# Purpose: Holds the points calculated for a planet by one method. The time
+#   of each point and its X, Y and Z coordinates (and optionally its
+#   velocity) are kept as the rows of a single float64 array, which is
+#   allocated once for the number of points when it is known, instead of
+#   growing a Python list of floats for each coordinate.
+###############################
+
+import numpy
+
+# Julian dates closer than this, in days, are treated as the same
+tolerance = 1e-6
+
+
+class Trajectory(object):
+
+    ########
+    # Values of Trajectory class
+    ########
+    #
+    # buffer -> numpy array (rows, capacity). Row 0 holds the Julian date of
+    #   each point, rows 1 to 3 the X, Y and Z coordinates in AU, and rows 4
+    #   to 6 the velocity in AU/day if the trajectory has velocities
+    # count -> int, number of points in the buffer that have been set
+    __slots__ = ['buffer', 'count']
+
+    ################
+    # __init__
+    ################
+    # INPUT:
+    #   capacity - int, number of points to allocate space for. More points
+    #       can still be added, but the buffer has to be reallocated
+    #   velocity - boolean, if True, the trajectory also holds velocities
+    def __init__(self, capacity=0, velocity=False):
+        self.buffer = numpy.empty((7 if velocity else 4, capacity))
+        self.count = 0
+
+    ################
+    # fromArrays
+    ################
+    # Creates a trajectory holding the given arrays
+    #
+    # INPUT:
+    #   times - array, Julian date of each point
+    #   X, Y, Z - arrays, coordinates of each point
+    #   velocities - tuple of arrays (VX, VY, VZ), or None
+    # OUTPUT:
+    #   Trajectory
+    @classmethod
+    def fromArrays(cls, times, X, Y, Z, velocities=None):
+        trajectory = cls(len(times), velocities is not None)
+        trajectory.extend(times, X, Y, Z, velocities)
+        return trajectory
+
+    ################
+    # __len__
+    ################
+    # Returns the number of points
+    def __len__(self):
+        return self.count
+
+    ################
+    # reserve
+    ################
+    # Reallocates the buffer, if needed, so that it has space for the given
+    #   number of points
+    def reserve(self, capacity):
+        if capacity <= self.buffer.shape[1]:
+            return
+        buffer = numpy.empty((len(self.buffer), capacity))
+        buffer[:, :self.count] = self.buffer[:, :self.count]
+        self.buffer = buffer
+
+    ################
+    # append
+    ################
+    # Adds a single point. Used by the methods that calculate one day at a
+    #   time. The buffer doubles in size when it is full.
+    #
+    # INPUT:
+    #   time - float, Julian date
+    #   x, y, z - floats, coordinates
+    #   velocity - tuple (vx, vy, vz), or None
+    def append(self, time, x, y, z, velocity=None):
+        if self.count == self.buffer.shape[1]:
+            self.reserve(max(16, 2 * self.count))
+        column = self.buffer[:, self.count]
+        column[:4] = (time, x, y, z)
+        if velocity is not None:
+            column[4:] = velocity
+        self.count += 1
+
+    ################
+    # extend
+    ################
+    # Adds a block of points after the existing points
+    #
+    # INPUT:
+    #   times - array, Julian date of each point
+    #   X, Y, Z - arrays, coordinates of each point
+    #   velocities - tuple of arrays (VX, VY, VZ), or None
+    def extend(self, times, X, Y, Z, velocities=None):
+        start = self.count
+        end = start + len(times)
+        self.reserve(end)
+        self.buffer[0, start:end] = times
+        self.buffer[1, start:end] = X
+        self.buffer[2, start:end] = Y
+        self.buffer[3, start:end] = Z
+        if velocities is not None:
+            self.buffer[4:, start:end] = velocities
+        self.count = end
+
+    ################
+    # hasVelocity
+    ################
+    # Returns True if the trajectory holds velocities
+    def hasVelocity(self):
+        return len(self.buffer) == 7
+
+    ################
+    # row
+    ################
+    # Returns a view of the set points of one row of the buffer
+    def row(self, index):
+        return self.buffer[index, :self.count]
+
+    # Views of each row. These are not copies, so changing them changes the
+    #   trajectory
+    times = property(lambda self: self.row(0))
+    X = property(lambda self: self.row(1))
+    Y = property(lambda self: self.row(2))
+    Z = property(lambda self: self.row(3))
+    VX = property(lambda self: self.row(4) if self.hasVelocity() else None)
+    VY = property(lambda self: self.row(5) if self.hasVelocity() else None)
+    VZ = property(lambda self: self.row(6) if self.hasVelocity() else None)
+
+    ################
+    # points
+    ################
+    # Returns the coordinates in the form used by plotManager
+    #
+    # OUTPUT:
+    #   dict, maps 'X', 'Y' and 'Z' to arrays
+    def points(self):
+        return {'X': self.X, 'Y': self.Y, 'Z': self.Z}
+
+    ################
+    # step
+    ################
+    # Returns the days between the points, which are assumed to be evenly
+    #   spaced, or 0 if there is only one point
+    def step(self):
+        if self.count < 2:
+            return 0.0
+        return float(self.buffer[0, 1] - self.buffer[0, 0])
+
+    ################
+    # section
+    ################
+    # Returns a new trajectory with the points at the given evenly spaced
+    #   Julian dates. The dates must be points of this trajectory.
+    #
+    # OUTPUT:
+    #   Trajectory, or None if the dates are not all in this trajectory
+    def section(self, jds):
+        jds = numpy.asarray(jds, dtype=float)
+        index = alignedIndex(self.buffer[0, 0], self.step(), jds)
+        if index is None:
+            return None
+        start, stride = index
+        end = start + stride * (len(jds) - 1) + 1
+        if start < 0 or end > self.count:
+            return None
+        trajectory = Trajectory(len(jds), self.hasVelocity())
+        trajectory.buffer[:] = self.buffer[:, start:end:stride]
+        trajectory.count = len(jds)
+        return trajectory
+
+    ################
+    # view
+    ################
+    # Returns a trajectory of the points from start up to end, sharing this
+    #   trajectory's buffer instead of copying it
+    def view(self, start, end):
+        trajectory = Trajectory(0, self.hasVelocity())
+        trajectory.buffer = self.buffer[:, start:end]
+        trajectory.count = end - start
+        return trajectory
+
+    ################
+    # relativeTo
+    ################
+    # Returns a new trajectory with the coordinates (and velocities, if both
+    #   have them) of another trajectory subtracted, i.e. the positions
+    #   relative to another planet. Both must have the same number of points.
+    def relativeTo(self, origin):
+        rows = 7 if self.hasVelocity() and origin.hasVelocity() else 4
+        trajectory = Trajectory(self.count, rows == 7)
+        trajectory.buffer[0] = self.times
+        trajectory.buffer[1:rows] = (self.buffer[1:rows, :self.count] -
+                                     origin.buffer[1:rows, :origin.count])
+        trajectory.count = self.count
+        return trajectory
+
+
+###############################
+# alignedIndex
+###############################
+# Finds where evenly spaced Julian dates fall on a grid of dates.
+#
+# INPUT:
+#   first - float, Julian date of the grid's first point
+#   step - float, days between the grid's points. 0 if it has one point
+#   jds - numpy array of evenly spaced Julian dates
+# OUTPUT:
+#   tuple (index of jds[0] on the grid, grid points between each of jds), or
+#       None if the dates are not on the grid
+def alignedIndex(first, step, jds):
+    if not step:
+        if len(jds) == 1 and abs(jds[0] - first) <= tolerance:
+            return (0, 1)
+        return None
+
+    start = (jds[0] - first) / step
+    stride = (jds[1] - jds[0]) / step if len(jds) > 1 else 1.0
+    if abs(start - round(start)) * step > tolerance:
+        return None
+    if round(stride) < 1 or abs(stride - round(stride)) * step > tolerance:
+        return None
+    return (int(round(start)), int(round(stride)))
+
+
+###############################
+# missingDates
+###############################
+# Finds the dates that must be calculated to extend a trajectory so that it
+#   covers the given dates
+#
+# INPUT:
+#   trajectory - Trajectory, the existing points
+#   jds - numpy array of Julian dates, with the same step as trajectory
+# OUTPUT:
+#   tuple (dates before the existing points, dates after them), each an
+#       array that may be empty, or None if the dates are not on the
+#       trajectory's grid, or are further from it than their own length
+def missingDates(trajectory, jds):
+    jds = numpy.asarray(jds, dtype=float)
+    step = trajectory.step()
+    if not step or len(jds) < 2 or abs(jds[1] - jds[0] - step) > tolerance:
+        return None
+    if alignedIndex(trajectory.times[0], step, jds) is None:
+        return None
+
+    # Number of points needed before and after the existing ones
+    before = max(0, int(round((trajectory.times[0] - jds[0]) / step)))
+    after = max(0, int(round((jds[-1] - trajectory.times[-1]) / step)))
+    gap = max(int(round((jds[0] - trajectory.times[-1]) / step)),
+              int(round((trajectory.times[0] - jds[-1]) / step)))
+    if gap > len(jds):
+        return None
+
+    return (trajectory.times[0] - step * numpy.arange(before, 0, -1),
+            trajectory.times[-1] + step * numpy.arange(1, after + 1))
+
+
+###############################
+# joinTrajectories
+###############################
+# Joins trajectories into one, in order of time. A point in more than one
+#   of them is only kept once. The result only has velocities if every part
+#   has them.
+#
+# INPUT:
+#   parts - list of Trajectory
+# OUTPUT:
+#   Trajectory
+def joinTrajectories(parts):
+    velocity = all(part.hasVelocity() for part in parts)
+    rows = 7 if velocity else 4
+    points = numpy.concatenate([part.buffer[:rows, :len(part)]
+                                for part in parts], axis=1)
+    points = points[:, numpy.argsort(points[0], kind='mergesort')]
+    keep = numpy.concatenate(([True], numpy.diff(points[0]) > tolerance))
+    points = points[:, keep]
+
+    joined = Trajectory(points.shape[1], velocity)
+    joined.buffer[:] = points
+    joined.count = points.shape[1]
+    return joined
+
@@ -0,0 +1,301 @@
+###############################
+# FileName: trajectoryCache.py
+#
+# Purpose: Saves calculated (or downloaded) trajectories to disk, so that
+#   later runs over the same dates can read them instead of calculating them
+#   again. Each trajectory is saved as a .npy file of its Trajectory buffer,
+#   which is memory mapped when read. A request for part of a saved date
+#   range, at the same or a multiple of its step, is served by slicing the
+#   saved file. A request that runs past a saved range only calculates the
+#   missing points.
+#
+#   The file name holds everything that affects the points:
+#       <planet>_<method>_<key>_<first JD>_<last JD>_<step>.npy
+#   where key is a hash of the engine version, the variant of the engine
+#   (see orbital_drift.py) and the engine's settings, such as
+#   VSOP87.truncation or the Horizons request settings. Files that have not
+#   been used for the longest time are removed once the folder is larger
+#   than maxBytes.
+###############################
+
+import os
+import glob
+import hashlib
+import threading
+import numpy
+
+import SchlyterCalc
+import VSOP87
+import horizonsConnection
+from trajectory import Trajectory, alignedIndex, missingDates
+from trajectory import joinTrajectories
+
+# The trajectory files are stored in the data folder in the directory this
+#   file is contained in
+directory = os.path.join(
+    os.path.dirname(os.path.realpath(__file__)), 'data', 'trajectories')
+
+# The largest total size of the trajectory files, in bytes
+maxBytes = 256 * 1024 * 1024
+
+# Julian dates closer than this, in days, are treated as the same
+tolerance = 1e-6
+
+# Held while files are written or removed. Horizons results are saved from a
+#   background thread while the planets are calculated, see
+#   horizonsCache.Retrieval
+writeLock = threading.RLock()
+
+
+###############################
+# settingsKey
+###############################
+# Returns the hash of everything other than the dates that affects the
+#   points of a method
+#
+# INPUT:
+#   method - String, "Sch", "VSO" or "Hor"
+#   variant - String, how the engine was run, i.e. "sequential". '' for the
+#       default batch calculation
+# OUTPUT:
+#   String, 10 hex digits
+def settingsKey(method, variant):
+    if method == "Sch":
+        settings = (SchlyterCalc.engineVersion, variant,
+                    SchlyterCalc.methodForEccen, SchlyterCalc.accuracy,
+                    SchlyterCalc.maxIterations)
+    elif method == "Hor":
+        settings = horizonsConnection.requestSettings()
+    else:
+        settings = (VSOP87.engineVersion, variant, VSOP87.truncation)
+    return hashlib.sha1(repr(settings)).hexdigest()[:10]
+
+
+###############################
+# cachePath
+###############################
+# Returns the file a trajectory is saved to
+def cachePath(name, method, key, first, last, step):
+    fileName = '{0}_{1}_{2}_{3:.6f}_{4:.6f}_{5:.9g}.npy'.format(
+        name, method, key, first, last, step)
+    return os.path.join(directory, fileName)
+
+
+###############################
+# cachedRanges
+###############################
+# Finds the saved trajectories for a planet, method and key
+#
+# OUTPUT:
+#   list of (path, first JD, last JD, step)
+def cachedRanges(name, method, key):
+    pattern = os.path.join(directory, name + '_' + method + '_' + key +
+                           '_*.npy')
+    ranges = []
+    for path in glob.glob(pattern):
+        parts = os.path.basename(path)[:-len('.npy')].split('_')
+        try:
+            ranges.append((path, float(parts[-3]), float(parts[-2]),
+                           float(parts[-1])))
+        except (ValueError, IndexError):
+            continue
+    return ranges
+
+
+###############################
+# gridStep
+###############################
+# Returns the step between evenly spaced Julian dates, or 0 for one date
+def gridStep(jds):
+    if len(jds) < 2:
+        return 0.0
+    return float(jds[1] - jds[0])
+
+
+###############################
+# readTrajectory
+###############################
+# Reads a saved trajectory file
+#
+# OUTPUT:
+#   Trajectory, or None if the file could not be read
+def readTrajectory(path):
+    try:
+        points = numpy.load(path, mmap_mode='r')
+    except (IOError, ValueError):
+        return None
+    velocities = tuple(points[4:7]) if len(points) == 7 else None
+    return Trajectory.fromArrays(points[0], points[1], points[2], points[3],
+                                 velocities)
+
+
+###############################
+# loadTrajectory
+###############################
+# Reads a trajectory for the given Julian dates from a saved file that covers
+#   them, if there is one.
+#
+# If calculate is given and no file covers the dates, a saved trajectory
+#   that overlaps or is close to them is extended instead, by calculating
+#   only the missing points before or after it (see planExtension). The
+#   extended trajectory replaces the file.
+#
+# INPUT:
+#   name - String, name of the planet
+#   method - String, "Sch", "VSO" or "Hor"
+#   jds - numpy array of evenly spaced Julian dates
+#   variant - String, see settingsKey
+#   calculate - function, takes an array of Julian dates and returns a
+#       Trajectory of the points at those dates. None to only read
+# OUTPUT:
+#   Trajectory, or None if no saved file covers the dates
+def loadTrajectory(name, method, jds, variant='', calculate=None):
+    jds = numpy.asarray(jds, dtype=float)
+    ranges = cachedRanges(name, method, settingsKey(method, variant))
+    for path, first, last, savedStep in ranges:
+        if jds[0] < first - tolerance or jds[-1] > last + tolerance:
+            continue
+
+        # The requested dates must fall on the saved ones
+        index = alignedIndex(first, savedStep, jds)
+        if index is None:
+            continue
+        start, stride = index
+
+        try:
+            points = numpy.load(path, mmap_mode='r')
+        except (IOError, ValueError):
+            continue
+        points = points[:, start:start + stride * len(jds):stride]
+        if points.shape[1] != len(jds) or not numpy.allclose(
+                points[0], jds, rtol=0, atol=tolerance):
+            continue
+
+        # Mark the file as recently used
+        os.utime(path, None)
+        velocities = tuple(points[4:7]) if len(points) == 7 else None
+        return Trajectory.fromArrays(jds, points[1], points[2], points[3],
+                                     velocities)
+
+    if calculate is None:
+        return None
+
+    # Extend a saved trajectory with the same step
+    plan = planExtension(name, method, jds, variant)
+    if plan is None:
+        return None
+    path, saved, missing = plan
+    parts = [saved]
+    for dates in missing:
+        if len(dates):
+            parts.append(calculate(dates))
+    extended = joinTrajectories(parts)
+    replaceTrajectory(name, method, extended, variant, path)
+    return extended.section(jds)
+
+
+###############################
+# planExtension
+###############################
+# Finds a saved trajectory with the same step that overlaps or is close to
+#   the given dates, and the dates that are missing from it
+#
+# INPUT:
+#   name - String, name of the planet
+#   method - String, "Sch", "VSO" or "Hor"
+#   jds - numpy array of evenly spaced Julian dates
+#   variant - String, see settingsKey
+# OUTPUT:
+#   tuple (path, saved Trajectory, (dates before it, dates after it)), or
+#       None if no saved trajectory can be extended to the dates
+def planExtension(name, method, jds, variant=''):
+    jds = numpy.asarray(jds, dtype=float)
+    step = gridStep(jds)
+    if not step:
+        return None
+    for path, first, last, savedStep in cachedRanges(
+            name, method, settingsKey(method, variant)):
+        if abs(savedStep - step) > tolerance:
+            continue
+        saved = readTrajectory(path)
+        if saved is None:
+            continue
+        missing = missingDates(saved, jds)
+        if missing is not None:
+            return (path, saved, missing)
+    return None
+
+
+###############################
+# replaceTrajectory
+###############################
+# Saves an extended trajectory, and removes the file it was extended from
+def replaceTrajectory(name, method, trajectory, variant, oldPath):
+    with writeLock:
+        saveTrajectory(name, method, trajectory, variant)
+        newPath = cachePath(name, method, settingsKey(method, variant),
+                            trajectory.times[0], trajectory.times[-1],
+                            trajectory.step())
+        if newPath != oldPath and os.path.isfile(oldPath):
+            os.remove(oldPath)
+
+
+###############################
+# saveTrajectory
+###############################
+# Saves a trajectory calculated for evenly spaced Julian dates, then removes
+#   the least recently used files if the folder has grown too large.
+#
+# INPUT:
+#   name - String, name of the planet
+#   method - String, "Sch", "VSO" or "Hor"
+#   trajectory - Trajectory to save
+#   variant - String, see settingsKey
+def saveTrajectory(name, method, trajectory, variant=''):
+    if not len(trajectory):
+        return
+    jds = trajectory.times
+    path = cachePath(name, method, settingsKey(method, variant), jds[0],
+                     jds[-1], gridStep(jds))
+
+    with writeLock:
+        if not os.path.isdir(directory):
+            os.makedirs(directory)
+
+        # Write to a temporary file first, so a partly written file is never
+        #   read
+        temporary = path + '.tmp'
+        f = open(temporary, 'wb')
+        numpy.save(f, trajectory.buffer[:, :len(trajectory)])
+        f.close()
+        os.rename(temporary, path)
+
+        evict(maxBytes, path)
+
+
+###############################
+# evict
+###############################
+# Removes the least recently used trajectory files until the total size is
+#   at most the given number of bytes. The file that was just saved is
+#   kept, even if it is larger than the limit on its own, as it is about to
+#   be used.
+#
+# INPUT:
+#   limit - int, bytes
+#   keep - String, path of the file not to remove, or None
+def evict(limit, keep=None):
+    files = []
+    for path in glob.glob(os.path.join(directory, '*.npy')):
+        info = os.stat(path)
+        files.append((info.st_mtime, info.st_size, path))
+    files.sort()
+
+    total = sum(size for used, size, path in files)
+    for used, size, path in files:
+        if total <= limit:
+            break
+        if path == keep:
+            continue
+        os.remove(path)
+        total -= size
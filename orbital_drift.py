@@ -10,15 +10,26 @@
 
 from datetime import datetime, timedelta
 import sys
-import copy
+import Queue
+import numpy
 
 from ODModules.planetDBInterface import PlanetDBInterface
 from ODModules.planet import Planet
+from ODModules.trajectory import Trajectory
 import ODModules.SchlyterCalc as SchlyterCalc
+import ODModules.keplerSolver as keplerSolver
 import ODModules.plotManager as plotManager
 import ODModules.reporting as reporting
 import ODModules.horizonsConnection as horiz
 import ODModules.VSOP87 as VSOP87
+import ODModules.chebyshevEphemeris as chebyshevEphemeris
+import ODModules.parallelRunner as parallelRunner
+import ODModules.trajectoryCache as trajectoryCache
+import ODModules.pipeline as pipeline
+import ODModules.timeGrid as timeGrid
+import ODModules.adaptiveSampling as adaptiveSampling
+import ODModules.frameTransform as frameTransform
+import ODModules.horizonsCache as horizonsCache
 
 #############################
 # Default Main Options
@@ -65,18 +76,241 @@ graphHorizon = False
 #   with VSOP87
 method = "Sch"
 
+# Target accuracy, in AU, of the VSOP87 series. Smaller terms are dropped to
+#   speed up the calculation. 0 uses the full series. -ta or --truncate
+truncation = 0
+
+# Evaluate the Schlyter and VSOP87 methods from the saved Chebyshev
+#   ephemerides, creating them if they do not cover the date range.
+#   -ce or --chebyshev
+chebyshev = False
+
+# Method used to calculate the eccentric anomaly in the Schlyter method. See
+#   SchlyterCalc.methodForEccen for the values. -km or --kepler
+keplerMethod = SchlyterCalc.methodForEccen
+
+# Calculate the Schlyter points a block of days after the other, starting
+#   each eccentric anomaly from the previous block's. This uses fewer solver
+#   iterations than calculating every day at once, but takes several times
+#   longer. -sq or --sequential
+sequential = False
+
+# Calculate the VSOP87 points by rotating each term from one day to the
+#   next, instead of calculating every cosine. -rr or --recurrence
+recurrence = False
+
+# Calculate the VSOP87 planets that share the same times in a single pass,
+#   instead of one planet after another. Not used with -ce, -rr or -j. -fv
+#   or --fused
+fused = False
+
+# Number of worker processes used to calculate the planets. 1 calculates
+#   everything in this process. Not used with -ce, -sq or -rr. -j or --jobs
+jobs = 1
+
+# Choose the interval of each planet so that straight lines between its
+#   points stay within this many AU of its orbit. The interval given with
+#   -in is doubled or halved as needed. Planets relative to an origin, and
+#   streamed planets, all use the shortest interval. 0 uses the same
+#   interval for every planet. -ad or --adaptive
+adaptive = 0
+
+# Read the points from trajectories saved by earlier runs over the same
+#   dates, and save the newly calculated ones. -tc or --cache
+cache = False
+
+# Calculate the points in blocks of pipeline.blockPoints points, keeping
+#   only the running differences, so that long date ranges use a fixed
+#   amount of memory. Nothing is graphed, and -tc and -j are not used. -st
+#   or --stream
+stream = False
+
+# File to write the points to while streaming, as CSV. -po or --points
+pointsFile = ""
+
+# Number of planets retrieved from Horizons at once. -hj or --horizonjobs
+horizonJobs = horiz.maxSessions
+
+# Only use the Horizons results saved by earlier runs, and stop at once if
+#   any are missing, instead of connecting. -of or --offline
+offline = False
+
 # Timer for entire program. -t or --mastertimer
 masterTimer = False
 
-# Default start date is today
+# Days between the points calculated. Given with a unit, from minutes to
+#   months, i.e. 30m, 6h, 1d, 2w or 1mo. -in or --interval
+interval = 1.0
+
+# Default start date is the start of today. Dates are given as 2001-01-01,
+#   or as 2001-01-01T06:30 to start at a time of day
 #   dateStart -> -d --date
 #   dateEnd -> -e --dateend
-dateStart = datetime.now()
+dateStart = datetime.now().replace(hour=0, minute=0, second=0, microsecond=0)
 
 ###########################
 # End options
 ###########################
 
+
+###############################
+# parseDate
+###############################
+# Reads a date given on the command line, with or without the time of day
+def parseDate(text):
+    try:
+        return datetime.strptime(text, '%Y-%m-%dT%H:%M')
+    except ValueError:
+        return datetime.strptime(text, '%Y-%m-%d')
+
+
+###############################
+# calculateSchlyter
+###############################
+# Calculates the Schlyter points of a planet for evenly spaced Julian dates
+#
+# OUTPUT:
+#   Trajectory
+def calculateSchlyter(planet, jds):
+    if not planet.elements:
+        planet.setElementsDict(db)  # Create dictionary of Schylter elements
+        planet.setSchlyterTerms(db)  # Set the values for each element
+    jds = numpy.asarray(jds, dtype=float)
+    days = jds - SchlyterCalc.epochJD
+    if chebyshev:
+        ephemeris = chebyshevEphemeris.getEphemeris(
+            planet, "Sch", jds[0], jds[-1], db)
+        X, Y, Z = chebyshevEphemeris.evaluate(ephemeris, jds)
+    elif sequential:
+        step = days[1] - days[0] if len(days) > 1 else 1.0
+        propagator = SchlyterCalc.SchlyterPropagator(planet, days[0], step)
+        X, Y, Z = propagator.propagate(len(days))
+    else:
+        # Calculate every day in one batch
+        X, Y, Z = SchlyterCalc.runSchlyterCalcBatch(planet, days)
+    return Trajectory.fromArrays(jds, X, Y, Z)
+
+
+###############################
+# calculateVSOP
+###############################
+# Calculates the VSOP87 points of a planet for evenly spaced Julian dates
+#
+# OUTPUT:
+#   Trajectory
+def calculateVSOP(planet, jds):
+    jds = numpy.asarray(jds, dtype=float)
+    times = VSOP87.calculateJMillenia(jds)
+    if chebyshev:
+        ephemeris = chebyshevEphemeris.getEphemeris(
+            planet, "VSO", jds[0], jds[-1], db)
+        X, Y, Z = chebyshevEphemeris.evaluate(ephemeris, jds)
+    elif recurrence and len(jds) > 1:
+        # The days are evenly spaced
+        X, Y, Z = VSOP87.runVSOP87Uniform(
+            planet, times[0], (jds[1] - jds[0]) / 365250.0, len(times),
+            db.cursor)
+    else:
+        # No setup needed for VSOP87. Calculate every day in one batch
+        X, Y, Z = VSOP87.runVSOP87Batch(planet, times, db.cursor)
+    return Trajectory.fromArrays(jds, X, Y, Z)
+
+
+###############################
+# calculateMethod
+###############################
+# Returns the function that calculates a planet's points with Schlyter or
+#   VSOP87 for an array of Julian dates, as used by trajectoryCache to extend
+#   saved trajectories
+def calculateMethod(planet, method):
+    if method == "Sch":
+        return lambda jds: calculateSchlyter(planet, jds)
+    return lambda jds: calculateVSOP(planet, jds)
+
+
+###############################
+# planetGrid
+###############################
+# Returns the times a planet is calculated at with a method. VSOP87 has
+#   always been calculated half a day later than the others, at the Julian
+#   day number (noon) of each date
+def planetGrid(planet, method):
+    planetTimes = grids.get(planet.name, grid)
+    if method == "VSO":
+        return planetTimes.shifted(0.5)
+    return planetTimes
+
+
+###############################
+# groupByGrid
+###############################
+# Splits a list of (planet, method) into the groups that are calculated at
+#   the same times
+#
+# OUTPUT:
+#   list of (TimeGrid, list of (planet, method))
+def groupByGrid(items):
+    groups = []
+    for planet, method in items:
+        planetTimes = grids.get(planet.name, grid)
+        for groupTimes, groupItems in groups:
+            if groupTimes is planetTimes:
+                groupItems.append((planet, method))
+                break
+        else:
+            groups.append((planetTimes, [(planet, method)]))
+    return groups
+
+
+###############################
+# startHorizons
+###############################
+# Starts retrieving the Horizons results of each planet at its own times in
+#   the background, several planets at once. Saved results are read from
+#   disk instead
+#
+# INPUT:
+#   horizonPlanets - list of planet objects
+#   arriving - list of Queue.Queue, one for each planet, to put the points
+#       in as they arrive (see pipeline.arrivingBlocks), or None
+# OUTPUT:
+#   horizonsCache.Retrieval, see joinHorizons
+def startHorizons(horizonPlanets, arriving=None):
+    requests = [(planet, planetGrid(planet, "Hor").jds())
+                for planet in horizonPlanets]
+    if arriving is not None:
+        requests = [request + (queue.put,)
+                    for request, queue in zip(requests, arriving)]
+    return horizonsCache.Retrieval(requests)
+
+
+###############################
+# joinHorizons
+###############################
+# Waits for the Horizons results started by startHorizons, and gives them to
+#   the planets
+def joinHorizons(horizonPlanets, retrieval):
+    results = retrieval.join()
+    for planet, (trajectory, seconds) in zip(horizonPlanets, results):
+        planet.trajectories["Hor"] = trajectory
+        planet.calculationTimes["Hor"] = seconds
+
+
+###############################
+# methodVariant
+###############################
+# Returns the name of the options a method is calculated with, which keeps
+#   the saved trajectories of each option apart
+def methodVariant(method):
+    if chebyshev:
+        return "chebyshev"
+    if method == "Sch" and sequential:
+        return "sequential"
+    if method == "VSO" and recurrence:
+        return "recurrence"
+    return ""
+
+
 # Help text if no args entered -- NOTE: Update this
 if(len(sys.argv) < 2):
     pStr = "To graph the planets, run the program followed by the names "
@@ -123,16 +357,55 @@ for i in range(1, len(sys.argv)):
     elif sys.argv[i] == "-o" or sys.argv[i] == "--output":
         i += 1
         output = sys.argv[i]
+    elif sys.argv[i] == "-ce" or sys.argv[i] == "--chebyshev":
+        chebyshev = True
+    elif sys.argv[i] == "-st" or sys.argv[i] == "--stream":
+        stream = True
+    elif sys.argv[i] == "-po" or sys.argv[i] == "--points":
+        i += 1
+        pointsFile = sys.argv[i]
+    elif sys.argv[i] == "-in" or sys.argv[i] == "--interval":
+        i += 1
+        interval = timeGrid.parseStep(sys.argv[i])
+        if interval is None:
+            print("The interval must be a number followed by m, h, d, w " +
+                  "or mo.")
+            exit()
+    elif sys.argv[i] == "-ad" or sys.argv[i] == "--adaptive":
+        i += 1
+        adaptive = float(sys.argv[i])
+    elif sys.argv[i] == "-hj" or sys.argv[i] == "--horizonjobs":
+        i += 1
+        horizonJobs = int(sys.argv[i])
+    elif sys.argv[i] == "-of" or sys.argv[i] == "--offline":
+        offline = True
+    elif sys.argv[i] == "-tc" or sys.argv[i] == "--cache":
+        cache = True
+    elif sys.argv[i] == "-rr" or sys.argv[i] == "--recurrence":
+        recurrence = True
+    elif sys.argv[i] == "-fv" or sys.argv[i] == "--fused":
+        fused = True
+    elif sys.argv[i] == "-j" or sys.argv[i] == "--jobs":
+        i += 1
+        jobs = int(sys.argv[i])
+    elif sys.argv[i] == "-sq" or sys.argv[i] == "--sequential":
+        sequential = True
+    elif sys.argv[i] == "-km" or sys.argv[i] == "--kepler":
+        i += 1
+        keplerMethod = int(sys.argv[i])
+    elif sys.argv[i] == "-ta" or sys.argv[i] == "--truncate":
+        i += 1
+        truncation = float(sys.argv[i])
     elif sys.argv[i] == "-d" or sys.argv[i] == "--date":
         i += 1
-        dateStart = datetime.strptime(sys.argv[i], '%Y-%m-%d')
+        dateStart = parseDate(sys.argv[i])
         if 'dateEnd' in locals():
             if dateEnd < dateStart:
                 print("The start date must be before the end date.")
                 exit()
     elif sys.argv[i] == "-e" or sys.argv[i] == "--dateend":
         i += 1
-        dateEnd = datetime.strptime(sys.argv[i], '%Y-%m-%d')
+        dateEnd = parseDate(sys.argv[i])
         if dateEnd < dateStart:
             out = "The end date must be after the start date."
             out += " The default date is today."
@@ -156,26 +429,106 @@ for i in range(1, len(sys.argv)):
                 planets.append(Planet(sys.argv[i], 0000, dbResults))
                 planets[-1].method.append(method)
 
-# Start timer for whole program
+# Start timer for whole program. The worker processes of -j are not timed
+#   by this process, so the time that passes is measured instead
 if(masterTimer):
-    timer = reporting.startTimer()
+    timer = reporting.startTimer(jobs > 1)
+
+# Use the truncated VSOP87 series, if requested
+VSOP87.truncation = truncation
+
+# Use the requested eccentric anomaly method
+SchlyterCalc.methodForEccen = keplerMethod
+
+# Open no more than the requested number of Horizons sessions at once
+horiz.maxSessions = max(1, horizonJobs)
+horizonsCache.offline = offline
 
 # Default length is one year
 if 'dateEnd' not in locals():
     dateEnd = dateStart + timedelta(days=365)
 
-dayDifference = dateEnd - dateStart
+# Horizons is only asked for whole minutes between points
+includeHorizon = not noHorizon or graphHorizon
+if includeHorizon and not timeGrid.wholeMinutes(interval):
+    print("The interval must be a whole number of minutes when the " +
+          "Horizons results")
+    print("are used (-h or -gh).")
+    exit()
+
+# The times the points are calculated at
+grid = timeGrid.TimeGrid.fromDates(dateStart, dateEnd, interval)
+
+# Every planet is calculated for each of its methods
+work = []
+for planet in planets:
+    for method in planet.method:
+        work.append((planet, method))
+
+# If geocentric coordinates requested, find the origin before calculating,
+#   so that it is calculated along with the planets. An origin that is one
+#   of the planets is the same object, so it is only calculated once
+origin = False
+originHorizon = False
+originMethods = []
+if noGalileo:
+    for planet in planets:
+        if planet.name == centralPlanet:
+            origin = planet
+    if origin is False:
+        # Did not find an origin object.
+        dbResults = db.getPlanet(centralPlanet)
+        origin = Planet(centralPlanet, 0000, dbResults)
+        originHorizon = graphHorizon or not noHorizon
+
+    # The origin is needed with every method of the planets. The methods it
+    #   is not listed with are calculated, but not graphed or compared
+    for planet in planets:
+        for method in planet.method:
+            if method not in originMethods:
+                originMethods.append(method)
+                if method not in origin.method:
+                    work.append((origin, method))
+
+# Choose the times each planet is calculated at
+grids = {}
+if adaptive:
+    for body, method in work:
+        if body.name not in grids:
+            bodyMethods = [m for p, m in work if p is body]
+            grids[body.name] = adaptiveSampling.adaptGrid(
+                body, bodyMethods, grid, adaptive, db, includeHorizon)
+
+    # Points relative to the origin are found by subtracting points at the
+    #   same times, and streams are advanced together
+    if noGalileo or stream:
+        finest = min(grids.values(), key=lambda times: times.step)
+        for name in grids:
+            grids[name] = finest
+
+# Start retrieving the Horizons results now, so that the planets are
+#   calculated while waiting on Horizons. They are only joined once needed
+if includeHorizon:
+    horizonPlanets = list(planets)
+    if originHorizon:
+        horizonPlanets.append(origin)
+    # Streamed planets are compared to the Horizons results as they arrive
+    horizonArriving = None
+    if stream:
+        horizonArriving = [Queue.Queue() for planet in horizonPlanets]
+    horizonRetrieval = startHorizons(horizonPlanets, horizonArriving)
 
 # Test if graphing should be done. If more than maxPoints points, don't graph
+if stream:
+    graph = False
 if not forceGraph and graph:
-    numDays = dayDifference.days
     numPoints = 0
     for planet in planets:
         numMethods = len(planet.method)
         if(graphHorizon):
             numMethods + 1
-        # Each planet gets graphed once every day, for each method it has
-        numPoints = numPoints + numDays * numMethods
+        # Each planet gets graphed at every time, for each method it has
+        numPoints = numPoints + len(planetGrid(planet, "Sch")) * numMethods
 
     if(numPoints > maxPoints):
         # Print warning and set graph option to false
@@ -189,112 +542,106 @@ if not forceGraph and graph:
 if graph:
     graphs = []
 
-# Creating graphs for each in planet
-for planet in planets:
+# Stream the points through the pipeline instead of keeping them
+if stream:
+    streams = []
+    for planet, method in work:
+        methodGrid = planetGrid(planet, method)
+        calculate = calculateMethod(planet, method)
+        if chebyshev:
+            # Create the ephemeris for the whole range first, instead of
+            #   extending it for each block
+            calculate(methodGrid.jds()[[0, -1]])
+        streams.append((planet, method, pipeline.engineBlocks(
+            planet, method, pipeline.gridBlocks(methodGrid), calculate)))
+
+    # Horizons results are compared block by block as they arrive, and
+    #   joined once every block has been compared
+    finish = None
+    if includeHorizon:
+        finish = lambda: joinHorizons(horizonPlanets, horizonRetrieval)
+        for planet, arriving in zip(horizonPlanets, horizonArriving):
+            streams.append((planet, "Hor", pipeline.arrivingBlocks(
+                pipeline.gridBlocks(planetGrid(planet, "Hor")), arriving,
+                finish)))
+
+    pipeline.runPipeline(streams, origin, planets, includeHorizon,
+                         None if noDifference else outputFile, pointsFile,
+                         finish)
+
+    if(masterTimer):
+        print("Total time taken: " +
+              str(reporting.endTimer(timer, jobs > 1)))
+        print(keplerSolver.statisticsString())
+    exit()
+
+# Read the saved trajectories, so only the others are calculated. Saved
+#   trajectories that cover part of the range are extended
+if cache:
+    remaining = []
+    for planet, method in work:
+        methodTimer = reporting.startTimer()
+        trajectory = trajectoryCache.loadTrajectory(
+            planet.name, method, planetGrid(planet, method).jds(),
+            methodVariant(method), calculateMethod(planet, method))
+        if trajectory is None:
+            remaining.append((planet, method))
+        else:
+            planet.trajectories[method] = trajectory
+            planet.calculationTimes[method] = reporting.endTimer(
+                methodTimer)
+    work = remaining
+
+# Calculate each planet and method, in parallel if requested
+if work and jobs > 1 and not (chebyshev or sequential or recurrence):
+    for times, items in groupByGrid(work):
+        parallelRunner.runJobs(items, times.jds(), times.shifted(0.5).jds(),
+                               jobs)
+else:
     # Run Schlyter method
-    if("Sch" in planet.method):
-        planet.setElementsDict(db)  # Create dictionary of Schylter elements
-        planet.setSchlyterTerms(db)  # Set the values for each element
-        # For every day in range, run the calculations
-        for i in range(dayDifference.days + 1):
-            newDate = dateStart + timedelta(days=i)
-            # Calculate points, and save in planet object
-            SchlyterCalc.runSchlyterCalc(planet, newDate, [])
-
-    # Run VSOP87 method
-    if("VSO" in planet.method):
-        # No setup needed for VSOP87. Run once each day
-        for i in range(dayDifference.days + 1):
-            newDate = dateStart + timedelta(days=i)
-            VSOP87.runVSOP87(planet, newDate, db.cursor)
-
-# Retrieve horizon info if requested.
-if(graphHorizon or not noHorizon):
-    # Retrieves horizon info for each planet in date range
-    horiz.calculatePlanets(planets, dateStart, dateEnd, 0)
-
-# If geocentric coordinates requested, subtract origin from each planet
-# NOTE: When revisiting project in future, functionize this mess
-origin = False
+    for planet, method in work:
+        if method == "Sch":
+            methodTimer = reporting.startTimer()
+            planet.trajectories["Sch"] = calculateSchlyter(
+                planet, planetGrid(planet, "Sch").jds())
+            planet.calculationTimes["Sch"] = reporting.endTimer(methodTimer)
+
+    # Run VSOP87 method. With -fv, several planets at the same times are
+    #   calculated in a single pass
+    vsopWork = [(planet, method) for planet, method in work
+                if method == "VSO"]
+    for times, items in groupByGrid(vsopWork):
+        vsopPlanets = [planet for planet, method in items]
+        vsopGrid = times.shifted(0.5)
+        if fused and len(vsopPlanets) > 1 and not (chebyshev or recurrence):
+            results = VSOP87.runVSOP87Fused(vsopPlanets, vsopGrid.millennia(),
+                                            db.cursor)
+            for planet, (X, Y, Z) in zip(vsopPlanets, results):
+                planet.trajectories["VSO"] = Trajectory.fromArrays(
+                    vsopGrid.jds(), X, Y, Z)
+        else:
+            for planet in vsopPlanets:
+                methodTimer = reporting.startTimer()
+                planet.trajectories["VSO"] = calculateVSOP(planet,
+                                                           vsopGrid.jds())
+                planet.calculationTimes["VSO"] = reporting.endTimer(
+                    methodTimer)
+
+# Save the calculated trajectories for later runs
+if cache:
+    for planet, method in work:
+        trajectoryCache.saveTrajectory(planet.name, method,
+                                       planet.trajectories[method],
+                                       methodVariant(method))
+
+# Wait for the horizon info, if requested
+if includeHorizon:
+    joinHorizons(horizonPlanets, horizonRetrieval)
+
+# If geocentric coordinates requested, subtract origin from each planet. The
+#   heliocentric points are kept, and are still used to draw the Sun
 if noGalileo:
-    # Find each method needed
-    neededMethods = []
-    for planet in planets:
-        for method in planet.method:
-            if method not in neededMethods:
-                neededMethods.append(method)
-        # If origin is already done, use points found
-        if planet.name == centralPlanet:
-            origin = copy.copy(planet)
-    if origin is False:
-        # Did not find an origin object.
-        dbResults = db.getPlanet(centralPlanet)
-        origin = Planet(centralPlanet, 0000, dbResults)
-        if graphHorizon or not noHorizon:
-            neededMethods.append("Hori")
-
-    # For each method needed, calculate for orgin if not done yet
-    for method in neededMethods:
-        if method not in origin.method:
-            if method is "Sch":
-                origin.method.append("Sch")
-                origin.setElementsDict(db)
-                origin.setSchlyterTerms(db)  # Set the values for each element
-                # For every day in range, run the calculations
-                for i in range(dayDifference.days + 1):
-                    newDate = dateStart + timedelta(days=i)
-                    # Calculate points, and save in planet object
-                    SchlyterCalc.runSchlyterCalc(origin, newDate, [])
-            if method is "VSO":
-                # No setup needed for VSOP87. Run once each day
-                origin.method.append("VSO")
-                for i in range(dayDifference.days + 1):
-                    newDate = dateStart + timedelta(days=i)
-                    VSOP87.runVSOP87(origin, newDate, db.cursor)
-            if method is "Hori":
-                horiz.calculatePlanets([origin], dateStart, dateEnd, 0)
-
-    # Subtract origin's coordinates for each planet for each method
-    for planet in planets:
-        if "Sch" in planet.method:
-            x = []
-            x[:] = [planet.orbitXSchlyter[i] - origin.orbitXSchlyter[i]
-                    for i in range(0, len(origin.orbitXSchlyter))]
-            planet.orbitXSchlyter = x
-            y = []
-            y[:] = [planet.orbitYSchlyter[i] - origin.orbitYSchlyter[i]
-                    for i in range(0, len(origin.orbitYSchlyter))]
-            planet.orbitYSchlyter = y
-            z = []
-            z[:] = [planet.orbitZSchlyter[i] - origin.orbitZSchlyter[i]
-                    for i in range(0, len(origin.orbitZSchlyter))]
-            planet.orbitZSchlyter = z
-        if "VSO" in planet.method:
-            x = []
-            x[:] = [planet.orbitXVSOP[i] - origin.orbitXVSOP[i]
-                    for i in range(0, len(origin.orbitXVSOP))]
-            planet.orbitXVSOP = x
-            y = []
-            y[:] = [planet.orbitYVSOP[i] - origin.orbitYVSOP[i]
-                    for i in range(0, len(origin.orbitYVSOP))]
-            planet.orbitYVSOP = y
-            z = []
-            z[:] = [planet.orbitZVSOP[i] - origin.orbitZVSOP[i]
-                    for i in range(0, len(origin.orbitZVSOP))]
-            planet.orbitZVSOP = z
-        if graphHorizon or not noHorizon:
-            x = []
-            x[:] = [planet.horizonX[i] - origin.horizonX[i]
-                    for i in range(0, len(origin.horizonX))]
-            planet.horizonX = x
-            y = []
-            y[:] = [planet.horizonY[i] - origin.horizonY[i]
-                    for i in range(0, len(origin.horizonY))]
-            planet.horizonY = y
-            z = []
-            z[:] = [planet.horizonZ[i] - origin.horizonZ[i]
-                    for i in range(0, len(origin.horizonZ))]
-            planet.horizonZ = z
+    frameTransform.centerOn(planets, origin)
 
 # Add each planet for graphing
 if graph:
@@ -303,9 +650,7 @@ if graph:
         if("Sch" in planet.method):
             # If graphing, add the points to a graphObject
             if graph:
-                points = {'X': planet.orbitXSchlyter,
-                          'Y': planet.orbitYSchlyter,
-                          'Z': planet.orbitZSchlyter}
+                points = planet.trajectories["Sch"].points()
                 graphObject = plotManager.createOrbitGraphObject(
                     planet.name, "Schlyter", planet.orbit_color, points)
                 graphs.append(graphObject)
@@ -314,53 +659,47 @@ if graph:
         if("VSO" in planet.method):
             # If graphing, add the points to a graphObject
             if graph:
-                points = {'X': planet.orbitXVSOP, 'Y': planet.orbitYVSOP,
-                          'Z': planet.orbitZVSOP}
+                points = planet.trajectories["VSO"].points()
                 graphObject = plotManager.createOrbitGraphObject(
                         planet.name, "VSOP87", planet.orbit_color, points)
                 graphs.append(graphObject)
 
         # If graphing, add the points to a graphObject
         if(graphHorizon):
-                points = {'X': planet.horizonX, 'Y': planet.horizonY,
-                          'Z': planet.horizonZ}
+                points = planet.trajectories["Hor"].points()
                 graphObject = plotManager.createOrbitGraphObject(
                     planet.name, "Horizon", planet.orbit_color, points)
                 graphs.append(graphObject)
 
 # Output difference file
 if not noDifference:
-    includeHorizon = not noHorizon or graphHorizon
     reporting.outputDifferenceFile(planets, outputFile, includeHorizon)
 
 # Add the sun, unless not requested
 if not noSun and graph:
     # If geocentric coordinates, the "Sun" is just the origin's coordinates
     if noGalileo:
-        if("Sch" in origin.method):
+        originPoints = frameTransform.heliocentric(origin)
+        if("Sch" in originMethods):
             # If graphing, add the points to a graphObject
             if graph:
-                points = {'X': origin.orbitXSchlyter,
-                          'Y': origin.orbitYSchlyter,
-                          'Z': origin.orbitZSchlyter}
+                points = originPoints["Sch"].points()
                 graphObject = plotManager.createOrbitGraphObject(
                     "Sun", "Schlyter", "#E9C300", points)
                 graphs.append(graphObject)
 
         # Add VSOP87 method
-        if("VSO" in origin.method):
+        if("VSO" in originMethods):
             # If graphing, add the points to a graphObject
             if graph:
-                points = {'X': origin.orbitXVSOP, 'Y': origin.orbitYVSOP,
-                          'Z': origin.orbitZVSOP}
+                points = originPoints["VSO"].points()
                 graphObject = plotManager.createOrbitGraphObject(
                         "Sun", "VSOP87", "#E9C300", points)
                 graphs.append(graphObject)
 
         # If graphing, add the points to a graphObject
         if(graphHorizon):
-                points = {'X': origin.horizonX, 'Y': origin.horizonY,
-                          'Z': origin.horizonZ}
+                points = originPoints["Hor"].points()
                 graphObject = plotManager.createOrbitGraphObject(
                     "Sun", "Horizon", "#E9C300", points)
                 graphs.append(graphObject)
@@ -374,4 +713,5 @@ if graph:
 
 # Finish timing
 if(masterTimer):
-    print("Total time taken: " + str(reporting.endTimer(timer)))
+    print("Total time taken: " + str(reporting.endTimer(timer, jobs > 1)))
+    print(keplerSolver.statisticsString())
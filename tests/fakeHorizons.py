@@ -0,0 +1,209 @@
+###############################
+# FileName: fakeHorizons.py
+#
+# Purpose: A stand-in for the Horizons telnet service, for testing
+#   horizonsConnection without a network. It walks through the same prompts
+#   as Horizons: every prompt for the first case of a connection, and the
+#   shorter "Use previous center" and "Accept previous output" prompts for
+#   each new case. The vectors are those of a circular orbit whose radius in
+#   AU is the planet's ID divided by 100, see vectors.
+###############################
+
+import os
+import sys
+import math
+import time
+import socket
+import threading
+import SocketServer
+import _strptime  # Imported before any thread calls strptime
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'ODModules'))
+import horizonsConnection as horiz
+
+# The prompts asked only by the first case of a connection, or by every case
+#   if the server is started with fullPrompts
+outputPrompts = ["Output reference frame [J2000, B1950] : ",
+                 "Corrections [ 1=NONE, 2=LT, 3=LT+S ]  : ",
+                 "Output units [1=KM-S, 2=AU-D, 3=KM-D] : ",
+                 "Spreadsheet CSV format    [ YES, NO ] : ",
+                 "Output delta-T (TDB-UT)   [ YES, NO ] : ",
+                 "Select output table type  [ 1-6, ?  ] : "]
+
+# A row of the table, as Horizons sends it in CSV format. The calendar date
+#   is not read, so it is always the same
+rowFormat = ("%.9f, A.D. 2000-Jan-01 00:00:00.0000, %.15E, %.15E, %.15E, " +
+             "%.15E, %.15E, %.15E,\r\n")
+
+
+###############################
+# vectors
+###############################
+# Returns the row the fake sends for a planet at a Julian date
+#
+# INPUT:
+#   planetID - String, i.e. "399"
+#   jd - float, Julian date
+# OUTPUT:
+#   tuple (jd, x, y, z, vx, vy, vz)
+def vectors(planetID, jd):
+    radius = int(planetID) / 100.0
+    speed = 1 / (365.25 * radius ** 1.5)
+    angle = (jd - horiz.epochJD) * speed
+    return (jd, radius * math.cos(angle), radius * math.sin(angle),
+            0.01 * radius, -radius * speed * math.sin(angle),
+            radius * speed * math.cos(angle), 0.0)
+
+
+###############################
+# parseStep
+###############################
+# Converts the output interval sent to Horizons, i.e. "6h", to days
+def parseStep(text):
+    units = {'m': 1 / 1440.0, 'h': 1 / 24.0, 'd': 1.0}
+    return float(text[:-1]) * units[text[-1]]
+
+
+class FakeHorizons(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
+
+    ########
+    # Values of FakeHorizons class
+    ########
+    #
+    # delay -> float, seconds to wait before sending each planet's vectors
+    # fullPrompts -> boolean, if True, every case asks every prompt
+    # dropAfter -> int, number of prompts to answer before closing the
+    #   connection, or None to never close it
+    # lock -> Lock, held while the counts are changed
+    # connections -> int, number of connections made
+    # cases -> list of dicts, the prompts and answers of each case
+    # active -> int, number of connections open now
+    # mostActive -> int, the most connections open at once
+    allow_reuse_address = True
+    daemon_threads = True
+
+    ################
+    # __init__
+    ################
+    # Listens on a free port of 127.0.0.1
+    def __init__(self, delay=0.0, fullPrompts=False, dropAfter=None):
+        SocketServer.TCPServer.__init__(self, ('127.0.0.1', 0), FakeSession)
+        self.delay = delay
+        self.fullPrompts = fullPrompts
+        self.dropAfter = dropAfter
+        self.lock = threading.Lock()
+        self.connections = 0
+        self.cases = []
+        self.active = 0
+        self.mostActive = 0
+
+    ################
+    # start
+    ################
+    # Serves in a background thread, and points horizonsConnection at the
+    #   fake
+    def start(self):
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        horiz.host, horiz.port = self.server_address
+
+    ################
+    # stop
+    ################
+    # Stops serving
+    def stop(self):
+        self.shutdown()
+        self.server_close()
+
+
+class FakeSession(SocketServer.StreamRequestHandler):
+
+    ################
+    # handle
+    ################
+    # Answers one connection, one case after another
+    def handle(self):
+        server = self.server
+        with server.lock:
+            server.connections += 1
+            server.active += 1
+            server.mostActive = max(server.mostActive, server.active)
+        self.asked = 0
+        try:
+            first = True
+            while self.runCase(first):
+                first = server.fullPrompts
+        except (socket.error, EOFError):
+            pass
+        finally:
+            with server.lock:
+                server.active -= 1
+
+    ################
+    # ask
+    ################
+    # Sends a prompt and returns the answer. Raises EOFError to close the
+    #   connection after dropAfter prompts
+    def ask(self, case, prompt):
+        if self.server.dropAfter is not None:
+            if self.asked >= self.server.dropAfter:
+                raise EOFError()
+        self.asked += 1
+        self.wfile.write("\r\n" + prompt)
+        self.wfile.flush()
+        answer = self.rfile.readline()
+        if not answer:
+            raise EOFError()
+        case['prompts'].append((prompt, answer.strip()))
+        return answer.strip()
+
+    ################
+    # runCase
+    ################
+    # Walks through the prompts of one planet and sends its vectors
+    #
+    # OUTPUT:
+    #   boolean, True if a new case was asked for
+    def runCase(self, first):
+        case = {'prompts': []}
+        planetID = self.ask(case, "Horizons> ")
+        self.ask(case, "Select ... [E]phemeris, [F]tp, [M]ail, [R]edisplay, " +
+                 "?, <cr>: ")
+        self.ask(case, "Observe, Elements, Vectors  [o,e,v,?] : ")
+        if first:
+            self.ask(case, "Coordinate center [ <id>,coord,geo  ] : ")
+            self.ask(case, "Confirm selected station    [ y/n ] --> ")
+            self.ask(case, "Reference plane [eclip, frame, body ] : ")
+        else:
+            self.ask(case, "Use previous center  [ cr=(y), n, ? ] : ")
+        start = self.ask(case, "Starting TDB [>=   9999BC-Mar-20 00:00] : ")
+        end = self.ask(case, "Ending   TDB [<=   9999-Dec-31 12:00] : ")
+        step = parseStep(self.ask(
+            case, "Output interval [ex: 10m, 1h, 1d, ? ] : "))
+        accept = self.ask(case, "Accept " +
+                          ("default" if first else "previous") +
+                          " output [ cr=(y), n, ?] : ")
+        if first or accept == 'n':
+            for prompt in outputPrompts:
+                self.ask(case, prompt)
+        with self.server.lock:
+            self.server.cases.append(case)
+
+        time.sleep(self.server.delay)
+        jdStart = horiz.dateToJD(datetime.strptime(start, "%Y-%b-%d %H:%M"))
+        jdEnd = horiz.dateToJD(datetime.strptime(end, "%Y-%b-%d %H:%M"))
+        count = int(math.floor((jdEnd - jdStart) / step + 1e-9)) + 1
+        rows = ["\r\n*******\r\nJDTDB, Calendar Date (TDB), X, Y, Z, VX, " +
+                "VY, VZ,\r\n$$SOE\r\n"]
+        for i in range(count):
+            rows.append(rowFormat % vectors(planetID, jdStart + i * step))
+        rows.append("$$EOE\r\n*******\r\n")
+        self.wfile.write("".join(rows))
+        self.wfile.flush()
+
+        again = self.ask(case, ">>> Select... [A]gain, [N]ew-case, [F]tp, " +
+                         "[K]ermit, [M]ail, [R]edisplay, ? : ")
+        return again.upper() == 'N'
@@ -0,0 +1,65 @@
+###############################
+# FileName: test_SchlyterCalc.py
+#
+# Purpose: Tests that SchlyterCalc.SchlyterPropagator, which calculates a
+#   block of days after the other, gives the same points as
+#   runSchlyterCalcBatch.
+###############################
+
+import os
+import sys
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'ODModules'))
+from planetDBInterface import PlanetDBInterface
+from planet import Planet
+import SchlyterCalc
+import keplerSolver
+
+
+class PropagatorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = PlanetDBInterface()
+        self.addCleanup(keplerSolver.resetStatistics)
+
+    ################
+    # assertSameAsBatch
+    ################
+    # Checks the propagated points of a planet against the batch
+    #   calculation, and returns the propagator
+    def assertSameAsBatch(self, name, days):
+        planet = Planet(name, 0000, self.db.getPlanet(name))
+        planet.setElementsDict(self.db)
+        planet.setSchlyterTerms(self.db)
+        expected = SchlyterCalc.runSchlyterCalcBatch(planet, days)
+
+        keplerSolver.resetStatistics()
+        propagator = SchlyterCalc.SchlyterPropagator(planet, days[0],
+                                                     days[1] - days[0])
+        points = propagator.propagate(len(days))
+        numpy.testing.assert_allclose(points, expected, rtol=0, atol=1e-8)
+        self.assertEqual(propagator.count, len(days))
+        self.assertEqual(keplerSolver.statistics['unconverged'], 0)
+        return propagator
+
+    def testManyBlocks(self):
+        # Mercury's mean anomaly moves by 2 radians in about 28 days
+        propagator = self.assertSameAsBatch('Mercury',
+                                            numpy.arange(0, 3000.0))
+        self.assertTrue(propagator.blockPoints < 100)
+
+    def testSlowPlanet(self):
+        self.assertSameAsBatch('Neptune', numpy.arange(-5000.0, 5000.0, 0.5))
+
+    def testFewerIterations(self):
+        self.assertSameAsBatch('Mars', numpy.arange(0, 10000.0))
+        self.assertTrue(keplerSolver.statistics['iterations'] <
+                        3 * keplerSolver.statistics['samples'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,59 @@
+###############################
+# FileName: test_adaptiveSampling.py
+#
+# Purpose: Tests the grids chosen by adaptiveSampling for slow and fast
+#   planets
+###############################
+
+import os
+import sys
+import unittest
+from datetime import datetime
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'ODModules'))
+from planetDBInterface import PlanetDBInterface
+from planet import Planet
+from timeGrid import TimeGrid
+import timeGrid
+import adaptiveSampling
+
+
+class AdaptGridTest(unittest.TestCase):
+
+    def setUp(self):
+        self.db = PlanetDBInterface()
+        self.grid = TimeGrid.fromDates(datetime(2016, 1, 1),
+                                       datetime(2017, 1, 1), 1.0)
+
+    ################
+    # adapt
+    ################
+    # Returns the grid chosen for a planet over the test's dates
+    def adapt(self, name, tolerance, minutes=False):
+        planet = Planet(name, 0000, self.db.getPlanet(name))
+        return adaptiveSampling.adaptGrid(planet, ["Sch", "VSO"], self.grid,
+                                          tolerance, self.db, minutes)
+
+    def testSlowPlanetCoversEnd(self):
+        grid = self.adapt("Neptune", 1e-3)
+        self.assertTrue(grid.step > 30)
+        self.assertAlmostEqual(grid.jds()[0], self.grid.jds()[0])
+        self.assertAlmostEqual(grid.jds()[-1], self.grid.jds()[-1])
+
+    def testFastPlanetCoversEnd(self):
+        grid = self.adapt("Mercury", 1e-6)
+        self.assertTrue(grid.step < 1)
+        self.assertAlmostEqual(grid.jds()[-1], self.grid.jds()[-1])
+
+    def testWholeMinutesForHorizons(self):
+        fine = self.adapt("Mercury", 1e-7)
+        grid = self.adapt("Mercury", 1e-7, True)
+        self.assertFalse(timeGrid.wholeMinutes(fine.step))
+        self.assertTrue(timeGrid.wholeMinutes(grid.step))
+        self.assertTrue(grid.step <= fine.step)
+        self.assertAlmostEqual(grid.jds()[-1], self.grid.jds()[-1])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,197 @@
+###############################
+# FileName: test_horizonsCache.py
+#
+# Purpose: Tests retrieving Horizons results with horizonsCache, in the
+#   background and from the saved results, against the fake Horizons
+#   service in fakeHorizons.py. The results are saved to a temporary
+#   folder.
+###############################
+
+import Queue
+import shutil
+import tempfile
+import unittest
+from datetime import datetime
+
+import numpy
+
+from fakeHorizons import vectors
+from test_horizonsConnection import HorizonsTestCase, Body, names
+import horizonsConnection as horiz
+import horizonsCache
+import trajectoryCache
+import pipeline
+
+
+class RetrievalTest(HorizonsTestCase):
+
+    def setUp(self):
+        settings = (trajectoryCache.directory, horizonsCache.offline)
+
+        def restore():
+            trajectoryCache.directory, horizonsCache.offline = settings
+        self.addCleanup(restore)
+        self.useFolder()
+
+        jdStart = horiz.dateToJD(datetime(2001, 1, 1))
+        self.jds = jdStart + numpy.arange(11.0)
+
+    ################
+    # useFolder
+    ################
+    # Saves the results to a new, empty temporary folder
+    def useFolder(self):
+        trajectoryCache.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, trajectoryCache.directory, True)
+
+    ################
+    # requests
+    ################
+    # Returns the requests for the given planets over the test's dates
+    def requests(self, planetNames):
+        return [(Body(name), self.jds) for name in planetNames]
+
+    ################
+    # fetchedSpans
+    ################
+    # Returns the first and last Julian date asked of Horizons by each case
+    def fetchedSpans(self, fake):
+        spans = []
+        for case in fake.cases:
+            answers = dict((prompt.split(' ')[0], answer)
+                           for prompt, answer in case['prompts'])
+            spans.append(tuple(
+                horiz.dateToJD(datetime.strptime(answers[prompt],
+                                                 "%Y-%b-%d %H:%M"))
+                for prompt in ('Starting', 'Ending')))
+        return spans
+
+    ################
+    # assertFresh
+    ################
+    # Checks that a trajectory holds the vectors Horizons sends for a planet
+    #   at the given dates
+    def assertFresh(self, trajectory, name, jds):
+        expected = numpy.array([vectors(horiz.planetIDs[name], jd)
+                                for jd in jds]).T
+        self.assertEqual(len(trajectory), len(jds))
+        numpy.testing.assert_allclose(trajectory.buffer[:, :len(trajectory)],
+                                      expected, rtol=1e-14, atol=1e-20)
+
+    def testSameAsRetrieveTrajectories(self):
+        self.startFake()
+        expected = horizonsCache.retrieveTrajectories(self.requests(names))
+
+        self.useFolder()
+        retrieval = horizonsCache.Retrieval(self.requests(names))
+        self.assertIsNotNone(retrieval.thread)
+        results = retrieval.join()
+
+        self.assertEqual(len(results), len(expected))
+        for (trajectory, seconds), (other, otherSeconds) in zip(results,
+                                                                 expected):
+            numpy.testing.assert_array_equal(
+                trajectory.buffer[:, :len(trajectory)],
+                other.buffer[:, :len(other)])
+
+    def testFailureRaisedByJoin(self):
+        fake = self.startFake()
+        address = fake.server_address
+        fake.stop()
+        horiz.host, horiz.port = address
+
+        # The failed session's exit is raised in the thread that joins
+        retrieval = horizonsCache.Retrieval(self.requests(['Earth']))
+        with self.assertRaises(SystemExit):
+            retrieval.join()
+
+    def testErrorRaisedByJoin(self):
+        self.startFake()
+        retrieval = horizonsCache.Retrieval(self.requests(['Earth', 'Pluto']))
+        with self.assertRaises(KeyError):
+            retrieval.join()
+
+    def testOfflineFailsAtOnce(self):
+        fake = self.startFake()
+        horizonsCache.offline = True
+        with self.assertRaises(SystemExit):
+            horizonsCache.Retrieval(self.requests(['Earth']))
+        self.assertEqual(fake.connections, 0)
+
+    def testOfflineReadsSaved(self):
+        fake = self.startFake()
+        expected = horizonsCache.Retrieval(self.requests(['Earth'])).join()
+
+        horizonsCache.offline = True
+        retrieval = horizonsCache.Retrieval(self.requests(['Earth']))
+        self.assertIsNone(retrieval.thread)
+        trajectory = retrieval.join()[0][0]
+        numpy.testing.assert_array_equal(trajectory.buffer,
+                                         expected[0][0].buffer)
+        self.assertEqual(fake.connections, 1)
+
+    def testPointsArriveInBlocks(self):
+        self.startFake()
+        grid = [self.jds[i:i + 3] for i in range(0, len(self.jds), 3)]
+
+        # Retrieved, and then read from the saved results
+        for fetched in (True, False):
+            arriving = Queue.Queue()
+            retrieval = horizonsCache.Retrieval(
+                [(Body('Earth'), self.jds, arriving.put)])
+            blocks = list(pipeline.arrivingBlocks(grid, arriving,
+                                                  retrieval.join))
+            trajectory = retrieval.join()[0][0]
+            self.assertEqual([len(block) for block in blocks], [3, 3, 3, 2])
+            numpy.testing.assert_array_equal(
+                numpy.concatenate([block.buffer for block in blocks], axis=1),
+                trajectory.buffer[:, :len(trajectory)])
+            self.assertIsNone(arriving.get_nowait())
+
+    def testArrivingEndsEarly(self):
+        self.startFake(dropAfter=1)
+        arriving = Queue.Queue()
+        retrieval = horizonsCache.Retrieval(
+            [(Body('Earth'), self.jds, arriving.put)])
+        with self.assertRaises(SystemExit):
+            list(pipeline.arrivingBlocks([self.jds], arriving,
+                                         retrieval.join))
+
+    def testSubRangeFromSaved(self):
+        fake = self.startFake()
+        horizonsCache.retrieveTrajectories([(Body('Mars'), self.jds)])
+
+        # Part of the saved dates, and every other one of them
+        for jds in (self.jds[2:8], self.jds[1::2]):
+            results = horizonsCache.retrieveTrajectories([(Body('Mars'), jds)])
+            self.assertFresh(results[0][0], 'Mars', jds)
+        self.assertEqual(len(fake.cases), 1)
+
+    def testOnlyMissingFetched(self):
+        fake = self.startFake()
+        horizonsCache.retrieveTrajectories([(Body('Mars'), self.jds[4:8])])
+
+        # Dates after the saved ones, then before them
+        for jds, span in ((self.jds[6:], (self.jds[8], self.jds[10])),
+                          (self.jds, (self.jds[0], self.jds[3]))):
+            results = horizonsCache.retrieveTrajectories([(Body('Mars'), jds)])
+            self.assertFresh(results[0][0], 'Mars', jds)
+            self.assertEqual(self.fetchedSpans(fake)[-1], span)
+        self.assertEqual(len(fake.cases), 3)
+
+        # Everything is now saved
+        results = horizonsCache.retrieveTrajectories([(Body('Mars'),
+                                                       self.jds)])
+        self.assertFresh(results[0][0], 'Mars', self.jds)
+        self.assertEqual(len(fake.cases), 3)
+
+    def testStepNotWholeMinutesExits(self):
+        # Horizons is asked for 2 minutes between points, not 1.5
+        self.startFake()
+        jds = self.jds[0] + numpy.arange(11.0) * 1.5 / 1440
+        with self.assertRaises(SystemExit):
+            horizonsCache.retrieveTrajectories([(Body('Earth'), jds)])
+
+
+if __name__ == '__main__':
+    unittest.main()
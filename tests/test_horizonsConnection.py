@@ -0,0 +1,228 @@
+###############################
+# FileName: test_horizonsConnection.py
+#
+# Purpose: Tests horizonsConnection against the fake Horizons service in
+#   fakeHorizons.py. Run from the repository with
+#       python -m unittest discover tests
+###############################
+
+import unittest
+from datetime import datetime
+
+import numpy
+
+from fakeHorizons import FakeHorizons, vectors
+import horizonsConnection as horiz
+import horizonsParser
+
+
+class Body(object):
+
+    ########
+    # Values of Body class
+    ########
+    #
+    # The only value of a planet object that horizonsConnection reads
+    #
+    # name -> String, name of the planet
+    __slots__ = ['name']
+
+    def __init__(self, name):
+        self.name = name
+
+
+# Planets used by the tests, and the dates retrieved
+names = ['Mercury', 'Venus', 'Earth', 'Mars', 'Jupiter']
+dateStart = datetime(2001, 1, 1)
+dateEnd = datetime(2001, 1, 11)
+
+
+###############################
+# expectedVectors
+###############################
+# Returns the rows the fake sends for a planet, one row of the trajectory
+#   buffer for each value
+def expectedVectors(name, interval=1.0):
+    jdStart = horiz.dateToJD(dateStart)
+    count = int(round((horiz.dateToJD(dateEnd) - jdStart) / interval)) + 1
+    rows = [vectors(horiz.planetIDs[name], jdStart + i * interval)
+            for i in range(count)]
+    return numpy.array(rows).T
+
+
+class HorizonsTestCase(unittest.TestCase):
+
+    ################
+    # startFake
+    ################
+    # Starts a fake service, and points horizonsConnection at it until the
+    #   test ends
+    def startFake(self, **options):
+        settings = (horiz.host, horiz.port, horiz.maxSessions, horiz.timeout)
+        fake = FakeHorizons(**options)
+        fake.start()
+        horiz.timeout = 10
+
+        def restore():
+            fake.stop()
+            horiz.host, horiz.port, horiz.maxSessions, horiz.timeout = \
+                settings
+        self.addCleanup(restore)
+        return fake
+
+    ################
+    # assertVectors
+    ################
+    # Checks that a trajectory holds the vectors the fake sent for a planet
+    def assertVectors(self, trajectory, name, interval=1.0):
+        expected = expectedVectors(name, interval)
+        self.assertEqual(len(trajectory), expected.shape[1])
+        numpy.testing.assert_allclose(trajectory.buffer[:, :len(trajectory)],
+                                      expected, rtol=1e-14, atol=1e-20)
+
+
+class FetchTrajectoriesTest(HorizonsTestCase):
+
+    def testResultsInOrder(self):
+        fake = self.startFake()
+        horiz.maxSessions = 2
+        requests = [(Body(name), dateStart, dateEnd, 1.0) for name in names]
+        results = horiz.fetchTrajectories(requests)
+
+        self.assertEqual(len(results), len(names))
+        for name, (trajectory, seconds) in zip(names, results):
+            self.assertVectors(trajectory, name)
+            self.assertTrue(trajectory.hasVelocity())
+            self.assertTrue(seconds >= 0)
+        self.assertEqual(len(fake.cases), len(names))
+
+    def testSessionLimit(self):
+        fake = self.startFake(delay=0.2)
+        horiz.maxSessions = 2
+        requests = [(Body(name), dateStart, dateEnd, 1.0) for name in names]
+        horiz.fetchTrajectories(requests)
+
+        # Each session is kept open for the next planet
+        self.assertEqual(fake.connections, 2)
+        self.assertEqual(fake.mostActive, 2)
+
+    def testOneSessionPerPlanet(self):
+        fake = self.startFake(delay=0.2)
+        horiz.maxSessions = 8
+        requests = [(Body(name), dateStart, dateEnd, 1.0) for name in names]
+        horiz.fetchTrajectories(requests)
+        self.assertEqual(fake.connections, len(names))
+
+    def testInterval(self):
+        self.startFake()
+        results = horiz.fetchTrajectories([(Body('Mars'), dateStart,
+                                            dateEnd, 0.25)])
+        self.assertVectors(results[0][0], 'Mars', 0.25)
+
+    def testSessionFailureExits(self):
+        # The connection closes after the planet is sent
+        self.startFake(dropAfter=1)
+        requests = [(Body(name), dateStart, dateEnd, 1.0) for name in names]
+        with self.assertRaises(SystemExit):
+            horiz.fetchTrajectories(requests)
+
+    def testNoServiceExits(self):
+        fake = self.startFake()
+        address = fake.server_address
+        fake.stop()
+        horiz.host, horiz.port = address
+        with self.assertRaises(SystemExit):
+            horiz.fetchTrajectories([(Body('Earth'), dateStart, dateEnd,
+                                      1.0)])
+
+    def testOtherErrorsRaised(self):
+        # A planet Horizons has no ID for is a mistake in the program, not a
+        #   failed session, so it is raised as it is
+        self.startFake()
+        requests = [(Body('Earth'), dateStart, dateEnd, 1.0),
+                    (Body('Pluto'), dateStart, dateEnd, 1.0)]
+        with self.assertRaises(KeyError):
+            horiz.fetchTrajectories(requests)
+
+
+class HorizonsSessionTest(HorizonsTestCase):
+
+    ################
+    # requestTwo
+    ################
+    # Retrieves Earth and Mars over a single session
+    def requestTwo(self):
+        session = horiz.HorizonsSession()
+        try:
+            earth = session.request(Body('Earth'), dateStart, dateEnd)
+            mars = session.request(Body('Mars'), dateStart, dateEnd, 0.5)
+        finally:
+            session.close()
+        self.assertVectors(earth, 'Earth')
+        self.assertVectors(mars, 'Mars', 0.5)
+        self.assertEqual(session.cases, 2)
+
+    ################
+    # answers
+    ################
+    # Returns the answer given to each prompt of a case, by the start of
+    #   the prompt
+    def answers(self, case):
+        return dict((prompt.split(' ')[0], answer)
+                    for prompt, answer in case['prompts'])
+
+    def testNewCase(self):
+        fake = self.startFake()
+        self.requestTwo()
+        self.assertEqual(fake.connections, 1)
+        first, second = fake.cases
+
+        # The first case asks for a new case once its vectors are read
+        self.assertEqual(self.answers(first)['>>>'], 'N')
+        self.assertEqual(self.answers(first)['Coordinate'], horiz.center)
+
+        # The new case keeps the previous center and output settings
+        answers = self.answers(second)
+        self.assertEqual(answers['Horizons>'], horiz.planetIDs['Mars'])
+        self.assertEqual(answers['Use'], 'y')
+        self.assertEqual(answers['Accept'], 'y')
+        self.assertEqual(answers['Output'], '12h')
+        self.assertNotIn('Coordinate', answers)
+        self.assertNotIn('Corrections', answers)
+
+    def testEveryPromptAgain(self):
+        # A service that asks every prompt for each case is answered in full
+        fake = self.startFake(fullPrompts=True)
+        self.requestTwo()
+        answers = self.answers(fake.cases[1])
+        self.assertEqual(answers['Coordinate'], horiz.center)
+        self.assertEqual(answers['Accept'], 'n')
+        self.assertEqual(answers['Corrections'], horiz.corrections)
+
+    def testConsumerBlocks(self):
+        self.startFake()
+        blockPoints = horizonsParser.blockPoints
+        self.addCleanup(setattr, horizonsParser, 'blockPoints', blockPoints)
+        horizonsParser.blockPoints = 4
+
+        # The 11 points are handed on as two full blocks and the rest
+        blocks = []
+        trajectory = horiz.fetchTrajectory(Body('Earth'), dateStart, dateEnd,
+                                           1.0, blocks.append)
+        self.assertEqual([len(block) for block in blocks], [4, 4, 3])
+        numpy.testing.assert_array_equal(
+            numpy.concatenate([block.buffer for block in blocks], axis=1),
+            trajectory.buffer[:, :len(trajectory)])
+
+    def testFailedSession(self):
+        # The connection closes after the first planet's vectors
+        self.startFake(dropAfter=16)
+        session = horiz.HorizonsSession()
+        self.addCleanup(session.close)
+        session.request(Body('Earth'), dateStart, dateEnd)
+        with self.assertRaises(horiz.HorizonsError):
+            session.request(Body('Mars'), dateStart, dateEnd)
+
+
+if __name__ == '__main__':
+    unittest.main()
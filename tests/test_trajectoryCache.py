@@ -0,0 +1,223 @@
+###############################
+# FileName: test_trajectoryCache.py
+#
+# Purpose: Tests saving trajectories with trajectoryCache, reading them back
+#   for the same or part of the saved dates, and extending them past the
+#   saved dates. The trajectories are calculated with VSOP87 and saved to a
+#   temporary folder.
+###############################
+
+import os
+import sys
+import glob
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.realpath(__file__)),
+                                '..', 'ODModules'))
+from planetDBInterface import PlanetDBInterface
+from planet import Planet
+from trajectory import Trajectory
+import trajectoryCache
+import VSOP87
+
+
+class Calculator(object):
+
+    ########
+    # Values of Calculator class
+    ########
+    #
+    # Calculates the VSOP87 points of a planet, and records the dates it was
+    #   asked for
+    #
+    # planet -> planet object to be used
+    # db -> PlanetDBInterface
+    # calculated -> list of arrays, the dates of each call
+    __slots__ = ['planet', 'db', 'calculated']
+
+    def __init__(self, name, db):
+        self.planet = Planet(name, 0000, db.getPlanet(name))
+        self.db = db
+        self.calculated = []
+
+    ################
+    # __call__
+    ################
+    # Returns a Trajectory of the planet's points at the given Julian dates
+    def __call__(self, jds):
+        jds = numpy.asarray(jds, dtype=float)
+        self.calculated.append(jds)
+        X, Y, Z = VSOP87.runVSOP87Batch(self.planet,
+                                        VSOP87.calculateJMillenia(jds),
+                                        self.db.cursor)
+        return Trajectory.fromArrays(jds, X, Y, Z)
+
+    ################
+    # calculatedDates
+    ################
+    # Returns every date calculated so far, in order
+    def calculatedDates(self):
+        if not self.calculated:
+            return numpy.array([])
+        return numpy.sort(numpy.concatenate(self.calculated))
+
+
+class CacheTestCase(unittest.TestCase):
+
+    def setUp(self):
+        settings = (trajectoryCache.directory, trajectoryCache.maxBytes)
+
+        def restore():
+            trajectoryCache.directory, trajectoryCache.maxBytes = settings
+        self.addCleanup(restore)
+        trajectoryCache.directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, trajectoryCache.directory, True)
+
+        self.db = PlanetDBInterface()
+        self.jds = 2451545.0 + numpy.arange(100.0)
+
+    ################
+    # calculateAndSave
+    ################
+    # Calculates and saves a planet's points at the given dates
+    def calculateAndSave(self, name, jds):
+        trajectory = Calculator(name, self.db)(jds)
+        trajectoryCache.saveTrajectory(name, "VSO", trajectory)
+        return trajectory
+
+    ################
+    # assertFresh
+    ################
+    # Checks that a trajectory holds the same points as a fresh calculation
+    #   at its dates
+    def assertFresh(self, trajectory, name, jds):
+        expected = Calculator(name, self.db)(jds)
+        self.assertEqual(len(trajectory), len(jds))
+        numpy.testing.assert_array_equal(trajectory.buffer[:4, :len(jds)],
+                                         expected.buffer[:, :len(jds)])
+
+    ################
+    # savedFiles
+    ################
+    # Returns the names of the saved files
+    def savedFiles(self):
+        return sorted(os.path.basename(path) for path in glob.glob(
+            os.path.join(trajectoryCache.directory, '*.npy')))
+
+
+class ReuseTest(CacheTestCase):
+
+    def testSameDates(self):
+        self.calculateAndSave('Earth', self.jds)
+        calculator = Calculator('Earth', self.db)
+        trajectory = trajectoryCache.loadTrajectory('Earth', "VSO", self.jds,
+                                                    '', calculator)
+        self.assertEqual(calculator.calculated, [])
+        self.assertFresh(trajectory, 'Earth', self.jds)
+
+    def testSubRange(self):
+        self.calculateAndSave('Earth', self.jds)
+
+        # Part of the saved dates, and every fifth of them
+        for jds in (self.jds[10:40], self.jds[3:90:5]):
+            trajectory = trajectoryCache.loadTrajectory('Earth', "VSO", jds)
+            self.assertFresh(trajectory, 'Earth', jds)
+
+    def testNotSaved(self):
+        self.calculateAndSave('Earth', self.jds)
+
+        # Another planet, a step between the saved dates, another variant,
+        #   and dates past the saved ones
+        self.assertIsNone(trajectoryCache.loadTrajectory('Mars', "VSO",
+                                                         self.jds))
+        self.assertIsNone(trajectoryCache.loadTrajectory(
+            'Earth', "VSO", self.jds[0] + 0.5 * numpy.arange(10.0)))
+        self.assertIsNone(trajectoryCache.loadTrajectory(
+            'Earth', "VSO", self.jds, 'ce'))
+        self.assertIsNone(trajectoryCache.loadTrajectory(
+            'Earth', "VSO", self.jds + 50))
+
+
+class ExtendTest(CacheTestCase):
+
+    ################
+    # extend
+    ################
+    # Saves Earth at the middle of the test's dates, then asks for the given
+    #   part of them. Checks that only the dates not saved are calculated,
+    #   and that the extended file replaces the saved one
+    def extend(self, jds):
+        self.calculateAndSave('Earth', self.jds[40:60])
+        calculator = Calculator('Earth', self.db)
+        trajectory = trajectoryCache.loadTrajectory('Earth', "VSO", jds, '',
+                                                    calculator)
+        self.assertFresh(trajectory, 'Earth', jds)
+
+        saved = self.jds[40:60]
+        missing = jds[(jds < saved[0]) | (jds > saved[-1])]
+        numpy.testing.assert_array_equal(calculator.calculatedDates(),
+                                         missing)
+        self.assertEqual(len(self.savedFiles()), 1)
+        return calculator
+
+    def testAfter(self):
+        self.extend(self.jds[45:80])
+
+    def testBefore(self):
+        self.extend(self.jds[20:50])
+
+    def testBothSides(self):
+        calculator = self.extend(self.jds[30:70])
+        self.assertEqual(len(calculator.calculated), 2)
+
+        # The extended file now serves the whole range
+        calculator = Calculator('Earth', self.db)
+        trajectory = trajectoryCache.loadTrajectory(
+            'Earth', "VSO", self.jds[30:70], '', calculator)
+        self.assertEqual(calculator.calculated, [])
+        self.assertFresh(trajectory, 'Earth', self.jds[30:70])
+
+    def testTooFar(self):
+        # Dates further from the saved ones than their own length are not
+        #   joined to them
+        self.calculateAndSave('Earth', self.jds[:10])
+        calculator = Calculator('Earth', self.db)
+        self.assertIsNone(trajectoryCache.loadTrajectory(
+            'Earth', "VSO", self.jds[80:90], '', calculator))
+        self.assertEqual(calculator.calculated, [])
+
+
+class EvictTest(CacheTestCase):
+
+    def testLeastRecentlyUsedRemoved(self):
+        trajectoryCache.maxBytes = 10 ** 9
+        for index, name in enumerate(['Mercury', 'Venus', 'Earth']):
+            self.calculateAndSave(name, self.jds)
+            path = glob.glob(os.path.join(trajectoryCache.directory,
+                                          name + '_*.npy'))[0]
+            os.utime(path, (1000 * index, 1000 * index))
+        size = os.path.getsize(path)
+
+        # Reading Mercury makes Venus the least recently used
+        trajectoryCache.loadTrajectory('Mercury', "VSO", self.jds)
+        trajectoryCache.maxBytes = 3 * size
+        self.calculateAndSave('Mars', self.jds)
+
+        names = [fileName.split('_')[0] for fileName in self.savedFiles()]
+        self.assertEqual(names, ['Earth', 'Mars', 'Mercury'])
+
+    def testSavedFileKept(self):
+        # The file just saved is kept, even if it is over the limit alone
+        trajectoryCache.maxBytes = 1
+        self.calculateAndSave('Earth', self.jds)
+        self.calculateAndSave('Mars', self.jds)
+        self.assertEqual(len(self.savedFiles()), 1)
+        self.assertTrue(self.savedFiles()[0].startswith('Mars_'))
+
+
+if __name__ == '__main__':
+    unittest.main()